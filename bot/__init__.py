@@ -1,6 +1,7 @@
 #! /usr/bin/python3
 # -*- coding: utf-8 -*-
 import contextlib
+import os
 
 from .func_helper.logger_config import logu, Now
 
@@ -49,6 +50,7 @@ db_is_docker = config.db_is_docker
 db_docker_name = config.db_docker_name
 db_backup_dir = config.db_backup_dir
 db_backup_maxcount = config.db_backup_maxcount
+db_backup_full_days = config.db_backup_full_days
 # 探针
 tz_ad = config.tz_ad
 tz_api = config.tz_api
@@ -63,6 +65,8 @@ moviepilot = config.moviepilot
 auto_update = config.auto_update
 api = config.api
 save_config()
+# 进程角色：bot 运行 Telegram 客户端（main.py）；web 是单独运行的接口进程（web.py），不连接 Telegram、不执行定时任务
+role = os.environ.get('EMBYBOSS_ROLE', 'bot')
 
 LOGGER.info("配置文件加载完毕")
 from pyrogram.types import BotCommand
@@ -139,4 +143,13 @@ bot = Client(bot_name, api_id=owner_api, api_hash=owner_hash, bot_token=bot_toke
              workers=300,
              max_concurrent_transmissions=1000, parse_mode=enums.ParseMode.MARKDOWN)
 
+# 统计更新数和 handler 耗时，须在注册任何 handler 之前
+from .func_helper.metrics import instrument_client
+
+instrument_client(bot)
+# 回调查询前缀分发表，先于各模块的 regex handler 执行
+from .func_helper.callback_router import router
+
+router.install(bot)
+
 LOGGER.info("Clinet 客户端准备")
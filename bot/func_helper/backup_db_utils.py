@@ -1,89 +1,171 @@
 import asyncio
 import glob
+import hashlib
+import json
 import os
+import shutil
 from datetime import datetime
 
 from bot import LOGGER
 
+# 单个分卷的大小上限，留出余量以低于 Telegram 2GB 的文件限制
+part_size = 1900 * 1024 * 1024
+chunk_size = 1024 * 1024
+# 备份文件名中时间戳的格式
+stamp_format = "%Y-%m-%d-%H-%M-%S"
+
 
 class BackupDBUtils:
 
     @staticmethod
-    # 数据库备份(mysql直装/本机含有mysql)
-    async def backup_mysql_db(host, port, user, password, database_name, backup_dir, max_backup_count):
-        # 如果文件夹不存在，就创建它
-        if not os.path.exists(backup_dir):
-            os.makedirs(backup_dir)
-        # 根据时间创建当前备份文件
-        backup_file = os.path.join(backup_dir, f'{database_name}-{datetime.now().strftime("%Y-%m-%d-%H-%M-%S")}.sql')
-        command = f"mysqldump -h{host} --no-tablespaces -P{port} -u{user} -p\'{password}\' {database_name} > {backup_file}"
-        skip_ssl_command = f"mysqldump -h{host} --skip-ssl --no-tablespaces -P{port} -u{user} -p\'{password}\' {database_name} > {backup_file}"
-        return_code = -1
+    def dump_args(database_name, host=None, port=None, user=None, skip_ssl=False, tables=None):
+        # 密码通过环境变量 MYSQL_PWD 传入，不出现在命令行和进程列表中
+        args = ['mysqldump', '--no-tablespaces', '--single-transaction']
+        if skip_ssl:
+            args.append('--skip-ssl')
+        if host:
+            args += [f'-h{host}', f'-P{port}']
+        return args + [f'-u{user}', database_name] + (tables or [])
+
+    @staticmethod
+    async def stream_dump(dump_cmd, password, backup_base):
+        """
+        mysqldump -> gzip（有 pigz 时用 pigz）两个进程用管道直接相连，不经过 shell；
+        压缩后的数据边读边算 sha256，并按 part_size 切成分卷。
+        分卷直接 cat 起来就是完整的 .sql.gz
+        :return: (文件列表, sha256)，失败返回 None
+        """
+        env = {**os.environ, 'MYSQL_PWD': password}
+        read_fd, write_fd = os.pipe()
         try:
-            process = await asyncio.create_subprocess_shell(command)
-            await process.communicate()
-            return_code = process.returncode
-            if return_code != 0:
-                LOGGER.warning(f"BOT数据库备份失败，使用 skip-ssl方式尝试备份")
-                process = await asyncio.create_subprocess_shell(skip_ssl_command)
-                await process.communicate()
-                return_code = process.returncode
-            if return_code != 0:
-                LOGGER.error(f"BOT数据库备份失败, error code: {return_code}")
-                return None
-            LOGGER.info(f"BOT数据库备份成功,文件保存为 {backup_file}")
-            # 获取所有备份文件，并且通过时间进行排序
-            all_backups = sorted(glob.glob(os.path.join(backup_dir, f'{database_name}-*.sql')))
-            # 如果超过了当前的备份最大数量，则删除最久的一个
-            while len(all_backups) > max_backup_count:
-                os.remove(all_backups[0])
-                all_backups.pop(0)
-        except Exception as e:
-            LOGGER.error(f"BOT数据库备份失败, error: {str(e)}")
+            dump = await asyncio.create_subprocess_exec(*dump_cmd, stdout=write_fd,
+                                                        stderr=asyncio.subprocess.PIPE, env=env)
+        finally:
+            os.close(write_fd)
+        try:
+            gzip = await asyncio.create_subprocess_exec(shutil.which('pigz') or 'gzip', '-c', stdin=read_fd,
+                                                        stdout=asyncio.subprocess.PIPE)
+        finally:
+            os.close(read_fd)
+
+        digest = hashlib.sha256()
+        parts = []
+        out = None
+        written = 0
+        try:
+            while True:
+                data = await gzip.stdout.read(chunk_size)
+                if not data:
+                    break
+                digest.update(data)
+                while data:
+                    if out is None or written >= part_size:
+                        if out is not None:
+                            out.close()
+                        parts.append(f'{backup_base}.sql.gz.part{len(parts) + 1:03d}')
+                        out = open(parts[-1], 'wb')
+                        written = 0
+                    n = min(len(data), part_size - written)
+                    out.write(data[:n])
+                    written += n
+                    data = data[n:]
+        finally:
+            if out is not None:
+                out.close()
+        _, err = await dump.communicate()
+        await gzip.wait()
+        if dump.returncode != 0 or gzip.returncode != 0:
+            LOGGER.error(f"BOT数据库备份失败, error code: {dump.returncode}/{gzip.returncode} {err.decode(errors='ignore')}")
+            for p in parts:
+                os.remove(p)
             return None
-        return backup_file
+        # 只有一个分卷时去掉分卷后缀
+        if len(parts) == 1:
+            os.replace(parts[0], f'{backup_base}.sql.gz')
+            parts = [f'{backup_base}.sql.gz']
+        with open(f'{backup_base}.sha256', 'w') as f:
+            f.write(f'{digest.hexdigest()}  {os.path.basename(backup_base)}.sql.gz\n')
+        return parts, digest.hexdigest()
+
+    @staticmethod
+    def load_manifests(backup_dir, database_name):
+        """
+        读取备份清单，按时间从旧到新
+        清单内容: stamp, type(full/incr), base(所依赖的全量备份 stamp), checksums, tables(本次导出的表), files, sha256
+        """
+        manifests = []
+        for path in sorted(glob.glob(os.path.join(backup_dir, f'{database_name}-*.manifest.json'))):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    manifests.append(json.load(f))
+            except Exception as e:
+                LOGGER.warning(f"读取备份清单 {path} 失败: {e}")
+        return manifests
+
+    @staticmethod
+    def rotate_backups(backup_dir, database_name, max_backup_count):
+        """
+        按时间戳把文件归为一次备份（分卷、校验文件、清单、旧的 .sql），超过 max_backup_count 次时删除最旧的，
+        但仍被保留的增量备份所依赖的全量备份不删
+        """
+        prefix = os.path.join(backup_dir, f'{database_name}-')
+        stamp_len = len(datetime.now().strftime(stamp_format))
+        backups = {}
+        for path in glob.glob(f'{prefix}*'):
+            backups.setdefault(path[len(prefix):len(prefix) + stamp_len], []).append(path)
+        base_of = {m['stamp']: m['base'] for m in BackupDBUtils.load_manifests(backup_dir, database_name)}
+        stamps = sorted(backups)
+        kept = stamps[-max_backup_count:] if max_backup_count else []
+        protected = {base_of.get(stamp, stamp) for stamp in kept}
+        for stamp in stamps[:len(stamps) - len(kept)]:
+            if stamp in protected:
+                continue
+            for path in backups[stamp]:
+                os.remove(path)
 
     @staticmethod
-    # 数据库备份(docker)
-    async def backup_mysql_db_docker(container_name, user, password, database_name, backup_dir, max_backup_count):
+    async def dump_with_retry(make_cmd, password, backup_dir, database_name, max_backup_count, manifest=None):
+        """
+        :param manifest: 传入时在备份成功后写入 {备份名}.manifest.json，自动补上 stamp/files/sha256
+        """
         # 如果文件夹不存在，就创建它
         if not os.path.exists(backup_dir):
             os.makedirs(backup_dir)
-        # 根据当前时间创建备份文件
-        backup_file_in_container = f'{database_name}-{datetime.now().strftime("%Y-%m-%d-%H-%M-%S")}.sql'
-        backup_file_on_host = os.path.join(backup_dir, backup_file_in_container)
-        # 进入容器，使用mysqldump备份文件
-        command = f'docker exec {container_name} sh -c "mysqldump  --no-tablespaces -u{user} -p\'{password}\' {database_name} > {backup_file_in_container}"'
-        skip_ssl_command = f'docker exec {container_name} sh -c "mysqldump --skip-ssl --no-tablespaces -u{user} -p\'{password}\' {database_name} > {backup_file_in_container}"'
-        return_code = -1
+        # 根据时间创建当前备份文件
+        stamp = datetime.now().strftime(stamp_format)
+        backup_base = os.path.join(backup_dir, f'{database_name}-{stamp}')
         try:
-            process = await asyncio.create_subprocess_shell(command)
-            await process.communicate()
-            return_code = process.returncode
-            if return_code != 0:
+            result = await BackupDBUtils.stream_dump(make_cmd(False), password, backup_base)
+            if result is None:
                 LOGGER.warning(f"BOT数据库备份失败，使用 skip-ssl方式尝试备份")
-                process = await asyncio.create_subprocess_shell(skip_ssl_command)
-                await process.communicate()
-                return_code = process.returncode
-            if return_code != 0:
-                LOGGER.error(f"BOT数据库备份失败, error code: {return_code}")
+                result = await BackupDBUtils.stream_dump(make_cmd(True), password, backup_base)
+            if result is None:
                 return None
-            # 将容器中的备份文件复制到本地
-            command = f'docker cp {container_name}:{backup_file_in_container} {backup_file_on_host}'
-            process = await asyncio.create_subprocess_shell(command)
-            await process.communicate()
+            LOGGER.info(f"BOT数据库备份成功,文件保存为 {result[0]} sha256: {result[1]}")
+            if manifest is not None:
+                manifest = {'base': stamp, **manifest, 'stamp': stamp,
+                            'files': [os.path.basename(p) for p in result[0]], 'sha256': result[1]}
+                with open(f'{backup_base}.manifest.json', 'w', encoding='utf-8') as f:
+                    json.dump(manifest, f, indent=2)
+            BackupDBUtils.rotate_backups(backup_dir, database_name, max_backup_count)
         except Exception as e:
             LOGGER.error(f"BOT数据库备份失败, error: {str(e)}")
-        finally:
-            # 删除容器中文件
-            command = f'docker exec {container_name} rm {backup_file_in_container}'
-            process = await asyncio.create_subprocess_shell(command)
-            await process.communicate()
-        LOGGER.info(f"BOT数据库备份成功,文件保存为 {backup_file_on_host}")
-        # 获取所有备份文件，并且通过时间进行排序
-        all_backups = sorted(glob.glob(os.path.join(backup_dir, f'{database_name}-*.sql')))
-        # 如果超过了当前的备份最大数量，则删除最久的一个
-        while len(all_backups) > max_backup_count:
-            os.remove(all_backups[0])
-            all_backups.pop(0)
-        return backup_file_on_host
+            return None
+        return result
+
+    @staticmethod
+    # 数据库备份(mysql直装/本机含有mysql)
+    async def backup_mysql_db(host, port, user, password, database_name, backup_dir, max_backup_count, tables=None,
+                              manifest=None):
+        return await BackupDBUtils.dump_with_retry(
+            lambda skip_ssl: BackupDBUtils.dump_args(database_name, host, port, user, skip_ssl, tables),
+            password, backup_dir, database_name, max_backup_count, manifest)
+
+    @staticmethod
+    # 数据库备份(docker)，直接读取容器内 mysqldump 的输出，不在容器里落盘
+    async def backup_mysql_db_docker(container_name, user, password, database_name, backup_dir, max_backup_count,
+                                     tables=None, manifest=None):
+        return await BackupDBUtils.dump_with_retry(
+            lambda skip_ssl: ['docker', 'exec', '-e', 'MYSQL_PWD', container_name] +
+                             BackupDBUtils.dump_args(database_name, user=user, skip_ssl=skip_ssl, tables=tables),
+            password, backup_dir, database_name, max_backup_count, manifest)
@@ -5,10 +5,13 @@ emby的api操作方法
 """
 from datetime import datetime, timedelta, timezone
 
-import requests as r
 from bot import emby_url, emby_api, emby_block, extra_emby_libs, LOGGER
 from bot.sql_helper.sql_emby import sql_update_emby, Emby
 from bot.func_helper.utils import pwd_create, convert_runtime, cache, Singleton
+from bot.func_helper.metrics import HttpClient
+
+# 与 requests 用法相同，额外按接口统计耗时和失败数
+r = HttpClient('emby')
 
 
 def create_policy(admin=False, disable=False, limit: int = 2, block: list = None):
@@ -438,6 +441,24 @@ class Embyservice(metaclass=Singleton):
         except Exception as e:
             return False, {'error': e}
 
+    async def emby_custom_query(self, sql, replace_user_id=False, timeout=60):
+        """
+        在 playback_reporting 插件上执行一条查询
+        :return: (True, results) / (False, message)
+        """
+        try:
+            _url = f'{self.url}/emby/user_usage_stats/submit_custom_query'
+            data = {"CustomQueryString": sql, "ReplaceUserId": replace_user_id}
+            resp = r.post(_url, headers=self.headers, json=data, timeout=timeout)
+            if resp.status_code != 204 and resp.status_code != 200:
+                return False, {'error': "🤕Emby 服务器连接失败!"}
+            ret = resp.json()
+            if len(ret["colums"]) == 0:
+                return False, ret["message"]
+            return True, ret["results"]
+        except Exception as e:
+            return False, {'error': e}
+
     # 找出 指定用户播放过的不同ip，设备
     async def get_emby_userip(self, user_id):
         sql = f"SELECT DeviceName,ClientName, RemoteAddress FROM PlaybackActivity " \
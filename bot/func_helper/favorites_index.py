@@ -0,0 +1,151 @@
+"""
+收藏的内存倒排索引：item_id -> 收藏了它的用户
+媒体 webhook 找"谁收藏了这些条目"时直接查内存，不再访问数据库。
+item_id、embyid 都是 32 位左右的字符串，统一驻留成一个 int，集合里只存这个 int，
+同一个字符串全局只保存一份。
+全量重建在线程里进行，期间事件循环里的增删记在日志中，替换后重放，重建过程中的变化不会丢
+"""
+import sys
+import threading
+import time
+
+from bot import LOGGER
+from bot.func_helper.metrics import registry
+
+
+class FavoritesIndex:
+    def __init__(self):
+        # 字符串 -> 驻留后的 int
+        self._ids = {}
+        # item -> {user}
+        self.items = {}
+        # user -> tg，未绑定 tg 的用户不在其中
+        self.user_tg = {}
+        self.built = False
+        self.built_at = 0.0
+        # 替换数据和增删都在锁内，读的一方不会看到替换了一半的数据
+        self._lock = threading.Lock()
+        # 重建期间的增删 [(方法名, 参数)]，不在重建时为 None
+        self._journal = None
+
+    def _intern(self, s: str) -> int:
+        i = self._ids.get(s)
+        if i is None:
+            i = self._ids[s] = len(self._ids)
+        return i
+
+    def begin(self):
+        """读取全表之前调用，之后的增删都会在 build 替换后重放"""
+        with self._lock:
+            self._journal = []
+
+    def abort(self):
+        """读取全表失败，不再记录日志"""
+        with self._lock:
+            self._journal = None
+
+    def build(self, rows):
+        """
+        用全表数据重建，须先调用 begin
+        :param rows: [(item_id, embyid, tg)]
+        """
+        # 先在局部变量里建好再整体替换，可以放在线程里执行，不影响事件循环里的查询
+        ids, items, user_tg = {}, {}, {}
+        for item_id, embyid, tg in rows:
+            user = ids.setdefault(embyid, len(ids))
+            items.setdefault(ids.setdefault(item_id, len(ids)), set()).add(user)
+            if tg:
+                user_tg[user] = tg
+        with self._lock:
+            self._ids, self.items, self.user_tg = ids, items, user_tg
+            self.built = True
+            self.built_at = time.monotonic()
+            # 读取全表之后才发生的变化不在 rows 里；之前的重放一遍也无妨，结果相同
+            for method, args in self._journal or ():
+                getattr(self, method)(*args)
+            replayed, self._journal = len(self._journal or ()), None
+        if replayed:
+            LOGGER.info(f"收藏索引重放了重建期间的 {replayed} 次变更")
+        info = self.info()
+        LOGGER.info(f"收藏索引已建立：{info['items']} 个条目，{info['pairs']} 条收藏，约 {info['bytes'] / 1024:.0f} KB")
+
+    def age(self) -> float:
+        """距上次全量重建的秒数"""
+        return time.monotonic() - self.built_at
+
+    def _apply(self, method: str, *args):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((method, args))
+            getattr(self, method)(*args)
+
+    def add(self, embyid: str, item_id: str):
+        self._apply('_add', embyid, item_id)
+
+    def _add(self, embyid: str, item_id: str):
+        if self.built:
+            self.items.setdefault(self._intern(item_id), set()).add(self._intern(embyid))
+
+    def discard(self, embyid: str, item_id: str):
+        self._apply('_discard', embyid, item_id)
+
+    def _discard(self, embyid: str, item_id: str):
+        if not self.built:
+            return
+        item, user = self._ids.get(item_id), self._ids.get(embyid)
+        users = self.items.get(item)
+        if users is not None:
+            users.discard(user)
+            if not users:
+                del self.items[item]
+
+    def clear_user(self, embyid: str):
+        """删除一个用户的全部收藏，少见操作，遍历即可"""
+        self._apply('_clear_user', embyid)
+
+    def _clear_user(self, embyid: str):
+        user = self._ids.get(embyid)
+        if not self.built or user is None:
+            return
+        for item in [i for i, users in self.items.items() if user in users]:
+            self.items[item].discard(user)
+            if not self.items[item]:
+                del self.items[item]
+        self.user_tg.pop(user, None)
+
+    def set_tg(self, embyid: str, tg):
+        self._apply('_set_tg', embyid, tg)
+
+    def _set_tg(self, embyid: str, tg):
+        if not self.built:
+            return
+        user = self._intern(embyid)
+        if tg:
+            self.user_tg[user] = tg
+        else:
+            self.user_tg.pop(user, None)
+
+    def fans(self, item_ids) -> list:
+        """:return: [(item_id, tg)]，只含已绑定 tg 的用户"""
+        result = []
+        with self._lock:
+            for item_id in item_ids:
+                for user in self.items.get(self._ids.get(item_id), ()):
+                    tg = self.user_tg.get(user)
+                    if tg:
+                        result.append((item_id, tg))
+        return result
+
+    def info(self) -> dict:
+        """条目数、收藏数和内存占用（字节，含驻留字符串、字典、集合本身）"""
+        with self._lock:
+            size = sys.getsizeof(self._ids) + sys.getsizeof(self.items) + sys.getsizeof(self.user_tg)
+            size += sum(sys.getsizeof(s) + sys.getsizeof(i) for s, i in self._ids.items())
+            size += sum(sys.getsizeof(users) for users in self.items.values())
+            size += sum(sys.getsizeof(tg) for tg in self.user_tg.values())
+            return {'items': len(self.items), 'users': len(self.user_tg),
+                    'pairs': sum(len(users) for users in self.items.values()), 'bytes': size}
+
+
+favorites_index = FavoritesIndex()
+registry.collector('bot_favorites_index_bytes', '收藏倒排索引的内存占用（估算）', lambda: favorites_index.info()['bytes'])
@@ -1,4 +1,4 @@
-from cacheout import Cache
+from bot.func_helper.metrics import MeteredCache
 from pykeyboard import InlineKeyboard, InlineButton
 from pyrogram.types import InlineKeyboardMarkup
 from pyromod.helpers import ikb, array_chunk
@@ -8,7 +8,7 @@ from bot.func_helper import nezha_res
 from bot.func_helper.emby import emby
 from bot.func_helper.utils import members_info
 
-cache = Cache()
+cache = MeteredCache('buttons')
 
 """start面板 ↓"""
 
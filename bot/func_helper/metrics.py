@@ -0,0 +1,354 @@
+"""
+进程内指标注册表，输出 Prometheus 文本格式（/metrics）
+不依赖 prometheus_client；计数器、仪表、直方图都按标签分桶保存在内存里，
+采集时才需要计算的值（队列深度、连接池占用等）用 collector 回调在输出时读取。
+此模块不 import bot，可以在 bot 初始化的任何阶段导入
+"""
+import inspect
+import re
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from cacheout import Cache
+
+# 默认直方图分桶（秒），覆盖从毫秒级的数据库查询到分钟级的定时任务
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+# 路径中的 id、数字统一替换，避免每个条目一个标签
+_id_pattern = re.compile(r'/(?:[0-9a-fA-F]{32}|[0-9a-fA-F-]{36}|\d+)(?=/|$)')
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _fmt_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _fmt_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self):
+        """:return: [(后缀, 标签元组, 值)]"""
+        with self._lock:
+            return [('', labels, value) for labels, value in self._values.items()]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets=default_buckets):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # 每个桶的计数（非累计）、总和、次数
+                counts = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[0][i] += 1
+                    break
+            counts[1] += value
+            counts[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        result = []
+        with self._lock:
+            for labels, (counts, total, n) in self._values.items():
+                acc = 0
+                for bound, c in zip(self.buckets, counts):
+                    acc += c
+                    result.append(('_bucket', labels + (('le', _fmt_value(bound)),), acc))
+                result.append(('_sum', labels, total))
+                result.append(('_count', labels, n))
+        return result
+
+
+class Collected(Metric):
+    """
+    输出时才调用 fn 取值
+    fn 返回数值，或 {标签元组: 值}，标签元组形如 (('job', 'x'),)
+    """
+
+    def __init__(self, name: str, help: str, kind: str, fn):
+        super().__init__(name, help)
+        self.kind = kind
+        self.fn = fn
+
+    def samples(self):
+        value = self.fn()
+        if isinstance(value, dict):
+            return [('', labels, v) for labels, v in value.items()]
+        return [('', (), value)] if value is not None else []
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        # 模块被重复导入时返回已有的指标
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help) -> Counter:
+        return self._add(Counter(name, help))
+
+    def gauge(self, name, help) -> Gauge:
+        return self._add(Gauge(name, help))
+
+    def histogram(self, name, help, buckets=default_buckets) -> Histogram:
+        return self._add(Histogram(name, help, buckets))
+
+    def collector(self, name, help, fn, kind='gauge'):
+        self._metrics[name] = Collected(name, help, kind, fn)
+
+    def collect(self, extra: tuple = ()) -> dict:
+        """
+        :param extra: 加到每个样本上的标签，如 (('worker', '123'),)
+        :return: {名称: [说明, 类型, [(后缀, 标签元组, 值)]]}，采集失败时说明为异常、类型为 None
+        """
+        families = {}
+        for metric in self._metrics.values():
+            try:
+                samples = [(suffix, labels + extra, value) for suffix, labels, value in metric.samples()]
+            except Exception as e:
+                families[metric.name] = [str(e), None, []]
+                continue
+            families[metric.name] = [metric.help, metric.kind, samples]
+        return families
+
+    def render(self, extra: tuple = (), others=()) -> str:
+        """
+        :param extra: 同 collect
+        :param others: 其他进程 collect() 的结果，同名指标合并到一起输出
+        """
+        families = self.collect(extra)
+        for other in others:
+            for name, (help, kind, samples) in other.items():
+                family = families.setdefault(name, [help, kind, []])
+                if family[1] is None:
+                    family[:2] = help, kind
+                family[2].extend(samples)
+        lines = []
+        for name, (help, kind, samples) in families.items():
+            if kind is None:
+                lines.append(f'# {name} 采集失败: {_escape(help)}')
+                continue
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for suffix, labels, value in samples:
+                lines.append(f'{name}{suffix}{_fmt_labels(labels)} {_fmt_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+tg_updates = registry.counter('bot_telegram_updates_total', 'Telegram 原始更新数，按类型')
+tg_handler_seconds = registry.histogram('bot_telegram_handler_seconds', 'Telegram handler 耗时')
+tg_handler_errors = registry.counter('bot_telegram_handler_errors_total', 'Telegram handler 抛出的异常数')
+http_seconds = registry.histogram('bot_http_request_seconds', '外部 HTTP 接口耗时，按服务和接口')
+http_errors = registry.counter('bot_http_request_errors_total', '外部 HTTP 接口失败数（异常或状态码 >= 400）')
+db_seconds = registry.histogram('bot_db_query_seconds', '数据库语句耗时，按语句类型')
+cache_hits = registry.counter('bot_cache_hits_total', '缓存命中数')
+cache_misses = registry.counter('bot_cache_misses_total', '缓存未命中数')
+job_seconds = registry.histogram('bot_sched_job_seconds', '定时任务耗时（含排队等待）')
+job_runs = registry.counter('bot_sched_job_runs_total', '定时任务运行次数，按结果')
+job_lag = registry.gauge('bot_sched_job_lag_seconds', '定时任务最近一次相对计划时间的滞后')
+
+
+def _count_error(name, e):
+    # StopPropagation / ContinuePropagation 是流程控制，不算错误
+    if type(e).__name__ not in ('StopPropagation', 'ContinuePropagation'):
+        tg_handler_errors.inc(handler=name)
+
+
+def timed(name, callback):
+    """
+    包装 handler 回调，保持同步 / 协程的类型不变，dispatcher 据此决定如何调用。
+    pyromod 的 handler 回调是协程 resolve_future_or_callback，里面再 await 真正的回调，耗时包含两者
+    """
+    if inspect.iscoroutinefunction(callback):
+        async def wrapper(client, *args):
+            start = time.perf_counter()
+            try:
+                return await callback(client, *args)
+            except Exception as e:
+                _count_error(name, e)
+                raise
+            finally:
+                tg_handler_seconds.observe(time.perf_counter() - start, handler=name)
+    else:
+        def wrapper(client, *args):
+            start = time.perf_counter()
+            try:
+                return callback(client, *args)
+            except Exception as e:
+                _count_error(name, e)
+                raise
+            finally:
+                tg_handler_seconds.observe(time.perf_counter() - start, handler=name)
+    return wrapper
+
+
+def instrument_client(client):
+    """
+    统计 pyrogram 客户端：每类更新的数量、每个 handler 的耗时。
+    需在注册 handler 之前调用，之后注册的 handler 回调都会被包装；
+    回调带 untimed 属性的不包装，由它自己分别计时（callback_router 按动作计时）
+    """
+    from pyrogram.handlers import RawUpdateHandler
+
+    dispatcher_add = client.dispatcher.add_handler
+
+    def add_handler(handler, group):
+        # pyromod 把真正的回调放在 original_callback，用它命名
+        func = getattr(handler, 'original_callback', None) or handler.callback
+        if getattr(func, 'untimed', False):
+            return dispatcher_add(handler, group)
+        name = f'{getattr(func, "__module__", "")}.{getattr(func, "__qualname__", repr(func))}'
+        handler.callback = timed(name, handler.callback)
+        return dispatcher_add(handler, group)
+
+    client.dispatcher.add_handler = add_handler
+
+    async def count_update(_, update, __, ___):
+        tg_updates.inc(type=type(update).__name__)
+
+    # 单独一个最靠前的组，不影响其他组的匹配
+    dispatcher_add(RawUpdateHandler(count_update), -1000)
+
+
+def instrument_engine(engine):
+    """SQLAlchemy：每条语句的耗时，以及连接池占用"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('metrics_start')
+        if starts:
+            db_seconds.observe(time.perf_counter() - starts.pop(), op=statement.lstrip().split(None, 1)[0].upper())
+
+    pool = engine.pool
+    if not hasattr(pool, 'checkedout'):
+        return
+    registry.collector('bot_db_pool_checked_out', '连接池中正在使用的连接数', pool.checkedout)
+    registry.collector('bot_db_pool_size', '连接池大小', pool.size)
+    registry.collector('bot_db_pool_overflow', '连接池溢出连接数（超出 pool_size 的部分）', pool.overflow)
+
+
+class HttpClient:
+    """
+    requests 的 get/post/delete 加上耗时统计，用法与 requests 模块相同
+    接口标签是去掉主机、把 id 替换成 {id} 之后的路径
+    """
+
+    def __init__(self, service: str):
+        self.service = service
+
+    def request(self, method, url, **kwargs):
+        import requests
+        endpoint = _id_pattern.sub('/{id}', urlsplit(url).path)
+        labels = dict(service=self.service, method=method.upper(), endpoint=endpoint)
+        start = time.perf_counter()
+        try:
+            resp = requests.request(method, url, **kwargs)
+        except Exception:
+            http_errors.inc(**labels)
+            raise
+        finally:
+            http_seconds.observe(time.perf_counter() - start, **labels)
+        if resp.status_code >= 400:
+            http_errors.inc(**labels)
+        return resp
+
+    def get(self, url, **kwargs):
+        return self.request('get', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('post', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('delete', url, **kwargs)
+
+
+_missing = object()
+
+
+class MeteredCache(Cache):
+    """统计命中率的 cacheout.Cache，memoize 也走 get，同样会被统计"""
+
+    def __init__(self, name: str, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.name = name
+
+    def get(self, key, default=None):
+        value = super().get(key, default=_missing)
+        if value is _missing:
+            cache_misses.inc(cache=self.name)
+            return default
+        cache_hits.inc(cache=self.name)
+        return value
+
+
+def _hit_ratio():
+    hits = {dict(k)['cache']: v for k, v in cache_hits.snapshot().items()}
+    misses = {dict(k)['cache']: v for k, v in cache_misses.snapshot().items()}
+    return {(('cache', name),): hits.get(name, 0) / (hits.get(name, 0) + misses.get(name, 0))
+            for name in hits.keys() | misses.keys()}
+
+
+registry.collector('bot_cache_hit_ratio', '缓存命中率（进程启动以来）', _hit_ratio)
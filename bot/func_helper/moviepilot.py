@@ -168,4 +168,24 @@ async def get_history_transfer_task_by_title_download_id(title, download_id, pag
             return None
     except Exception as e:
         LOGGER.error(f"MP 获取历史转移任务失败: {e}")
-        return None
\ No newline at end of file
+        return None
+
+
+async def get_history_transfer_status_map(page=1, count=100):
+    """
+    一次拉取最近的转移历史
+    :return: {download_hash: status}，请求失败返回 None
+    """
+    url = f"{mp.url}/api/v1/history/transfer?title=&page={page}&count={count}"
+    headers = {'Authorization': mp.access_token}
+    request = {'method': 'GET', 'url': url, 'headers': headers}
+    try:
+        result = await _do_request(request)
+        if result and result.get("success", False) and result.get("data", []):
+            return {item['download_hash']: item['status'] for item in result["data"]["list"]}
+        else:
+            LOGGER.error(f"MP 获取历史转移任务失败: {result}")
+            return None
+    except Exception as e:
+        LOGGER.error(f"MP 获取历史转移任务失败: {e}")
+        return None
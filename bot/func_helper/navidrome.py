@@ -6,7 +6,6 @@ import asyncio
 import hashlib
 import random
 import string
-from functools import wraps
 
 import aiohttp
 from aiohttp_retry import RetryClient, ExponentialRetry
@@ -33,28 +32,17 @@ def generate_token(password, salt):
     salted_password = password + salt
     return hashlib.md5(salted_password.encode('utf-8')).hexdigest()
 
-# --- AIOHTTP Retry Decorator ---
-def aiohttp_retry_for_navidrome(func):
-    """
-    Decorator to add retry logic to aiohttp requests for Navidrome.
-    """
-    @wraps(func)
-    async def wrapper(self, *args, **kwargs):
-        # self here is the NavidromeAPI instance
-        if not self.session or self.session.closed:
-            self.session = aiohttp.ClientSession()
-            LOGGER.info("NavidromeAPI: New aiohttp.ClientSession created.")
-
-        retry_options = ExponentialRetry(attempts=3, excepciones_ignorar=(aiohttp.ClientResponseError,))
-        retry_client = RetryClient(client_session=self.session, retry_options=retry_options)
-        
-        # Pass the retry_client to the decorated function if it expects it,
-        # or use it directly here if the function is part of the class.
-        # For this structure, we'll assume the method uses self.session which is now retry-enabled via context
-        async with retry_client: # Use the retry_client for the session context
-            return await func(self, *args, **kwargs)
-
-    return wrapper
+# --- Connection / Retry Settings ---
+# Each NavidromeAPI owns one long-lived session: TCP/TLS connections are kept alive and reused
+# across requests, and DNS lookups are cached, so repeated calls skip the connection setup.
+CONNECTION_LIMIT = 20  # Max concurrent connections to the Navidrome server
+KEEPALIVE_TIMEOUT = 60  # Seconds an idle connection stays in the pool
+DNS_CACHE_TTL = 300  # Seconds a resolved address is cached
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=30, connect=10)
+# Retry only transient failures, per request: connection errors (including a pooled keep-alive
+# connection the server has already closed), timeouts and 5xx responses. 4xx are returned at once.
+RETRY_OPTIONS = ExponentialRetry(attempts=3, start_timeout=0.5,
+                                 exceptions={aiohttp.ClientConnectionError, asyncio.TimeoutError})
 
 
 # --- Navidrome API Client Class ---
@@ -73,15 +61,22 @@ class NavidromeAPI:
         self.app_name = app_name
         self.api_version = api_version
         self.response_format = response_format
-        self.session = None # Initialized in methods or when first needed
+        self.session = None # Pooled session, created on first request
+        self.client = None # RetryClient wrapping self.session
         LOGGER.info(f"NavidromeAPI initialized for URL: {self.base_url}, User: {self.username}")
 
-    async def _get_session(self):
-        """Gets or creates an aiohttp ClientSession."""
+    def _get_client(self):
+        """
+        Gets the long-lived RetryClient, creating the pooled session on first use or after close_session().
+        The client is never used as a context manager: closing it would close the shared session.
+        """
         if self.session is None or self.session.closed:
-            self.session = aiohttp.ClientSession()
-            LOGGER.info("NavidromeAPI: New aiohttp.ClientSession created for instance.")
-        return self.session
+            connector = aiohttp.TCPConnector(limit=CONNECTION_LIMIT, keepalive_timeout=KEEPALIVE_TIMEOUT,
+                                             ttl_dns_cache=DNS_CACHE_TTL)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=REQUEST_TIMEOUT)
+            self.client = RetryClient(client_session=self.session, retry_options=RETRY_OPTIONS)
+            LOGGER.info("NavidromeAPI: New pooled aiohttp.ClientSession created.")
+        return self.client
 
     def _get_auth_params(self):
         """Generates authentication parameters (salt and token) for a request."""
@@ -91,7 +86,6 @@ class NavidromeAPI:
             return {}
         return {"s": salt, "t": token}
 
-    @aiohttp_retry_for_navidrome
     async def _make_request(self, endpoint, params=None, is_json_response=True):
         """
         Makes an asynchronous GET request to a Navidrome endpoint.
@@ -101,8 +95,8 @@ class NavidromeAPI:
         :param is_json_response: Whether to expect a JSON response.
         :return: Parsed JSON response as a dictionary, or raw content if not JSON.
         """
-        session = await self._get_session()
-        
+        client = self._get_client()
+
         url = f"{self.base_url}{endpoint}"
         
         base_params = {
@@ -120,7 +114,7 @@ class NavidromeAPI:
 
         try:
             LOGGER.debug(f"NavidromeAPI Request: GET {url} with params: {base_params}")
-            async with session.get(url, params=base_params) as response:
+            async with client.get(url, params=base_params) as response:
                 response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
                 if is_json_response:
                     # Check content type before parsing
@@ -141,7 +135,7 @@ class NavidromeAPI:
                     LOGGER.debug(f"NavidromeAPI Binary Response: {len(content)} bytes from {endpoint}")
                     return content
         except aiohttp.ClientResponseError as e: # Handles 4xx/5xx from raise_for_status
-            LOGGER.error(f"NavidromeAPI HTTP Error: {e.status} {e.message} for {url}. Response: {await response.text() if response else 'No response text'}")
+            LOGGER.error(f"NavidromeAPI HTTP Error: {e.status} {e.message} for {url}")
             return {"error": f"HTTP {e.status}: {e.message}", "status": "failed"}
         except aiohttp.ClientError as e: # Handles other client errors (connection, timeout, etc.)
             LOGGER.error(f"NavidromeAPI Client Error: {e} for {url}")
@@ -155,10 +149,10 @@ class NavidromeAPI:
         Pings the Navidrome server to check connectivity.
         Endpoint: /rest/ping.view
         """
-        LOGGER.info("Pinging Navidrome server...")
+        LOGGER.debug("Pinging Navidrome server...")  # Also called by /health/ready, keep it quiet
         response = await self._make_request("/rest/ping.view")
         if response and response.get("subsonic-response", {}).get("status") == "ok":
-            LOGGER.info("Navidrome ping successful.")
+            LOGGER.debug("Navidrome ping successful.")
             return response
         else:
             LOGGER.error(f"Navidrome ping failed. Response: {response}")
@@ -211,10 +205,11 @@ class NavidromeAPI:
         return image_bytes
 
     async def close_session(self):
-        """Closes the aiohttp ClientSession."""
-        if self.session and not self.session.closed:
-            await self.session.close()
+        """Closes the pooled session (and the RetryClient wrapping it)."""
+        if self.client and self.session and not self.session.closed:
+            await self.client.close()
             LOGGER.info("NavidromeAPI: aiohttp.ClientSession closed.")
+        self.session = self.client = None
 
 # --- Global Navidrome API Client Instance ---
 navidrome_api = None
@@ -285,6 +280,39 @@ async def main_test():
     await navidrome_api.close_session()
     LOGGER.info("--- Navidrome API Test Finished ---")
 
+async def bench_search3(query, rounds=20):
+    """
+    Latency of repeated search3 calls: once on the pooled session, and once with a fresh session
+    per call (what every request paid before). The first pooled call includes the TCP/TLS/DNS setup.
+    Usage: python3 -m bot.func_helper.navidrome bench "<query>" [rounds]
+    """
+    import statistics
+    import time
+
+    if not navidrome_api:
+        LOGGER.error("Navidrome API client not available for benchmark.")
+        return
+    rounds = max(rounds, 2)
+
+    async def timed():
+        start = time.perf_counter()
+        await navidrome_api.search3(query=query)
+        return (time.perf_counter() - start) * 1000
+
+    await navidrome_api.close_session()
+    pooled = [await timed() for _ in range(rounds)]
+    fresh = []
+    for _ in range(rounds):
+        await navidrome_api.close_session()
+        fresh.append(await timed())
+    await navidrome_api.close_session()
+    for name, samples in (("pooled session", pooled), ("new session per call", fresh)):
+        rest = sorted(samples[1:])
+        LOGGER.info(f"search3 x{rounds} {name}: first {samples[0]:.1f} ms, "
+                    f"median {statistics.median(rest):.1f} ms, p95 {rest[min(len(rest) - 1, int(len(rest) * 0.95))]:.1f} ms")
+    return pooled, fresh
+
+
 if __name__ == "__main__":
     # This is for direct script execution testing.
     # You'd need to ensure bot.py or equivalent has loaded config.
@@ -293,6 +321,7 @@ if __name__ == "__main__":
     
     # Configure logging for standalone testing
     import logging
+    import sys
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     # Assuming config is loaded by bot.py or a similar entry point.
     # If running this file directly, you might need to mock or manually load `bot.config`.
@@ -323,7 +352,10 @@ if __name__ == "__main__":
     # To run it: python -m bot.func_helper.navidrome
     # (This might require adjustments to PYTHONPATH or how `bot.config` is accessed)
     
-    LOGGER.info("To test this module directly, ensure bot.config is populated and uncomment asyncio.run(main_test()) call with appropriate setup.")
-    # Example:
-    # asyncio.run(main_test()) # Make sure config is loaded before this.
-    pass
+    # Run from the project root so that config.json is found:
+    #   python3 -m bot.func_helper.navidrome                      -> main_test()
+    #   python3 -m bot.func_helper.navidrome bench "<query>" [n]  -> bench_search3()
+    if len(sys.argv) > 2 and sys.argv[1] == "bench":
+        asyncio.run(bench_search3(sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 20))
+    else:
+        asyncio.run(main_test())
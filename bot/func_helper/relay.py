@@ -0,0 +1,101 @@
+"""
+web 接口里需要 Telegram 客户端的操作（通知用户、发群消息）
+接口和 bot 在同一进程时直接调用客户端；api.standalone 时接口在单独的进程里，
+操作写入数据库发件箱（bot_outbox），由 bot 进程的 consume() 轮询取出执行。
+多实例部署时只有定时任务主节点执行发件箱，每条消息只发一次
+"""
+import asyncio
+
+from pyrogram.errors import FloodWait
+
+from bot import LOGGER, bot, role
+from bot.func_helper.metrics import registry
+from bot.func_helper.scheduler import scheduler
+from bot.sql_helper.sql_outbox import sql_add_outbox, sql_get_outbox, sql_delete_outbox, sql_retry_outbox
+
+# 发件箱空闲时的轮询间隔（秒）
+poll_interval = 1
+# 每轮最多取出的条数
+batch_size = 100
+# 失败后 retry_base * 2^(已失败次数) 秒再试，最长 retry_max 秒
+retry_base = 10
+retry_max = 3600
+# 失败这么多次后放弃（用户屏蔽了 bot 等），按上面的退避约两小时
+max_attempts = 10
+
+stats = {'relayed': 0, 'sent': 0, 'failed': 0, 'dropped': 0}
+
+
+async def _send_message(chat_id, text, forward_to=None):
+    out = await bot.send_message(chat_id, text)
+    if forward_to:
+        await out.forward(forward_to)
+
+
+actions = {'send_message': _send_message}
+
+
+async def send_message(chat_id, text: str, forward_to=None):
+    """
+    发送消息，forward_to 不为空时再把这条消息转发给该用户。
+    单独运行的接口进程里只是写入发件箱，失败时抛出异常，与直接发送失败一样由调用方处理
+    """
+    if role != 'web':
+        return await _send_message(chat_id, text, forward_to)
+    payload = {'chat_id': chat_id, 'text': text, 'forward_to': forward_to}
+    if not await asyncio.to_thread(sql_add_outbox, 'send_message', payload):
+        raise RuntimeError('写入发件箱失败')
+    stats['relayed'] += 1
+
+
+async def drain() -> int:
+    """执行一批发件箱中的操作，:return: 取出的条数"""
+    rows = await asyncio.to_thread(sql_get_outbox, batch_size)
+    done, retry = [], []
+    flood = 0
+    for i, action, payload, attempts in rows:
+        func = actions.get(action)
+        try:
+            if func is None:
+                raise ValueError(f'未知的操作 {action}')
+            await func(**payload)
+            stats['sent'] += 1
+            done.append(i)
+        except FloodWait as e:
+            # 被 Telegram 限流：本条和后面的都没执行，不算失败，等够时间再从本条继续
+            flood = e.value
+            LOGGER.warning(f"发件箱 {i} {action} 被限流，暂停 {flood} 秒")
+            break
+        except Exception as e:
+            stats['failed'] += 1
+            if attempts + 1 >= max_attempts or func is None:
+                stats['dropped'] += 1
+                LOGGER.error(f"发件箱 {i} {action} 失败 {attempts + 1} 次，放弃: {e}")
+                done.append(i)
+            else:
+                LOGGER.warning(f"发件箱 {i} {action} 失败，稍后重试: {e}")
+                retry.append(i)
+    await asyncio.to_thread(sql_delete_outbox, done)
+    await asyncio.to_thread(sql_retry_outbox, retry, retry_base, retry_max)
+    if flood:
+        await asyncio.sleep(flood)
+    return len(rows)
+
+
+async def consume():
+    """bot 进程中常驻，客户端连上、且本实例是定时任务主节点时执行发件箱，热备实例只等待"""
+    LOGGER.info("【API服务】接口单独运行，bot 进程执行接口转来的消息")
+    while True:
+        n = 0
+        if bot.is_connected and scheduler.is_leader:
+            try:
+                n = await drain()
+            except Exception as e:
+                LOGGER.error(f"执行发件箱出错 {e}")
+        # 取满一批说明还有积压，不等待
+        if n < batch_size:
+            await asyncio.sleep(poll_interval)
+
+
+registry.collector('bot_relay_messages_total', '通过发件箱转发的消息数，按阶段',
+                   lambda: {(('stage', k),): v for k, v in stats.items()}, kind='counter')
@@ -1,40 +1,408 @@
 import asyncio
+import os
+import socket
+import sys
+from collections import defaultdict, deque
+from datetime import datetime, timedelta, timezone as tz
+
+from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_EXECUTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED, \
+    EVENT_JOB_MAX_INSTANCES
+from apscheduler.executors.asyncio import AsyncIOExecutor
+from apscheduler.executors.base_py3 import run_coroutine_job
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from bot import LOGGER
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.util import iscoroutinefunction_partial
+from bot import LOGGER, role
 from bot.func_helper.utils import Singleton
+from bot.func_helper.metrics import job_seconds, job_runs, job_lag
+from bot.sql_helper import engine
+from bot.sql_helper.sql_sched import sql_add_sched_run, sql_start_sched_run, sql_finish_sched_run, \
+    sql_mark_interrupted_runs, sql_prune_sched_runs, sql_get_sched_runs
+from bot.sql_helper.sql_leader import sql_acquire_lease, sql_release_lease, sql_get_lease
+
+# 每个任务的策略，未列出的使用 job_defaults。
+# coalesce 把错过的多次运行合并成一次；max_instances=1 保证慢任务不会叠加；
+# misfire_grace_time 是重启后仍会补跑的时间窗口（秒）；
+# jitter 让 cron 任务在整点后随机推迟最多 jitter 秒，避开 Emby 自身的计划任务和彼此的整点碰撞；
+# executor='heavy' 的任务属于同一互斥组，依次运行，不会同时压在 Emby 和数据库上；
+# window=(起, 止) 表示可以挪到这段时间（小时，左闭右开）里 Emby 最空闲的一个小时，见 plan_quiet_slots
+job_policies = {
+    'check_expired': {'misfire_grace_time': 6 * 3600, 'jitter': 600, 'executor': 'heavy', 'window': (0, 6)},
+    'check_low_activity': {'misfire_grace_time': 6 * 3600, 'jitter': 600, 'executor': 'heavy', 'window': (6, 11)},
+    'backup_db': {'misfire_grace_time': 6 * 3600, 'jitter': 600, 'executor': 'heavy', 'window': (0, 6)},
+    'user_day_plays': {'misfire_grace_time': 3600, 'jitter': 120, 'executor': 'heavy'},
+    'user_week_plays': {'misfire_grace_time': 3600, 'jitter': 120, 'executor': 'heavy'},
+    'day_ranks': {'misfire_grace_time': 3600, 'jitter': 120, 'executor': 'heavy'},
+    'week_ranks': {'misfire_grace_time': 3600, 'jitter': 120, 'executor': 'heavy'},
+    'update_bot': {'misfire_grace_time': 3600, 'jitter': 300},
+    'sync_playback': {'misfire_grace_time': 300},
+    # local 的任务维护本进程的状态，每个实例都要运行，不跟随主节点租约
+    'rebuild_favorites_index': {'misfire_grace_time': 300, 'local': True},
+    # 每分钟轮询，错过了等下一轮即可，不必持久化
+    'sync_download_tasks': {'misfire_grace_time': 30, 'jobstore': 'memory'},
+}
+job_defaults = {'coalesce': True, 'max_instances': 1}
+# 每个任务在内存中保留的最近运行次数
+stats_size = 50
+# 主节点租约：多实例部署时只有持有者运行定时任务，其余实例暂停调度器热备（local 任务照常运行）。
+# 每 lease_ttl/3 秒续期一次，主节点失联 lease_ttl 秒后由其他实例接管
+lease_name = 'scheduler'
+lease_ttl = 30
+# add_job 中除这些以外的参数都属于触发器
+job_options = {'args', 'kwargs', 'id', 'name', 'misfire_grace_time', 'coalesce', 'max_instances', 'next_run_time',
+               'jobstore', 'executor', 'replace_existing'}
+# 只供本模块使用的策略项，不传给 APScheduler
+policy_only = {'window', 'local'}
+# 挑选空闲时段时参考最近几天的播放量
+quiet_days = 7
+
+
+class ExclusiveExecutor(AsyncIOExecutor):
+    """
+    同一个执行器里的协程任务排队依次运行。
+    拿到锁真正开始时调用 on_start(job_id, run_times)，排队等待的时间计入滞后而不是耗时；
+    等待超过 misfire_grace_time 的会记为 missed。
+    沿用了 AsyncIOExecutor 的内部属性（_eventloop、_pending_futures），requirements 固定了 APScheduler 3.10，
+    升级前要对照新版本的 AsyncIOExecutor 检查
+    """
+
+    def __init__(self, on_start=None):
+        super().__init__()
+        self._on_start = on_start
+
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+        self._exclusive = asyncio.Lock()
+
+    def _do_submit_job(self, job, run_times):
+        if not iscoroutinefunction_partial(job.func):
+            return super()._do_submit_job(job, run_times)
+
+        async def exclusive():
+            async with self._exclusive:
+                if self._on_start:
+                    self._on_start(job.id, run_times)
+                return await run_coroutine_job(job, job._jobstore_alias, run_times, self._logger.name)
+
+        def callback(f):
+            self._pending_futures.discard(f)
+            try:
+                events = f.result()
+            except BaseException:
+                self._run_job_error(job.id, *sys.exc_info()[1:])
+            else:
+                self._run_job_success(job.id, events)
+
+        f = self._eventloop.create_task(exclusive())
+        f.add_done_callback(callback)
+        self._pending_futures.add(f)
+
+
+def quiet_hour(load: dict, window, current=None):
+    """
+    window 内播放量最少的小时；并列时优先保留当前的小时，其次取最早的
+    :param load: {小时: 播放次数}
+    """
+    hours = [h % 24 for h in range(window[0], window[1] if window[1] > window[0] else window[1] + 24)]
+    return min(hours, key=lambda h: (load.get(h, 0), h != current, hours.index(h)))
 
 
 class Scheduler(metaclass=Singleton):
     def __init__(self, timezone='Asia/Shanghai', misfire_grace_time=60, event_loop=None):
-        # 创建一个AsyncIOScheduler对象，并传入时区、容忍度和事件循环参数
-        self.SCHEDULER = AsyncIOScheduler(timezone=timezone, misfire_grace_time=misfire_grace_time, max_instances=5,
-                                          event_loop=event_loop or asyncio.get_event_loop())
-        # 启动调度器
-        self.SCHEDULER.start()
+        # 任务持久化在bot数据库中，重启后错过的运行会在 misfire_grace_time 内补跑
+        event_loop = event_loop or asyncio.get_event_loop()
+        self.SCHEDULER = AsyncIOScheduler(jobstores={'default': SQLAlchemyJobStore(engine=engine),
+                                                     'memory': MemoryJobStore()},
+                                          executors={'default': AsyncIOExecutor(),
+                                                     'heavy': ExclusiveExecutor(on_start=self._on_job_started)},
+                                          job_defaults={**job_defaults, 'misfire_grace_time': misfire_grace_time},
+                                          timezone=timezone,
+                                          event_loop=event_loop)
+        # 本进程的任务，不持久化，也不随主节点租约暂停
+        self.LOCAL = AsyncIOScheduler(jobstores={'default': MemoryJobStore()},
+                                      executors={'default': AsyncIOExecutor()},
+                                      job_defaults={**job_defaults, 'misfire_grace_time': misfire_grace_time},
+                                      timezone=timezone,
+                                      event_loop=event_loop)
+        self._loop = event_loop
+        # (job_id, 计划时间) -> (写入运行记录的任务，结果为记录id, 开始时间)
+        self._runs = {}
+        # 尚未完成的运行记录写入，保留引用以免被回收
+        self._writes = set()
+        # job_id -> 最近运行的环形缓冲区
+        self.stats = defaultdict(lambda: deque(maxlen=stats_size))
+        # 最近一次按负载挑出的时段 job_id -> 小时
+        self.quiet_hours = {}
+        self.holder = f'{socket.gethostname()}-{os.getpid()}'
+        if role == 'web':
+            # 单独运行的接口进程不竞争主节点，也不启动调度器，各模块注册的任务都由 bot 进程执行
+            self.is_leader = False
+            self._heartbeat_task = None
+            return
+        self.is_leader = sql_acquire_lease(lease_name, self.holder, lease_ttl)
+        if self.is_leader:
+            self._on_promoted()
+        else:
+            LOGGER.info(f"定时任务由其他实例执行，本实例 {self.holder} 热备")
+        self._load_stats()
+        for sched in (self.SCHEDULER, self.LOCAL):
+            sched.add_listener(self._on_job_event, EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR |
+                               EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES)
+        # 启动调度器，非主节点先暂停
+        self.SCHEDULER.start(paused=not self.is_leader)
+        self.LOCAL.start()
+        self._heartbeat_task = event_loop.create_task(self._heartbeat())
+        self.LOCAL.add_job(sql_prune_sched_runs, 'cron', hour=4, minute=0, id='prune_sched_runs')
+        # 启动后等各模块注册完任务再挑一次，之后每天在所有窗口开始前重新挑
+        self.LOCAL.add_job(self.plan_quiet_slots, 'cron', hour=23, minute=40, id='plan_quiet_slots',
+                           next_run_time=datetime.now(self.LOCAL.timezone) + timedelta(minutes=2))
         # 设置日志级别为INFO
         # logging.basicConfig(level=logging.INFO)
 
+    def _on_promoted(self):
+        # 只有主节点运行任务，上一任留下的 running 记录才能确定是中断了
+        n = sql_mark_interrupted_runs()
+        if n:
+            LOGGER.warning(f"上次退出时有 {n} 个定时任务未运行完毕，已标记为 interrupted")
+        LOGGER.info(f"本实例 {self.holder} 成为定时任务主节点")
+
+    async def _heartbeat(self):
+        """续期租约；得到租约时恢复调度器，失去时暂停"""
+        while True:
+            await asyncio.sleep(lease_ttl / 3)
+            held = await asyncio.to_thread(sql_acquire_lease, lease_name, self.holder, lease_ttl)
+            if held and not self.is_leader:
+                self.is_leader = True
+                self._on_promoted()
+                self.SCHEDULER.resume()
+                # 持久化任务的时段由主节点挑选，接管后马上挑一次
+                self.LOCAL.modify_job('plan_quiet_slots', next_run_time=datetime.now(self.LOCAL.timezone))
+            elif not held and self.is_leader:
+                # 已在运行的任务不会被打断，只是不再触发新的
+                self.is_leader = False
+                self.SCHEDULER.pause()
+                LOGGER.warning(f"本实例 {self.holder} 失去定时任务主节点租约，暂停调度")
+
+    def leader_info(self) -> str:
+        lease = sql_get_lease(lease_name)
+        if lease is None:
+            return '🗳 主节点：无'
+        return f"🗳 主节点：`{lease.holder}`{'（本实例）' if self.is_leader else ''}"
+
+    def _write(self, func, *args, after=None, **kwargs):
+        """
+        在线程里写运行记录，监听器在事件循环中被调用，不能等数据库。
+        after 为先要完成的写入任务，其结果（记录id）作为 func 的第一个参数
+        """
+
+        async def write():
+            if after is None:
+                return await asyncio.to_thread(func, *args, **kwargs)
+            run_id = await after
+            if run_id is not None:
+                return await asyncio.to_thread(func, run_id, *args, **kwargs)
+
+        task = self._loop.create_task(write())
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+        return task
+
+    def _on_job_started(self, job_id, run_times):
+        """排队的任务真正开始运行，把提交时记下的开始时间改为现在"""
+        now = datetime.now()
+        for run_time in run_times:
+            run, _ = self._runs.get((job_id, run_time), (None, None))
+            if run is not None:
+                self._runs[(job_id, run_time)] = (run, now)
+                self._write(sql_start_sched_run, now, after=run)
+
+    def _on_job_event(self, event):
+        """
+        记录每次运行：相对计划时间的滞后、耗时、处理条数、异常。
+        任务返回 int 时视为本次处理的条数。
+        """
+        now = datetime.now()
+        if event.code == EVENT_JOB_SUBMITTED:
+            for run_time in event.scheduled_run_times:
+                run = self._write(sql_add_sched_run, event.job_id, run_time.replace(tzinfo=None), now)
+                self._runs[(event.job_id, run_time)] = (run, now)
+            return
+        if event.code == EVENT_JOB_MAX_INSTANCES:
+            # 上一次还没跑完，本次跳过
+            for run_time in event.scheduled_run_times:
+                self._write(sql_add_sched_run, event.job_id, run_time.replace(tzinfo=None), now, outcome='skipped')
+                self._record(event.job_id, run_time.replace(tzinfo=None), now, now, 'skipped')
+                job_runs.inc(job=event.job_id, outcome='skipped')
+            return LOGGER.warning(f"定时任务 {event.job_id} 上一次运行尚未结束，跳过本次")
+        scheduled = event.scheduled_run_time.replace(tzinfo=None)
+        if event.code == EVENT_JOB_MISSED:
+            # 排队时已提交的运行，等待过久后记为 missed
+            run, _ = self._runs.pop((event.job_id, event.scheduled_run_time), (None, None))
+            if run is not None:
+                self._write(sql_finish_sched_run, 'missed', None, None, now, after=run)
+            else:
+                self._write(sql_add_sched_run, event.job_id, scheduled, now, outcome='missed')
+            self._record(event.job_id, scheduled, now, now, 'missed')
+            job_runs.inc(job=event.job_id, outcome='missed')
+            return LOGGER.warning(f"定时任务 {event.job_id} 错过了 {event.scheduled_run_time}，超出补跑窗口")
+
+        run, started = self._runs.pop((event.job_id, event.scheduled_run_time), (None, now))
+        outcome = 'error' if event.exception else 'success'
+        error = repr(event.exception) if event.exception else None
+        items = event.retval if isinstance(event.retval, int) and not isinstance(event.retval, bool) else None
+        if run is not None:
+            self._write(sql_finish_sched_run, outcome, error, items, now, after=run)
+        self._record(event.job_id, scheduled, started, now, outcome, items, error)
+        job_runs.inc(job=event.job_id, outcome=outcome)
+        job_seconds.observe((now - started).total_seconds(), job=event.job_id)
+        job_lag.set((started - scheduled).total_seconds(), job=event.job_id)
+        if event.exception:
+            LOGGER.error(f"定时任务 {event.job_id} 运行出错: {error}")
+
+    def _record(self, job_id, scheduled, started, ended, outcome, items=None, error=None):
+        self.stats[job_id].append({
+            'scheduled': scheduled, 'started': started, 'outcome': outcome, 'items': items, 'error': error,
+            'lag': (started - scheduled).total_seconds() if scheduled else 0,
+            'duration': (ended - started).total_seconds() if ended else 0,
+        })
+
+    def _load_stats(self):
+        """用数据库中最近的记录预热环形缓冲区，重启后面板仍能看到历史"""
+        for r in reversed(sql_get_sched_runs(limit=stats_size * 10)):
+            if r.outcome in ('running', 'interrupted') or r.started_at is None:
+                continue
+            self._record(r.job_id, r.scheduled_at, r.started_at, r.ended_at, r.outcome, r.items, r.error)
+
+    def report(self, recent: int = 10) -> str:
+        """
+        每个任务一行：最近一次的结果、耗时、滞后、处理条数，以及近 recent 次的平均耗时。
+        最近一次比平均慢 20% 以上标记 📈，用于观察随用户增长变慢的任务
+        """
+        text = ''
+        for job_id, runs in sorted(self.stats.items()):
+            if not runs:
+                continue
+            last = runs[-1]
+            done = [r['duration'] for r in list(runs)[-recent:] if r['outcome'] == 'success']
+            avg = sum(done) / len(done) if done else 0
+            icon = {'success': '✅', 'error': '❌', 'missed': '⏭️', 'skipped': '⏸️'}.get(last['outcome'], '❔')
+            trend = ' 📈' if last['outcome'] == 'success' and len(done) > 1 and last['duration'] > avg * 1.2 else ''
+            items = f" | {last['items']} 条" if last['items'] is not None else ''
+            errors = sum(1 for r in runs if r['outcome'] == 'error')
+            text += f"{icon} `{job_id}` {last['started'].strftime('%m-%d %H:%M')}\n" \
+                    f"    耗时 {last['duration']:.1f}s | 滞后 {last['lag']:.1f}s{items}\n" \
+                    f"    近{len(done)}次均值 {avg:.1f}s{trend} | 失败 {errors}/{len(runs)}\n"
+        return text
+
+    async def hourly_load(self):
+        """
+        最近 quiet_days 天每个小时（北京时间）的播放次数，作为 Emby 负载的参考
+        :return: {小时: 次数}，查询失败返回 None
+        """
+        from bot.func_helper.emby import emby
+        since = (datetime.now(tz(timedelta(hours=8))) - timedelta(days=quiet_days)).strftime("%Y-%m-%d %H:%M:%S")
+        success, result = await emby.emby_custom_query(
+            "SELECT strftime('%H', DateCreated) AS h, COUNT(1) FROM PlaybackActivity "
+            f"WHERE DateCreated >= '{since}' GROUP BY h", replace_user_id=False, timeout=60)
+        if not success:
+            # 没有数据时插件只返回 message
+            return None if isinstance(result, dict) else {}
+        return {int(h): int(c) for h, c in result}
+
+    async def plan_quiet_slots(self):
+        """
+        把带 window 策略的 cron 任务的下一次运行挪到窗口内最近几天播放最少的小时，分钟、星期和 jitter 不变。
+        只改下一次运行时间，不改持久化的触发器：重启时 add_job 认得出是同一个任务，保留挪过的时间照常补跑；
+        运行过后触发器按原配置算出下一次，由本任务每天再挪。持久化的任务是各实例共用的，只由主节点挑选
+        """
+        if not self.is_leader:
+            return
+        load = await self.hourly_load()
+        if load is None:
+            return LOGGER.warning("获取 Emby 播放负载失败，定时任务保持原时段")
+        now = datetime.now(self.SCHEDULER.timezone)
+        moved = 0
+        for job_id, policy in job_policies.items():
+            job = self.SCHEDULER.get_job(job_id)
+            if 'window' not in policy or job is None or job.next_run_time is None or \
+                    not isinstance(job.trigger, CronTrigger):
+                continue
+            current = job.next_run_time.hour
+            hour = quiet_hour(load, policy['window'], current)
+            self.quiet_hours[job_id] = hour
+            if hour == current:
+                continue
+            # 在下一次运行所在的那个窗口里找新的时间，不会挪到已经运行过的窗口或跳过一天
+            span = timedelta(hours=(policy['window'][1] - policy['window'][0]) % 24 or 24)
+            fields = {f.name: str(f) for f in job.trigger.fields if not f.is_default}
+            quiet = CronTrigger(**{**fields, 'hour': hour}, timezone=job.trigger.timezone, jitter=job.trigger.jitter)
+            run_time = quiet.get_next_fire_time(None, max(now, job.next_run_time - span))
+            if run_time is None or abs(run_time - job.next_run_time) >= span:
+                continue
+            job.modify(next_run_time=run_time)
+            LOGGER.info(f"定时任务 {job_id} 下一次运行挪到空闲时段 {run_time}（原 {current} 点）")
+            moved += 1
+        return moved
+
     # 函数、触发器、
     def add_job(self, func, trigger, **kwargs):
         # 调用调度器的add_job方法，添加定时任务
+        # 持久化的任务如果触发器没变，则保留库中的下次运行时间，这样重启期间错过的运行可以补跑
+        if role == 'web':
+            return
         try:
-            self.SCHEDULER.add_job(func, trigger, **kwargs)
+            job_id = kwargs.get('id')
+            if job_policies.get(job_id, {}).get('local'):
+                kwargs = {k: v for k, v in {**job_policies[job_id], **kwargs}.items() if k not in policy_only}
+                self.LOCAL.add_job(func, trigger, replace_existing=True, **kwargs)
+                return LOGGER.info(f"Added a local job: {func.__name__} with {trigger} trigger.")
+            kwargs = {k: v for k, v in {**job_policies.get(job_id, {}), **kwargs}.items() if k not in policy_only}
+            job = self.SCHEDULER.get_job(job_id) if job_id else None
+            if job is not None:
+                trigger_args = {k: v for k, v in kwargs.items() if k not in job_options}
+                new_trigger = self.SCHEDULER._create_trigger(trigger, trigger_args)
+                # str(trigger) 不包含 jitter，单独比较
+                if str(job.trigger) == str(new_trigger) and job.func == func and \
+                        getattr(job.trigger, 'jitter', None) == getattr(new_trigger, 'jitter', None):
+                    changes = {k: kwargs[k] for k in ('misfire_grace_time', 'coalesce', 'max_instances', 'executor')
+                               if k in kwargs}
+                    if changes:
+                        job.modify(**changes)
+                    LOGGER.info(f"Kept a job: {job_id}, next run at {job.next_run_time}.")
+                    return
+            self.SCHEDULER.add_job(func, trigger, replace_existing=True, **kwargs)
             LOGGER.info(f"Added a job: {func.__name__} with {trigger} trigger and {kwargs} arguments.")
         except Exception as e:
             LOGGER.error(f"Failed to add a job: {e}")
 
+    def get_job(self, job_id):
+        return self.SCHEDULER.get_job(job_id) or self.LOCAL.get_job(job_id)
+
     def remove_job(self, job_id=None, jobstore=None):
         # 调用调度器的remove_job方法，移除一个定时任务
         try:
+            if job_policies.get(job_id, {}).get('local'):
+                return self.LOCAL.remove_job(job_id)
+            if jobstore is None and job_id in job_policies:
+                jobstore = job_policies[job_id].get('jobstore')
             self.SCHEDULER.remove_job(job_id, jobstore)
             LOGGER.info(f"Removed a job: {job_id} from {jobstore}.")
         except Exception as e:
             LOGGER.error(f"Failed to remove a job: {e}")
 
     def shutdown(self):
-        # 调用调度器的shutdown方法，关闭调度器
+        # 调用调度器的shutdown方法，关闭调度器，并让出主节点
         try:
+            if self._heartbeat_task is None:
+                return
+            self._heartbeat_task.cancel()
             self.SCHEDULER.shutdown()
+            self.LOCAL.shutdown()
+            if self.is_leader:
+                sql_release_lease(lease_name, self.holder)
+                self.is_leader = False
             LOGGER.info("Shutdown the scheduler successfully.")
         except Exception as e:
             LOGGER.error(f"Failed to shutdown the scheduler: {e}")
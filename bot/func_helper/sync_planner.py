@@ -0,0 +1,88 @@
+"""
+sync_planner - 群组/账户同步的集合差分
+
+群成员与数据库账户先转成哈希集合，一次线性扫描算出 删号 / 恢复 / 踢出 三份名单（原先是 list 里 in，O(N·M)），
+执行时 emby 与 telegram 调用用信号量限制并发，数据库写入由调用方合并成批量操作。
+"""
+import asyncio
+
+from pyrogram.errors import FloodWait
+
+from bot import LOGGER
+
+
+class SyncPlan:
+    """
+    to_delete: 有账户但不在群里的 Emby 记录
+    to_restore: 有账户且在群里的 Emby 记录
+    to_kick: 在群里但没有账户的 tg id
+    """
+
+    def __init__(self):
+        self.to_delete = []
+        self.to_restore = []
+        self.to_kick = []
+
+    def report(self, title: str, *parts: str) -> str:
+        """
+        预演模式的文字报告
+        :param parts: 'delete' / 'restore' / 'kick' 中需要展示的部分
+        """
+        text = f'**▎{title}（预演，未执行）**\n\n'
+        if 'delete' in parts:
+            text += f'· 待删除 | {len(self.to_delete)}\n'
+            text += ''.join(f'{n}. #id{i.tg} - [{i.name}](tg://user?id={i.tg})\n'
+                            for n, i in enumerate(self.to_delete, 1))
+        if 'restore' in parts:
+            text += f'· 可恢复 | {len(self.to_restore)}\n'
+            text += ''.join(f'{n}. #id{i.tg} - [{i.name}](tg://user?id={i.tg})\n'
+                            for n, i in enumerate(self.to_restore, 1))
+        if 'kick' in parts:
+            text += f'· 待踢出 | {len(self.to_kick)}\n'
+            text += ''.join(f'{n}. `{tg}`\n' for n, tg in enumerate(self.to_kick, 1))
+        return text
+
+
+def plan_sync(members, accounts) -> SyncPlan:
+    """
+    :param members: 群成员 tg id 的可迭代对象
+    :param accounts: 数据库 Emby 记录
+    :return: SyncPlan
+    """
+    member_set = set(members)
+    account_set = set()
+    plan = SyncPlan()
+    for a in accounts:
+        account_set.add(a.tg)
+        if a.tg in member_set:
+            plan.to_restore.append(a)
+        else:
+            plan.to_delete.append(a)
+    plan.to_kick = [m for m in member_set if m not in account_set]
+    return plan
+
+
+async def run_bounded(func, items, limit: int = 8) -> list:
+    """
+    以最多 limit 个并发执行 func(item)
+    :return: [(item, result)]，异常时 result 为 False
+    """
+    sem = asyncio.Semaphore(limit)
+
+    async def one(item):
+        async with sem:
+            try:
+                return item, await func(item)
+            except FloodWait as f:
+                LOGGER.warning(str(f))
+                await asyncio.sleep(f.value * 1.2)
+                try:
+                    return item, await func(item)
+                except Exception as e:
+                    LOGGER.error(e)
+                    return item, False
+            except Exception as e:
+                LOGGER.error(e)
+                return item, False
+
+    return await asyncio.gather(*(one(i) for i in items))
@@ -3,9 +3,9 @@ import pytz
 from bot import bot, _open, save_config, owner, admins, bot_name, ranks, schedall, group
 from bot.sql_helper.sql_code import sql_add_code
 from bot.sql_helper.sql_emby import sql_get_emby
-from cacheout import Cache
+from bot.func_helper.metrics import MeteredCache
 
-cache = Cache()
+cache = MeteredCache('utils')
 
 
 def judge_admins(uid):
@@ -70,8 +70,8 @@ def tem_adduser():
     save_config()
 
 
-def tem_deluser():
-    _open.tem = _open.tem - 1
+def tem_deluser(n: int = 1):
+    _open.tem = _open.tem - n
     save_config()
 
 
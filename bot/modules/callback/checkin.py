@@ -2,15 +2,14 @@ import asyncio
 import random
 from datetime import datetime, timezone, timedelta
 
-from pyrogram import filters
-
-from bot import bot, _open, sakura_b
+from bot import _open, sakura_b
+from bot.func_helper.callback_router import router
 from bot.func_helper.filters import user_in_group_on_filter
 from bot.func_helper.msg_utils import callAnswer, sendMessage, deleteMessage
 from bot.sql_helper.sql_emby import sql_get_emby, sql_update_emby, Emby
 
 
-@bot.on_callback_query(filters.regex('checkin') & user_in_group_on_filter)
+@router.on('checkin', user_in_group_on_filter)
 async def user_in_checkin(_, call):
     now = datetime.now(timezone(timedelta(hours=8)))
     today = now.strftime("%Y-%m-%d")
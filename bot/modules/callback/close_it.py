@@ -1,14 +1,13 @@
 #! /usr/bin/python3
-from pyrogram import filters
 from pyrogram.enums import ChatType
 
-from bot import bot
+from bot.func_helper.callback_router import router
 from bot.func_helper.msg_utils import callAnswer, deleteMessage
 from bot.func_helper.utils import judge_admins
 
 
 # 使用装饰器语法来定义回调函数，并传递 client 和 call 参数
-@bot.on_callback_query(filters.regex('closeit'))
+@router.on('closeit')
 async def close_it(_, call):
     if call.message.chat.type is ChatType.PRIVATE:
         await deleteMessage(call)
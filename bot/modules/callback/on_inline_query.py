@@ -5,6 +5,7 @@ on_inline_query -
 """
 import asyncio
 
+from bot.func_helper.metrics import MeteredCache
 from pyrogram import filters
 
 from bot import bot, ranks, bot_photo, bot_name
@@ -17,6 +18,76 @@ from pyrogram.errors import BadRequest
 from bot.func_helper.msg_utils import callAnswer
 
 
+# 服务端缓存构建好的结果页，key = (规范化的关键词, offset)。
+# 媒体库内容与用户无关，所以所有人共享；is_personal=True 使得 telegram 侧的 cache_time 对他人无效
+inline_cache = MeteredCache('inline_query', maxsize=1024, ttl=300)
+# 防抖：每个用户只保留最后一次按键的 query id
+debounce_delay = 0.4
+_latest_query = {}
+# 同一页正在构建时，后来者等待同一个结果，不重复请求emby
+_building = {}
+
+
+def _normalize(query: str) -> str:
+    return ' '.join(query.split()).lower()
+
+
+async def _is_latest(inline_query: InlineQuery) -> bool:
+    """等待 debounce_delay，期间该用户若有新的查询，则本次作废"""
+    uid = inline_query.from_user.id
+    _latest_query[uid] = inline_query.id
+    await asyncio.sleep(debounce_delay)
+    if _latest_query.get(uid) != inline_query.id:
+        return False
+    _latest_query.pop(uid, None)
+    return True
+
+
+async def _build_page(key):
+    if key in _building:
+        return await asyncio.shield(_building[key])
+    task = asyncio.create_task(_build_results(*key))
+    _building[key] = task
+    try:
+        results = await task
+    finally:
+        _building.pop(key, None)
+    # 空结果也缓存，但时间短一些，避免新入库的资源迟迟搜不到
+    inline_cache.set(key, results, ttl=None if results else 30)
+    return results
+
+
+async def _build_results(name: str, offset: int) -> list:
+    ret_movies = await emby.get_movies(title=name, start=offset)
+    if not ret_movies:
+        return []
+    results = []
+    for i in ret_movies:
+        typer = ['movie', '🎬'] if i['item_type'] == 'Movie' else ['tv', '📺']
+        result = InlineQueryResultArticle(
+            title=f"{typer[1]} {i['title']} ({i['year']})",
+            # id=str(uuid.uuid4()),
+            description=f"{i['taglines']}-{i['overview']}",
+            input_message_content=InputTextMessageContent(
+                f"**{typer[1]}《{i['title']}》 [ ]({i['photo']})**\n\n"
+                f"🧫**年份** | {i['year']}\n"
+                f"🌐**地区** | {i['od']}\n"
+                f"💠**类型** | {i['genres']}\n"
+                f"⏱️**时长** | {i['runtime']}\n"
+                # f"·**发行商:** {i['studios']}\n"
+                f"**🧬加入日期** | {i['add']}\n\n"
+                f"**{i['taglines']}**\n"
+                f"{i['overview']}", disable_web_page_preview=False),
+            reply_markup=InlineKeyboardMarkup(
+                [[InlineKeyboardButton(text=f'🍿 TMDB',
+                                       url=f'https://www.themoviedb.org/{typer[0]}/{i["tmdbid"]}'),
+                  InlineKeyboardButton(text=f'点击收藏 💘', callback_data=f'favorited:{i["item_id"]}')]]),
+            # url=f't.me/{bot_name}?start=itemid-{i["item_id"]}')]]),
+            thumb_url=i['photo'], thumb_width=220, thumb_height=330)
+        results.append(result)
+    return results
+
+
 @bot.on_inline_query(user_in_group_on_filter)
 async def find_sth_media(_, inline_query: InlineQuery):
     try:
@@ -51,8 +122,14 @@ async def find_sth_media(_, inline_query: InlineQuery):
             # print(inline_query)
             Name = inline_query.query
             inline_count = 0 if not inline_query.offset else int(inline_query.offset)
-            ret_movies = await emby.get_movies(title=Name, start=inline_count)
-            if not ret_movies:
+            key = (_normalize(Name), inline_count)
+            results = inline_cache.get(key)
+            if results is None:
+                # 仍在输入时丢弃被后续按键取代的查询，只有最后一次按键去请求emby
+                if not await _is_latest(inline_query):
+                    return
+                results = await _build_page(key)
+            if not results:
                 results = [InlineQueryResultArticle(
                     title=f"{ranks.logo}",
                     description=f"没有更多信息 {Name}",
@@ -64,30 +141,6 @@ async def find_sth_media(_, inline_query: InlineQuery):
                                           is_personal=True,
                                           switch_pm_parameter='start')
             else:
-                results = []
-                for i in ret_movies:
-                    typer = ['movie', '🎬'] if i['item_type'] == 'Movie' else ['tv', '📺']
-                    result = InlineQueryResultArticle(
-                        title=f"{typer[1]} {i['title']} ({i['year']})",
-                        # id=str(uuid.uuid4()),
-                        description=f"{i['taglines']}-{i['overview']}",
-                        input_message_content=InputTextMessageContent(
-                            f"**{typer[1]}《{i['title']}》 [ ]({i['photo']})**\n\n"
-                            f"🧫**年份** | {i['year']}\n"
-                            f"🌐**地区** | {i['od']}\n"
-                            f"💠**类型** | {i['genres']}\n"
-                            f"⏱️**时长** | {i['runtime']}\n"
-                            # f"·**发行商:** {i['studios']}\n"
-                            f"**🧬加入日期** | {i['add']}\n\n"
-                            f"**{i['taglines']}**\n"
-                            f"{i['overview']}", disable_web_page_preview=False),
-                        reply_markup=InlineKeyboardMarkup(
-                            [[InlineKeyboardButton(text=f'🍿 TMDB',
-                                                   url=f'https://www.themoviedb.org/{typer[0]}/{i["tmdbid"]}'),
-                              InlineKeyboardButton(text=f'点击收藏 💘', callback_data=f'favorited:{i["item_id"]}')]]),
-                        # url=f't.me/{bot_name}?start=itemid-{i["item_id"]}')]]),
-                        thumb_url=i['photo'], thumb_width=220, thumb_height=330)
-                    results.append(result)
                 await inline_query.answer(results=results, cache_time=300, switch_pm_text='查看结果（最多20条）',
                                           is_personal=True,
                                           next_offset='10' if not inline_query.offset else '',
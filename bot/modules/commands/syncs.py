@@ -1,7 +1,7 @@
 """
 Syncs 功能
 
-1.sync——groupm 群组成员同步任务，遍历数据库中等级 b 账户，tgapi检测是否仍在群组，否->封禁
+1.sync——groupm 群组成员同步任务，遍历数据库中等级 b 账户，tgapi检测是否仍在群组，否->封禁，`/syncgroupm dry` 只预演
 
 2.sync——unbound 绑定同步任务，遍历服务器中users，未在数据表中找到同名数据的即 删除
 
@@ -12,14 +12,14 @@ Syncs 功能
 """
 import time
 from datetime import datetime, timedelta
-from asyncio import sleep
 from pyrogram import filters
-from pyrogram.errors import FloodWait
 from bot import bot, prefixes, bot_photo, LOGGER, owner, group
 from bot.func_helper.emby import emby
 from bot.func_helper.filters import admins_on_filter
 from bot.func_helper.utils import tem_deluser
-from bot.sql_helper.sql_emby import get_all_emby, Emby, sql_get_emby, sql_update_embys, sql_delete_emby, sql_update_emby
+from bot.func_helper.sync_planner import plan_sync, run_bounded
+from bot.sql_helper.sql_emby import get_all_emby, Emby, sql_get_emby, sql_update_embys, sql_delete_emby, \
+    sql_delete_embys
 from bot.func_helper.msg_utils import deleteMessage, sendMessage, sendPhoto
 from bot.sql_helper.sql_emby2 import sql_get_emby2
 
@@ -27,6 +27,7 @@ from bot.sql_helper.sql_emby2 import sql_get_emby2
 @bot.on_message(filters.command('syncgroupm', prefixes) & admins_on_filter)
 async def sync_emby_group(_, msg):
     await deleteMessage(msg)
+    dry_run = len(msg.command) > 1 and msg.command[1] == 'dry'
     send = await sendPhoto(msg, photo=bot_photo, caption="⚡群组成员同步任务\n  **正在开启中...消灭未在群组的账户**",
                            send=True)
     LOGGER.info(
@@ -36,38 +37,32 @@ async def sync_emby_group(_, msg):
     r = get_all_emby(Emby.lv == 'b')
     if not r:
         return await send.edit("⚡群组同步任务\n\n结束！搞毛，没有人。")
-    a = b = 0
-    text = ''
+    b = len(r)
     start = time.perf_counter()
-    for i in r:
-        b += 1
-        if i.tg not in members:
-            if await emby.emby_del(i.embyid):
-                sql_update_emby(Emby.embyid == i.embyid, embyid=None, name=None, pwd=None, pwd2=None, lv='d', cr=None,
-                                ex=None)
-                tem_deluser()
-                a += 1
-                reply_text = f'{b}. #id{i.tg} - [{i.name}](tg://user?id={i.tg}) 删除\n'
-                LOGGER.info(reply_text)
-                sql_delete_emby(tg=i.tg)
-            else:
-                reply_text = f'{b}. #id{i.tg} - [{i.name}](tg://user?id={i.tg}) 删除错误\n'
-                LOGGER.error(reply_text)
-            text += reply_text
-            try:
-                await bot.send_message(i.tg, reply_text)
-            except FloodWait as f:
-                LOGGER.warning(str(f))
-                await sleep(f.value * 1.2)
-                await bot.send_message(i.tg, reply_text)
-            except Exception as e:
-                LOGGER.error(e)
+    plan = plan_sync(members, r)
+    if dry_run:
+        return await send_chunks(msg, plan.report('群组成员同步任务', 'delete'))
 
-    # 防止触发 MESSAGE_TOO_LONG 异常，text可以是4096，caption为1024，取小会使界面好看些
-    n = 1000
-    chunks = [text[i:i + n] for i in range(0, len(text), n)]
-    for c in chunks:
-        await sendMessage(msg, c + f'\n🔈 当前时间：{datetime.now().strftime("%Y-%m-%d")}')
+    results = await run_bounded(lambda i: emby.emby_del(i.embyid), plan.to_delete)
+    deleted = [i for i, ok in results if ok]
+    if deleted:
+        sql_delete_embys([i.tg for i in deleted])
+        tem_deluser(len(deleted))
+    a = len(deleted)
+    text = ''
+    notices = []
+    for n, (i, ok) in enumerate(results, 1):
+        if ok:
+            reply_text = f'{n}. #id{i.tg} - [{i.name}](tg://user?id={i.tg}) 删除\n'
+            LOGGER.info(reply_text)
+        else:
+            reply_text = f'{n}. #id{i.tg} - [{i.name}](tg://user?id={i.tg}) 删除错误\n'
+            LOGGER.error(reply_text)
+        text += reply_text
+        notices.append((i.tg, reply_text))
+    await run_bounded(lambda x: bot.send_message(*x), notices)
+
+    await send_chunks(msg, text, f'\n🔈 当前时间：{datetime.now().strftime("%Y-%m-%d")}')
     end = time.perf_counter()
     times = end - start
     if a != 0:
@@ -78,6 +73,14 @@ async def sync_emby_group(_, msg):
     LOGGER.info(f"【群组同步任务结束】 - {msg.from_user.id} 共检索出 {b} 个账户，处刑 {a} 个账户，耗时：{times:.3f}s")
 
 
+async def send_chunks(msg, text, tail=''):
+    # 防止触发 MESSAGE_TOO_LONG 异常，text可以是4096，caption为1024，取小会使界面好看些
+    n = 1000
+    chunks = [text[i:i + n] for i in range(0, len(text), n)]
+    for c in chunks:
+        await sendMessage(msg, c + tail)
+
+
 @bot.on_message(filters.command('syncunbound', prefixes) & admins_on_filter)
 async def sync_emby_unbound(_, msg):
     await deleteMessage(msg)
@@ -219,25 +222,29 @@ async def kick_not_emby(_, msg):
         open_kick = msg.command[1]
     except:
         return await sendMessage(msg,
-                                 '注意: 此操作会将 当前群组中无emby账户的选手kick, 如确定使用请输入 `/kick_not_emby true`')
-    if open_kick == 'true':
-        LOGGER.info(f"{msg.from_user.first_name} - {msg.from_user.id} 执行了踢出非emby用户的操作")
-        embyusers = get_all_emby(Emby.embyid is not None and Emby.embyid != '')
-        # get tgid
-        embytgs = []
-        if embyusers:
-            embytgs = [i.tg for i in embyusers]
-        chat_members = [member.user.id async for member in bot.get_chat_members(chat_id=msg.chat.id)]
-        until_date = datetime.now() + timedelta(minutes=1)
-        for cmember in chat_members:
-            if cmember not in embytgs:
-                try:
-                    await msg.chat.ban_member(cmember, until_date=until_date)
-                    await sendMessage(msg, f'{cmember} 已踢出', send=True)
-                    LOGGER.info(f"{cmember} 已踢出")
-                except Exception as e:
-                    LOGGER.info(f"踢出 {cmember} 失败，原因: {e}")
-                    pass
+                                 '注意: 此操作会将 当前群组中无emby账户的选手kick, 如确定使用请输入 `/kick_not_emby true`，'
+                                 '只查看名单请输入 `/kick_not_emby dry`')
+    if open_kick not in ('true', 'dry'):
+        return
+    embyusers = get_all_emby(Emby.embyid is not None and Emby.embyid != '') or []
+    chat_members = [member.user.id async for member in bot.get_chat_members(chat_id=msg.chat.id)]
+    plan = plan_sync(chat_members, embyusers)
+    if open_kick == 'dry':
+        return await send_chunks(msg, plan.report('踢出非emby用户', 'kick'))
+
+    LOGGER.info(f"{msg.from_user.first_name} - {msg.from_user.id} 执行了踢出非emby用户的操作")
+    until_date = datetime.now() + timedelta(minutes=1)
+    results = await run_bounded(lambda tg: msg.chat.ban_member(tg, until_date=until_date), plan.to_kick, limit=5)
+    text = ''
+    for cmember, ok in results:
+        if ok:
+            text += f'{cmember} 已踢出\n'
+            LOGGER.info(f"{cmember} 已踢出")
+        else:
+            LOGGER.info(f"踢出 {cmember} 失败")
+    await send_chunks(msg, text or '没有需要踢出的人')
+
+
 @bot.on_message(filters.command('restore_from_db', prefixes) & filters.user(owner))
 async def restore_from_db(_, msg):
     await deleteMessage(msg)
@@ -245,41 +252,36 @@ async def restore_from_db(_, msg):
         confirm_restore = msg.command[1]
     except:
         return await sendMessage(msg,
-                                 '注意: 此操作会将 从数据库中恢复用户到Emby中, 请在需要恢复的群组中执行此命令, 如确定使用请输入 `/restore_from_db true`')
-    if confirm_restore == 'true':
-        LOGGER.info(
-            f"{msg.from_user.first_name} - {msg.from_user.id} 执行了从数据库中恢复用户到Emby中的操作")
-        embyusers = get_all_emby(Emby.embyid is not None and Emby.embyid != '')
-        # 获取当前执行命令的群组成员
-        chat_members = [member.user.id async for member in bot.get_chat_members(chat_id=msg.chat.id)]
-        await sendMessage(msg, '** 恢复中, 请耐心等待... **')
-        text = ''
-        for embyuser in embyusers:
-            if embyuser.tg in chat_members:
-                try:
-                    # emby api操作
-                    data = await emby.emby_create(embyuser.name, embyuser.us)
-                    if not data:
-                        text += f'**- ❎ 已有此账户名\n- ❎ 或检查有无特殊字符\n- ❎ 或emby服务器连接不通\n- ❎ 跳过恢复用户：#id{embyuser.tg} - [{embyuser.name}](tg://user?id={embyuser.tg}) \n**'
-                        LOGGER.error(
-                            f"【恢复账户】：重复账户 or 未知错误！{embyuser.name} 恢复失败！")
-                    else:
-                        tg = embyuser.tg
-                        embyid = data[0]
-                        pwd = data[1]
-                        sql_update_emby(Emby.tg == tg, embyid=embyid, pwd=pwd)
-                        text += f'**- ✅ 恢复用户：#id{embyuser.tg} - [{embyuser.name}](tg://user?id={embyuser.tg}) 成功！\n**'
-                        LOGGER.info(f"恢复 #id{embyuser.tg} - [{embyuser.name}](tg://user?id={embyuser.tg}) 成功")
-                except Exception as e:
-                    text += f'**- ❎ 恢复 #id{embyuser.tg} - [{embyuser.name}](tg://user?id={embyuser.tg}) 失败 \n**'
-                    LOGGER.info(f"恢复 #id{embyuser.tg} - [{embyuser.name}](tg://user?id={embyuser.tg}) 失败，原因: {e}")
-                    pass
-        # 防止触发 MESSAGE_TOO_LONG 异常，text可以是4096，caption为1024，取小会使界面好看些
-        n = 1000
-        chunks = [text[i:i + n] for i in range(0, len(text), n)]
-        for c in chunks:
-            await sendMessage(msg, c + f'\n🔈 当前时间：{datetime.now().strftime("%Y-%m-%d")}')
-        await sendMessage(msg, '** 恢复完成 **')
+                                 '注意: 此操作会将 从数据库中恢复用户到Emby中, 请在需要恢复的群组中执行此命令, 如确定使用请输入 `/restore_from_db true`，'
+                                 '只查看名单请输入 `/restore_from_db dry`')
+    if confirm_restore not in ('true', 'dry'):
+        return
+    embyusers = get_all_emby(Emby.embyid is not None and Emby.embyid != '') or []
+    # 获取当前执行命令的群组成员
+    chat_members = [member.user.id async for member in bot.get_chat_members(chat_id=msg.chat.id)]
+    plan = plan_sync(chat_members, embyusers)
+    if confirm_restore == 'dry':
+        return await send_chunks(msg, plan.report('从数据库恢复Emby账户', 'restore'))
+
+    LOGGER.info(
+        f"{msg.from_user.first_name} - {msg.from_user.id} 执行了从数据库中恢复用户到Emby中的操作")
+    await sendMessage(msg, '** 恢复中, 请耐心等待... **')
+    results = await run_bounded(lambda u: emby.emby_create(u.name, u.us), plan.to_restore)
+    text = ''
+    ls = []
+    for embyuser, data in results:
+        if not data:
+            text += f'**- ❎ 已有此账户名\n- ❎ 或检查有无特殊字符\n- ❎ 或emby服务器连接不通\n- ❎ 跳过恢复用户：#id{embyuser.tg} - [{embyuser.name}](tg://user?id={embyuser.tg}) \n**'
+            LOGGER.error(
+                f"【恢复账户】：重复账户 or 未知错误！{embyuser.name} 恢复失败！")
+        else:
+            ls.append([embyuser.tg, data[0], data[1]])
+            text += f'**- ✅ 恢复用户：#id{embyuser.tg} - [{embyuser.name}](tg://user?id={embyuser.tg}) 成功！\n**'
+            LOGGER.info(f"恢复 #id{embyuser.tg} - [{embyuser.name}](tg://user?id={embyuser.tg}) 成功")
+    if ls and not sql_update_embys(some_list=ls, method='restore'):
+        text += '**- ❎ 数据库批量写入失败，请检查日志\n**'
+    await send_chunks(msg, text, f'\n🔈 当前时间：{datetime.now().strftime("%Y-%m-%d")}')
+    await sendMessage(msg, '** 恢复完成 **')
 
 
 @bot.on_message(filters.command('scan_embyname', prefixes) & admins_on_filter)
@@ -1,10 +1,10 @@
-from bot.func_helper.emby import emby
 from pyrogram import filters
 from bot import bot, bot_name
 from bot.func_helper.filters import admins_on_filter
 from bot.func_helper.msg_utils import editMessage
 from bot.func_helper.fix_bottons import whitelist_page_ikb, normaluser_page_ikb,devices_page_ikb 
 from bot.sql_helper.sql_emby import get_all_emby, Emby
+from bot.sql_helper.sql_playback import sql_play_devices
 from bot.func_helper.msg_utils import callAnswer
 import math
 
@@ -92,9 +92,12 @@ async def user_devices(_, call):
     offset = (page - 1) * page_size
     
     # 获取用户设备信息
-    success, result, has_prev, has_next = await emby.get_emby_user_devices(offset=offset, limit=page_size)
-    if not success:
-        return await callAnswer(call, '🤕 Emby 服务器连接失败!')
+    # 本地汇总表，多取一条判断是否有下一页
+    result = sql_play_devices(offset=offset, limit=page_size + 1)
+    if result is None:
+        return await callAnswer(call, '🤕 查询用户设备失败!')
+    has_prev, has_next = offset > 0, len(result) > page_size
+    result = result[:page_size]
 
     text = '**💠 用户设备列表**\n\n'
     for name, device_count, ip_count in result:
@@ -15,6 +15,7 @@ from pyrogram.types import ChatPermissions, InlineKeyboardButton, InlineKeyboard
 from sqlalchemy import func
 
 from bot import bot, prefixes, sakura_b, bot_photo, red_envelope
+from bot.func_helper.callback_router import router
 from bot.func_helper.filters import user_in_group_on_filter
 from bot.func_helper.fix_bottons import users_iv_button
 from bot.func_helper.msg_utils import sendPhoto, sendMessage, callAnswer, editMessage
@@ -198,7 +199,7 @@ async def send_red_envelope(_, msg):
     await asyncio.gather(sendPhoto(msg, photo=cover, buttons=ikb), reply.delete())
 
 
-@bot.on_callback_query(filters.regex("red_envelope") & user_in_group_on_filter)
+@router.on('red_envelope', user_in_group_on_filter)
 async def grab_red_envelope(_, call):
     red_id = call.data.split("-")[1]
     try:
@@ -460,7 +461,7 @@ async def users_iv_rank():
 
 
 # 检索翻页
-@bot.on_callback_query(filters.regex("users_iv") & user_in_group_on_filter)
+@router.on('users_iv', user_in_group_on_filter)
 async def users_iv_pikb(_, call):
     # print(call.data)
     j, tg = map(int, call.data.split(":")[1].split("_"))
@@ -13,6 +13,7 @@ from datetime import timedelta, datetime
 from bot.schemas import ExDate, Yulv
 from bot import bot, LOGGER, _open, emby_line, sakura_b, ranks, group, extra_emby_libs, config, bot_name, schedall
 from pyrogram import filters
+from bot.func_helper.callback_router import router
 from bot.func_helper.emby import emby
 from bot.func_helper.filters import user_in_group_on_filter
 from bot.func_helper.utils import members_info, tem_adduser, cr_link_one, judge_admins, tem_deluser, pwd_create
@@ -86,7 +87,7 @@ async def create_user(_, call, us, stats):
 
 
 # 键盘中转
-@bot.on_callback_query(filters.regex('members'))
+@router.on('members')
 async def members(_, call):
     data = await members_info(tg=call.from_user.id)
     if not data:
@@ -107,7 +108,7 @@ async def members(_, call):
 
 
 # 创建账户
-@bot.on_callback_query(filters.regex('create') & user_in_group_on_filter)
+@router.on('create', user_in_group_on_filter)
 async def create(_, call):
     """
 
@@ -6,6 +6,7 @@ from bot.func_helper.fix_bottons import re_download_center_ikb, back_members_ikb
 from bot.sql_helper.sql_emby import sql_get_emby, sql_update_emby, Emby
 from bot.sql_helper.sql_request_record import sql_add_request_record, sql_get_request_record_by_tg
 from bot.func_helper.moviepilot import search, add_download_task 
+from bot.scheduler.sync_mp_download import wake_sync_download
 from bot.func_helper.emby import emby
 from bot.func_helper.utils import judge_admins
 import asyncio
@@ -221,6 +222,7 @@ async def handle_resource_selection(call, result):
                                     iv=emby_user.iv - need_cost)
                     sql_add_request_record(
                         call.from_user.id, download_id, result[index-1]['title'], download_log, need_cost)
+                    wake_sync_download()
                     if moviepilot.download_log_chatid:
                         try:
                             await sendMessage(call, download_log, send=True, chat_id=moviepilot.download_log_chatid)
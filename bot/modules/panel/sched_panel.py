@@ -10,6 +10,7 @@ from bot.func_helper.filters import admins_on_filter, user_in_group_on_filter
 from bot.func_helper.fix_bottons import sched_buttons, plays_list_button
 from bot.func_helper.msg_utils import callAnswer, editMessage, deleteMessage
 from bot.func_helper.scheduler import scheduler
+from bot.func_helper.favorites_index import favorites_index
 from bot.scheduler import *
 
 
@@ -23,10 +24,15 @@ auto_backup_db = DbBackupUtils.auto_backup_db
 user_plays_rank = Uplaysinfo.user_plays_rank
 check_low_activity = Uplaysinfo.check_low_activity
 
-async def user_day_plays(): await user_plays_rank(1)
+# 按观看时长发放奖励，先同步一次播放汇总
+async def user_day_plays():
+    await sync_playback()
+    await user_plays_rank(1)
 
 
-async def user_week_plays(): await user_plays_rank(7)
+async def user_week_plays():
+    await sync_playback()
+    await user_plays_rank(7)
 
 
 # 写优雅点
@@ -44,9 +50,9 @@ action_dict = {
 # 字典，对应的操作函数的参数和id
 args_dict = {
     "dayrank": {'hour': 18, 'minute': 30, 'id': 'day_ranks'},
-    "weekrank": {'day_of_week': "sun", 'hour': 23, 'minute': 59, 'id': 'week_ranks'},
+    "weekrank": {'day_of_week': "sun", 'hour': 23, 'minute': 50, 'id': 'week_ranks'},
     "dayplayrank": {'hour': 23, 'minute': 0, 'id': 'user_day_plays'},
-    "weekplayrank": {'day_of_week': "sun", 'hour': 23, 'minute': 0, 'id': 'user_week_plays'},
+    "weekplayrank": {'day_of_week': "sun", 'hour': 23, 'minute': 30, 'id': 'user_week_plays'},
     "check_ex": {'hour': 1, 'minute': 30, 'id': 'check_expired'},
     "low_activity": {'hour': 8, 'minute': 30, 'id': 'check_low_activity'},
     "backup_db": {'hour': 2, 'minute': 30, 'id': 'backup_db'},
@@ -55,10 +61,13 @@ args_dict = {
 
 def set_all_sche():
     for key, value in action_dict.items():
+        args = args_dict[key]
         if getattr(schedall, key):
             action = action_dict[key]
-            args = args_dict[key]
             scheduler.add_job(action, 'cron', **args)
+        elif scheduler.get_job(args['id']):
+            # 任务持久化在数据库中，配置里已关闭的要清掉
+            scheduler.remove_job(job_id=args['id'])
 
 
 set_all_sche()
@@ -66,8 +75,11 @@ set_all_sche()
 
 async def sched_panel(_, msg):
     # await deleteMessage(msg)
+    report = scheduler.report()
+    quiet = ' | '.join(f'`{k}` {h}点' for k, h in scheduler.quiet_hours.items())
+    quiet = f'🌙 空闲时段：{quiet}\n\n' if quiet else ''
     await editMessage(msg,
-                      text=f'🎮 **管理定时任务面板**\n\n',
+                      text=f'🎮 **管理定时任务面板**\n\n{scheduler.leader_info()}\n\n{quiet}{report}',
                       buttons=sched_buttons())
 
 
@@ -99,7 +111,8 @@ async def check_ex_admin(_, msg):
 # bot数据库手动备份
 @bot.on_message(filters.command('backup_db', prefixes) & filters.user(owner))
 async def manual_backup_db(_, msg):
-    await asyncio.gather(deleteMessage(msg), auto_backup_db())
+    # /backup_db full 强制全量备份
+    await asyncio.gather(deleteMessage(msg), auto_backup_db(full='full' in msg.command[1:]))
 
 
 @bot.on_message(filters.command('days_ranks', prefixes) & admins_on_filter)
@@ -133,8 +146,11 @@ async def shou_dong_uplayrank(_, msg):
 async def sync_favorites_admin(_, msg):
     await deleteMessage(msg)
     await msg.reply("⭕ 正在同步用户收藏记录...")
-    await sync_favorites()
-    await msg.reply("✅ 用户收藏记录同步完成")
+    # /sync_favorites [embyid ...] 只同步指定用户
+    await sync_favorites(msg.command[1:] or None)
+    info = favorites_index.info()
+    await msg.reply(f"✅ 用户收藏记录同步完成\n"
+                    f"收藏索引：{info['items']} 个条目 | {info['pairs']} 条收藏 | 约 {info['bytes'] / 1024:.0f} KB")
 
 @bot.on_message(filters.command('restart', prefixes) & admins_on_filter)
 async def restart_bot(_, msg):
@@ -191,7 +207,6 @@ async def execute(command, pass_error=True):
 from sys import executable, argv
 
 
-@scheduler.SCHEDULER.scheduled_job('cron', hour='12', minute='30', id='update_bot')
 async def update_bot(force: bool = False, msg: Message = None, manual: bool = False):
     """
     此为未被测试的代码片段。
@@ -233,6 +248,9 @@ async def update_bot(force: bool = False, msg: Message = None, manual: bool = Fa
         LOGGER.info(text)
 
 
+scheduler.add_job(update_bot, 'cron', hour='12', minute='30', id='update_bot')
+
+
 @bot.on_message(filters.command('update_bot', prefixes) & admins_on_filter)
 async def get_update_bot(_, msg: Message):
     delete_task = msg.delete()
@@ -3,8 +3,8 @@
 
 """
 from datetime import datetime, timezone, timedelta
-from pyrogram import filters
-from bot import bot, emby_line, emby_whitelist_line
+from bot import emby_line, emby_whitelist_line
+from bot.func_helper.callback_router import router
 from bot.func_helper.emby import emby
 from bot.func_helper.filters import user_in_group_on_filter
 from bot.sql_helper.sql_emby import sql_get_emby
@@ -12,7 +12,7 @@ from bot.func_helper.fix_bottons import cr_page_server
 from bot.func_helper.msg_utils import callAnswer, editMessage
 
 
-@bot.on_callback_query(filters.regex('server') & user_in_group_on_filter)
+@router.on('server', user_in_group_on_filter)
 async def server(_, call):
     data = sql_get_emby(tg=call.from_user.id)
     if not data:
@@ -0,0 +1,233 @@
+import asyncio
+import multiprocessing
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+"""
+海报渲染进程池
+背景、遮罩、字体在工作进程启动时加载一次；主进程只传入纯数据（名称、次数、封面 bytes），
+拿回编码好的图片 bytes，Pillow 合成不再占用事件循环。
+此模块不 import bot，工作进程里只做绘图
+"""
+
+resource_path = os.path.join('bot', 'ranks_helper', 'resource')
+red_path = os.path.join('bot', 'ranks_helper', 'red')
+bold_font = os.path.join(resource_path, 'font', "PingFang Bold.ttf")
+zimu_font = os.path.join(resource_path, 'font', "Provicali.otf")
+workers = 2
+
+_assets = None
+_pool = None
+
+
+def _open(path, mode=None):
+    image = Image.open(path)
+    image.load()
+    return image.convert(mode) if mode else image
+
+
+def load_assets():
+    """读取并解码全部素材，每个进程只做一次"""
+    global _assets
+    if _assets is not None:
+        return _assets
+    bg_path = os.path.join(resource_path, 'bg')
+    red_bg_path = os.path.join(red_path, 'bg')
+    _assets = {
+        'bgs': [_open(os.path.join(bg_path, f)) for f in sorted(os.listdir(bg_path))],
+        # (weekly, backdrop) -> 遮罩
+        'masks': {(weekly, backdrop): _open(os.path.join(
+            resource_path, f"{'week' if weekly else 'day'}_ranks_mask{'_backdrop' if backdrop else ''}.png"))
+            for weekly in (False, True) for backdrop in (False, True)},
+        'red_bgs': [_open(os.path.join(red_bg_path, f)) for f in sorted(os.listdir(red_bg_path))],
+        'red_mask': _open(os.path.join(red_path, 'red_mask.png'), 'L'),
+        'font': ImageFont.truetype(bold_font, 18),
+        'font_count': ImageFont.truetype(bold_font, 12),
+        'font_logo': ImageFont.truetype(bold_font, 60),
+        'font_red_name': ImageFont.truetype(bold_font, 50),
+        'font_red_money': ImageFont.truetype(zimu_font, 60),
+    }
+    return _assets
+
+
+def _init_worker():
+    # 素材缺失时不在这里抛出，否则整个进程池不可用；真正渲染时再报错
+    try:
+        load_assets()
+    except Exception:
+        pass
+
+
+def render_ranks(spec: dict) -> bytes:
+    """
+    绘制日榜/周榜海报
+    :param spec: weekly, backdrop, logo, draw_text,
+                 movies / tvs: [(kind, cover, name, count)]，kind 为 'backdrop' / 'primary' / None（无封面）
+    :return: jpg bytes
+    """
+    assets = load_assets()
+    backdrop = spec['backdrop']
+    mask = assets['masks'][(spec['weekly'], backdrop)]
+    bg = random.choice(assets['bgs']).resize(mask.size)
+    bg.paste(mask, (0, 0), mask)
+    text = ImageDraw.Draw(bg)
+    font, font_count = assets['font'], assets['font_count']
+
+    for index, (kind, cover, name, count) in enumerate(spec['movies'][:5]):
+        if kind == 'backdrop':
+            resize, xy = (242, 160), (103 + 302 * index, 140)
+        elif backdrop:
+            resize, xy = (110, 160), (169 + 302 * index, 140)
+        else:
+            resize, xy = (144, 210), (601, 162 + 230 * index)
+        if not _paste_cover(bg, cover, resize, xy):
+            # 如果没有封面图，使用name来代替
+            if backdrop:
+                draw_text_psd_style(text, (123 + 302 * index, 140), name, font, 126)
+            else:
+                draw_text_psd_style(text, (601, 162 + 230 * index), name, font, 126)
+        # 绘制 播放次数、影片名称
+        if spec['draw_text']:
+            draw_text_psd_style(text, (601 + 130, 163 + (230 * index)), str(count), font_count, 126)
+            draw_text_psd_style(text, (601, 163 + 190 + (230 * index)), name, font, 126)
+
+    for index, (kind, cover, name, count) in enumerate(spec['tvs'][:5]):
+        if kind == 'backdrop':
+            resize, xy = (242, 160), (408 + 302 * index, 444)
+        elif backdrop:
+            resize, xy = (110, 160), (474 + 302 * index, 444)
+        else:
+            resize, xy = (144, 210), (770, 985 - 232 * index)
+        if not _paste_cover(bg, cover, resize, xy):
+            if backdrop:
+                draw_text_psd_style(text, (428 + 302 * index, 444), name, font, 126)
+            else:
+                draw_text_psd_style(text, (770, 990 - 232 * index), name, font, 126)
+        if spec['draw_text']:
+            draw_text_psd_style(text, (770 + 130, 990 - (232 * index)), str(count), font_count, 126)
+            draw_text_psd_style(text, (770, 990 + 193 - (232 * index)), name, font, 126)
+
+    # 绘制Logo名字
+    if spec['logo']:
+        if backdrop:
+            draw_text_psd_style(text, (1900, 830), spec['logo'], assets['font_logo'], 126, align='right')
+        else:
+            draw_text_psd_style(text, (90, 1100), spec['logo'], assets['font_logo'], 126)
+    if bg.mode in ("RGBA", "P"):
+        bg = bg.convert("RGB")
+    out = BytesIO()
+    bg.save(out, format='jpeg')
+    return out.getvalue()
+
+
+def _paste_cover(bg, cover, resize, xy):
+    if not cover:
+        return False
+    try:
+        bg.paste(Image.open(BytesIO(cover)).resize(resize), xy)
+        return True
+    except Exception:
+        return False
+
+
+def render_red(money: int, members: int, user_pic: bytes = None, first_name: str = None) -> bytes:
+    """
+    绘制红包封面
+    :return: png bytes，头像不是有效图片时返回 None
+    """
+    assets = load_assets()
+    cover = random.choice(assets['red_bgs']).copy()
+    if user_pic:
+        try:
+            _pic = Image.open(BytesIO(user_pic)).convert('RGBA').resize((300, 300))
+        except IOError:
+            return None
+        _pic.putalpha(assets['red_mask'])
+        # 头像透明部分填充为背景色
+        pic_array = np.array(_pic)
+        pic_array[pic_array[..., 3] == 0] = cover.getpixel((0, 0))
+        cover.paste(Image.fromarray(pic_array), ((cover.width - _pic.width) // 2, 180))
+    draw = ImageDraw.Draw(cover)
+    draw.text((cover.width // 2, 550), f'{first_name}红包',
+              font=assets['font_red_name'], anchor='mm', fill=(249, 219, 160))
+    draw.text((cover.width // 2, cover.height - 100), f'{money} / {members}',
+              font=assets['font_red_money'], anchor='mm', fill=(249, 219, 160))
+    out = BytesIO()
+    cover.save(out, format='png')
+    return out.getvalue()
+
+
+def start():
+    """
+    创建进程池并立即 fork 出工作进程。
+    在 bot.run 之前调用，此时还没有其他线程；工作进程继承已导入的模块，不会重新执行 bot 的初始化
+    """
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'),
+                                    initializer=_init_worker)
+        _pool.submit(int)
+    return _pool
+
+
+async def render(func, *args):
+    """在进程池中执行 func(*args)，工作进程意外退出时重建一次"""
+    global _pool
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(start(), func, *args)
+    except BrokenProcessPool:
+        _pool = None
+        return await loop.run_in_executor(start(), func, *args)
+
+
+def draw_text_psd_style(draw, xy, text, font, tracking=0, leading=None, align='left', **kwargs):
+    """
+    usage: draw_text_psd_style(draw, (0, 0), "Test",
+                tracking=-0.1, leading=32, fill="Blue", align='left')
+
+    Leading is measured from the baseline of one line of text to the
+    baseline of the line above it. Baseline is the invisible line on which most
+    letters—that is, those without descenders—sit. The default auto-leading
+    option sets the leading at 120% of the type size (for example, 12‑point
+    leading for 10‑point type).
+
+    Tracking is measured in 1/1000 em, a unit of measure that is relative to
+    the current type size. In a 6 point font, 1 em equals 6 points;
+    in a 10 point font, 1 em equals 10 points. Tracking
+    is strictly proportional to the current type size.
+    """
+
+    def stutter_chunk(lst, size, overlap=0, default=None):
+        for i in range(0, len(lst), size - overlap):
+            r = list(lst[i:i + size])
+            while len(r) < size:
+                r.append(default)
+            yield r
+
+    x, y = xy
+    font_size = font.size
+    lines = text.splitlines()
+    if leading is None:
+        leading = font.size * 1.2
+
+    for line in lines:
+        # 计算整行文本宽度
+        total_width = font.getlength(line) + (tracking / 1000) * font_size * (len(line) - 1)
+
+        # 如果是右对齐，调整起始 x 坐标
+        current_x = x
+        if align == 'right':
+            current_x = x - total_width
+
+        for a, b in stutter_chunk(line, 2, 1, ' '):
+            w = font.getlength(a + b) - font.getlength(b)
+            draw.text((current_x, y), a, font=font, **kwargs)
+            current_x += w + (tracking / 1000) * font_size
+        y += leading
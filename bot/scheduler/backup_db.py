@@ -1,10 +1,13 @@
 import os
+from datetime import datetime, timedelta
 
 import asyncio
+from sqlalchemy import text
 
 from bot import bot, owner, LOGGER, db_is_docker, db_docker_name, db_host, db_name, db_user, db_pwd, \
-    db_backup_dir, db_backup_maxcount, db_port
-from bot.func_helper.backup_db_utils import BackupDBUtils
+    db_backup_dir, db_backup_maxcount, db_port, db_backup_full_days
+from bot.func_helper.backup_db_utils import BackupDBUtils, stamp_format
+from bot.sql_helper import engine
 
 
 class DbBackupUtils:
@@ -19,9 +22,47 @@ class DbBackupUtils:
     docker_mode = os.environ.get('DOCKER_MODE') == "1"
     docker_name = db_docker_name
 
+    @staticmethod
+    def table_checksums():
+        """每张表的 CHECKSUM TABLE 结果 {表名: checksum}"""
+        with engine.connect() as conn:
+            tables = [r[0] for r in conn.execute(text('SHOW TABLES'))]
+            if not tables:
+                return {}
+            rows = conn.execute(text('CHECKSUM TABLE ' + ', '.join(f'`{t}`' for t in tables)))
+            return {r[0].split('.', 1)[-1]: r[1] for r in rows}
+
+    @classmethod
+    async def plan_backup(cls, full=False):
+        """
+        决定本次备份方式：距上次全量超过 db_backup_full_days 天（或没有全量）时全量，
+        否则只导出相对上次全量 checksum 变化过的表（差异备份，恢复时只需 全量 + 最近一次增量）
+        :return: (要导出的表，None 为全部, 清单)
+        """
+        checksums = await asyncio.to_thread(cls.table_checksums)
+        fulls = [m for m in BackupDBUtils.load_manifests(cls.backup_dir, cls.database_name) if m['type'] == 'full']
+        last = fulls[-1] if fulls else None
+        if full or not db_backup_full_days or last is None or \
+                datetime.strptime(last['stamp'], stamp_format) + timedelta(days=db_backup_full_days) < datetime.now():
+            return None, {'type': 'full', 'checksums': checksums}
+        changed = [t for t, c in checksums.items() if c is None or last['checksums'].get(t) != c]
+        return changed, {'type': 'incr', 'base': last['stamp'], 'checksums': checksums, 'tables': changed}
+
     @classmethod
-    async def backup_db(cls):
+    async def backup_db(cls, full=False):
+        """:return: (分卷文件列表, sha256)，没有变化的表时返回 ([], None)，失败返回 None"""
         backup_file = None
+        try:
+            tables, manifest = await cls.plan_backup(full)
+        except Exception as e:
+            # 查不到 checksum 时退回不带清单的全量备份
+            LOGGER.warning(f"BOT数据库 checksum 获取失败，使用全量备份: {e}")
+            tables, manifest = None, None
+        if tables == []:
+            LOGGER.info("BOT数据库自上次全量备份以来没有变化，跳过")
+            return [], None
+        if tables:
+            LOGGER.info(f"BOT数据库增量备份，变化的表: {tables}")
         # 如果是在docker模式下运行的此程序，使用BackupDBUtils.backup_mysql_db的方式备份数据库（此镜像中已经安装了mysqldump工具）
         if os.environ.get('DOCKER_MODE') == "1" or not db_is_docker:
             backup_file = await BackupDBUtils.backup_mysql_db(
@@ -31,7 +72,9 @@ class DbBackupUtils:
                 password=db_pwd,
                 database_name=db_name,
                 backup_dir=db_backup_dir,
-                max_backup_count=db_backup_maxcount
+                max_backup_count=db_backup_maxcount,
+                tables=tables,
+                manifest=manifest
             )
         elif db_is_docker:
             backup_file = await BackupDBUtils.backup_mysql_db_docker(
@@ -40,28 +83,35 @@ class DbBackupUtils:
                 password=db_pwd,
                 database_name=db_name,
                 backup_dir=db_backup_dir,
-                max_backup_count=db_backup_maxcount
+                max_backup_count=db_backup_maxcount,
+                tables=tables,
+                manifest=manifest
             )
         return backup_file
 
     @staticmethod
-    async def auto_backup_db():
+    async def auto_backup_db(full=False):
         LOGGER.info("BOT数据库备份开始")
-        backup_file = await DbBackupUtils.backup_db()
-        if backup_file is not None:
+        result = await DbBackupUtils.backup_db(full)
+        if result is not None:
             LOGGER.info(f'BOT数据库备份完毕')
+            parts, digest = result
+            if not parts:
+                return
             try:
-                await asyncio.gather(bot.send_document(
-                    chat_id=owner,
-                    document=backup_file,
-                    caption=f'BOT数据库备份完毕',
-                    disable_notification=True  # 勿打扰
-                ), bot.send_document(
+                for i, part in enumerate(parts, 1):
+                    await bot.send_document(
+                        chat_id=owner,
+                        document=part,
+                        caption=f'BOT数据库备份完毕 {i}/{len(parts)}\nsha256: `{digest}`',
+                        disable_notification=True  # 勿打扰
+                    )
+                await bot.send_document(
                     chat_id=owner,
                     document='config.json',
                     caption=f'config备份完毕',
                     disable_notification=True  # 勿打扰
-                ))
+                )
             except Exception as e:
                 LOGGER.info(f'发送到owner失败，文件保存在本地:{e}')
         else:
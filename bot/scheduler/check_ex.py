@@ -173,3 +173,4 @@ async def check_expired():
             await bot.send_message(group[0].text)
         except Exception as e:
             LOGGER.error(e)
+    return len(rst) + len(rsc) + len(rseired)
@@ -0,0 +1,122 @@
+"""
+拉取 PlaybackActivity 到本地汇总表
+插件在播放开始时写入记录（DateCreated 为开始时间），播放结束才补上完整的 PlayDuration，
+所以不能只拉水位之后新增的记录：每轮都在插件里把水位前一天起的整天重新按天聚合，替换本地这些天的汇总。
+首次运行或停了很久时按 chunk_days 天一段拉取，每段一个事务，中途失败下次从已完成的段继续。
+榜单只读汇总表，靠 10 分钟一次的 sync_playback 保持新鲜；水位落后超过 stale_after 时才直接查询插件
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone, date
+
+from bot import LOGGER
+from bot.func_helper.emby import emby
+from bot.func_helper.scheduler import scheduler
+from bot.sql_helper.sql_playback import sql_get_playback_meta, sql_get_playback_user_names, \
+    sql_replace_playback_rollup
+
+# 每轮重新汇总水位前多少天起的记录，跨过水位才结束的长播放也能补上完整时长
+rescan = timedelta(days=1)
+# 每段拉取的天数，避免首次全量拉取超过插件查询的超时
+chunk_days = 30
+# 水位落后超过这个时间，读榜单时视为汇总表不可用
+stale_after = timedelta(minutes=30)
+_lock = asyncio.Lock()
+
+
+async def _query(sql, name):
+    """:return: 结果列表；没有数据时插件只返回 message，视为空；连接失败返回 None"""
+    success, result = await emby.emby_custom_query(sql)
+    if success:
+        return result
+    if isinstance(result, dict):
+        LOGGER.error(f'【playback_rollup】拉取{name}失败 {result}')
+        return None
+    return []
+
+
+async def sync_playback():
+    """
+    :return: 汇总的播放记录条数；拉取或写入失败返回 None，汇总表可能不是最新的
+    """
+    # 定时任务与手动榜单可能同时触发
+    async with _lock:
+        return await _sync()
+
+
+def rollup_fresh() -> bool:
+    """汇总表是否已同步到 stale_after 以内；首次补数据期间水位是已完成段的末尾，也算落后"""
+    watermark = sql_get_playback_meta('watermark')
+    if watermark is None:
+        return False
+    now = datetime.now(timezone(timedelta(hours=8))).replace(tzinfo=None)
+    return now - datetime.strptime(watermark, "%Y-%m-%d %H:%M:%S") <= stale_after
+
+
+async def _start_day():
+    """本轮从哪天开始汇总：水位前 rescan 天；还没有水位时从插件里最早的记录开始"""
+    watermark = sql_get_playback_meta('watermark')
+    if watermark is not None:
+        return date.fromisoformat(watermark[:10]) - rescan
+    first = await _query("SELECT min(DateCreated) FROM PlaybackActivity", '最早记录')
+    if first is None:
+        return None
+    if first and first[0][0]:
+        return date.fromisoformat(str(first[0][0])[:10])
+    return datetime.now(timezone(timedelta(hours=8))).date()
+
+
+async def _sync():
+    start = await _start_day()
+    if start is None:
+        return None
+    hidden = await _query("SELECT UserId FROM UserList", '隐藏用户')
+    hidden = [h[0] for h in hidden] if hidden is not None else sql_get_playback_meta('hidden_users', [])
+    # 重新汇总会整行替换，用户名取不到时跳过本轮，不能把已有的用户名写成空
+    success, users = await emby.users()
+    if not success:
+        LOGGER.error('【playback_rollup】获取 Emby 用户失败，跳过本轮')
+        return None
+    names = {u['Id']: u['Name'] for u in users}
+
+    total = 0
+    now = datetime.now(timezone(timedelta(hours=8)))
+    while start <= now.date():
+        end = min(start + timedelta(days=chunk_days), now.date() + timedelta(days=1))
+        n = await _sync_days(start, end, hidden, names,
+                             now.strftime("%Y-%m-%d %H:%M:%S") if end > now.date() else f'{end} 00:00:00')
+        if n is None:
+            return None
+        total += n
+        start = end
+    return total
+
+
+async def _sync_days(start: date, end: date, hidden: list, names: dict, watermark: str):
+    """重新汇总 [start, end) 这些天"""
+    where = f"WHERE DateCreated >= '{start}' AND DateCreated < '{end}' "
+    plays = await _query(
+        "SELECT date(DateCreated) AS day, UserId, ItemId, ItemType, "
+        "CASE WHEN ItemType = 'Episode' THEN substr(ItemName,0, instr(ItemName, ' - ')) ELSE ItemName END AS name, "
+        "COUNT(1), SUM(PlayDuration - PauseDuration) FROM PlaybackActivity " + where +
+        "GROUP BY day, UserId, ItemId", '播放记录')
+    devices = await _query(
+        "SELECT date(DateCreated) AS day, UserId, DeviceName, ClientName, RemoteAddress, COUNT(1) "
+        "FROM PlaybackActivity " + where + "GROUP BY day, UserId, DeviceName, ClientName, RemoteAddress", '设备记录')
+    if plays is None or devices is None:
+        return None
+    # 已在 Emby 删除的用户沿用汇总表里记下的用户名
+    missing = {row[1] for row in plays + devices} - names.keys()
+    if missing:
+        names = {**await asyncio.to_thread(sql_get_playback_user_names, missing), **names}
+
+    plays = [dict(day=d, user_id=u, item_id=i, user_name=names.get(u), item_type=t, name=(n or '')[:255],
+                  plays=int(c), duration=int(s or 0)) for d, u, i, t, n, c, s in plays]
+    devices = [dict(day=d, user_id=u, device=(dev or '')[:128], client=(cl or '')[:64], ip=(ip or '')[:64],
+                    user_name=names.get(u), plays=int(c)) for d, u, dev, cl, ip, c in devices]
+    if not await asyncio.to_thread(sql_replace_playback_rollup, plays, devices, start, end, watermark, hidden):
+        return None
+    LOGGER.info(f'【playback_rollup】{start} ~ {end} 汇总 {len(plays)} 条播放、{len(devices)} 条设备')
+    return len(plays)
+
+
+scheduler.add_job(sync_playback, 'interval', minutes=10, id='sync_playback')
@@ -7,18 +7,37 @@ from datetime import date
 from bot.func_helper.utils import convert_s
 from bot.func_helper.emby import emby
 from bot.ranks_helper import ranks_draw
+from bot.scheduler.playback_rollup import sync_playback, rollup_fresh
+from bot.sql_helper.sql_playback import sql_play_report, start_day
 from bot import bot, group, ranks, LOGGER, schedall, save_config
 
 
+async def play_reports(days):
+    """
+    最近 days 个自然日的电影榜和剧集榜，查询失败的一项为 None。
+    只读汇总表；汇总表落后太久时改为直接查询插件（最近 days*24 小时）
+    """
+    if rollup_fresh():
+        return sql_play_report('Movie', start_day(days)), sql_play_report('Episode', start_day(days))
+    LOGGER.warning('【ranks_task】播放汇总落后太久，直接查询 Emby')
+    reports = []
+    for types in ('Movie', 'Episode'):
+        success, result = await emby.get_emby_report(types=types, days=days)
+        reports.append(result if success else None)
+    return reports
+
+
 async def day_ranks(pin_mode=True):
     draw = ranks_draw.RanksDraw(ranks.logo, backdrop=ranks.backdrop)
     LOGGER.info("【ranks_task】定时任务 正在推送日榜")
-    success, movies = await emby.get_emby_report(types='Movie', days=1)
-    if not success:
+    if pin_mode:
+        # 定时推送前同步一次，榜单包含最近几分钟的播放
+        await sync_playback()
+    movies, tvs = await play_reports(1)
+    if movies is None:
         LOGGER.error('【ranks_task】推送日榜失败，获取Movies数据失败!')
         return
-    success, tvs = await emby.get_emby_report(types='Episode', days=1)
-    if not success:
+    if tvs is None:
         LOGGER.error('【ranks_task】推送日榜失败，获取Episode数据失败!')
         return
     # 绘制海报
@@ -54,17 +73,20 @@ async def day_ranks(pin_mode=True):
     schedall.day_ranks_message_id = message_info.id
     save_config()
     LOGGER.info("【ranks_task】定时任务 推送日榜完成")
+    return len(movies) + len(tvs)
 
 
 async def week_ranks(pin_mode=True):
     draw = ranks_draw.RanksDraw(ranks.logo, weekly=True, backdrop=ranks.backdrop)
     LOGGER.info("【ranks_task】定时任务 正在推送周榜")
-    success, movies = await emby.get_emby_report(types='Movie', days=7)
-    if not success:
+    if pin_mode:
+        # 定时推送前同步一次，榜单包含最近几分钟的播放
+        await sync_playback()
+    movies, tvs = await play_reports(7)
+    if movies is None:
         LOGGER.warning('【ranks_task】推送周榜失败，没有获取到Movies数据!')
         return
-    success, tvs = await emby.get_emby_report(types='Episode', days=7)
-    if not success:
+    if tvs is None:
         LOGGER.error('【ranks_task】推送周榜失败，没有获取到Episode数据!')
         return
     # 绘制海报
@@ -101,3 +123,4 @@ async def week_ranks(pin_mode=True):
     schedall.week_ranks_message_id = message_info.id
     save_config()
     LOGGER.info("【ranks_task】定时任务 推送周榜完成")
+    return len(movies) + len(tvs)
@@ -1,48 +1,117 @@
+import asyncio
+from datetime import datetime, timezone
+
 from bot import LOGGER
-from bot.sql_helper.sql_favorites import sql_add_favorites, sql_clear_favorites
+from bot.func_helper.sync_planner import run_bounded
+from bot.sql_helper.sql_favorites import sql_get_favorite_ids, sql_upsert_favorites, sql_delete_favorites, \
+    sql_rebuild_favorites_index
+from bot.func_helper.favorites_index import favorites_index
+from bot.func_helper.scheduler import scheduler
 from bot.sql_helper.sql_emby import get_all_emby, Emby
 from bot.func_helper.emby import emby
 
+# 每页拉取的收藏条数
+page_size = 200
+# webhook 触发的单用户对账延迟（秒），连续收藏只对账一次
+resync_delay = 30
+_pending = {}
+
 
-async def sync_favorites():
+async def fetch_favorites(embyid):
     """
-    同步所有用户的Emby收藏记录到数据库
+    分页拉取一个用户的全部收藏
+    :return: {item_id: item_name}，请求失败返回 None
+    """
+    items = {}
+    start = 0
+    while True:
+        page = await emby.get_favorite_items(embyid, start_index=start, limit=page_size)
+        if not page:
+            return None
+        for item in page.get("Items", []):
+            if item.get("Id"):
+                items[item["Id"]] = item.get("Name", "")
+        start += page_size
+        if start >= page.get("TotalRecordCount", 0) or not page.get("Items"):
+            return items
+
+
+async def diff_favorites(users, stored):
+    """
+    拉取 users 的收藏并与库中 stored 对比
+    :return: (待写入行, 待删除的 (embyid, item_id))
+    """
+    results = await run_bounded(lambda u: fetch_favorites(u.embyid), users)
+    upserts, deletes = [], []
+    for user, remote in results:
+        if remote is None or remote is False:
+            # 拉取失败不动库里的数据，避免误删
+            continue
+        local = stored.get(user.embyid, {})
+        for item_id, item_name in remote.items():
+            if item_id in local and (not item_name or local[item_id] == item_name):
+                continue
+            if not item_name:
+                item_name = await emby.item_id_namme(user.embyid, item_id) or "未知"
+            upserts.append(dict(embyid=user.embyid, embyname=user.name, item_id=item_id, item_name=item_name))
+        deletes.extend((user.embyid, item_id) for item_id in local.keys() - remote.keys())
+    return upserts, deletes
+
+
+async def sync_favorites(embyids: list = None):
+    """
+    差分同步用户的Emby收藏记录到数据库，只写入新增/改名的条目，删除已取消的条目
+    :param embyids: 只同步这些用户，默认全部
     """
     LOGGER.info("开始同步用户Emby收藏记录...")
     try:
         # 获取所有Emby用户
-        users = get_all_emby(Emby.embyid is not None)
+        condition = Emby.embyid.in_(embyids) if embyids else Emby.embyid.isnot(None)
+        users = get_all_emby(condition)
         if not users:
             LOGGER.warning("没有找到Emby用户")
             return
 
+        stored = sql_get_favorite_ids([u.embyid for u in users])
+        if stored is None:
+            return
+        upserts, deletes = await diff_favorites(users, stored)
         for user in users:
-            # 获取用户的收藏列表
-            favorites = await emby.get_favorite_items(user.embyid)
-            if not favorites:
-                continue
-            #  清除数据库中该用户的收藏记录
-            sql_clear_favorites(user.embyid)
-            # 遍历收藏项目并添加到数据库
-            for item in favorites.get("Items", []):
-                item_id = item.get("Id")
-                if not item_id:
-                    continue
-
-                # 获取项目名称
-                item_name = item.get("Name", "")
-                if not item_name:
-                    item_name = await emby.item_id_namme(user.embyid, item_id) or "未知"
-
-                # 添加到数据库
-                sql_add_favorites(
-                    embyid=user.embyid,
-                    embyname=user.name,
-                    item_id=item_id,
-                    item_name=item_name,
-                )
-
-        LOGGER.info("Emby收藏记录同步完成")
+            favorites_index.set_tg(user.embyid, user.tg)
+        if sql_upsert_favorites(upserts) and sql_delete_favorites(deletes):
+            LOGGER.info(f"Emby收藏记录同步完成，{len(users)} 个用户，写入 {len(upserts)} 条，删除 {len(deletes)} 条")
+        return len(users)
 
     except Exception as e:
         LOGGER.error(f"同步Emby收藏记录时出错: {str(e)}")
+
+
+def request_resync(embyid: str):
+    """
+    收藏 webhook 调用：resync_delay 秒后对该用户做一次差分对账，补上 webhook 漏掉的事件。
+    期间的重复请求合并为一次
+    """
+    if not embyid or embyid in _pending:
+        return
+
+    async def later():
+        try:
+            await asyncio.sleep(resync_delay)
+            await sync_favorites([embyid])
+        finally:
+            _pending.pop(embyid, None)
+
+    _pending[embyid] = asyncio.create_task(later())
+
+
+async def rebuild_favorites_index():
+    """
+    定期全量重建收藏索引，纠正增量维护漏掉的变化（换绑 tg、删号等）
+    """
+    if await sql_rebuild_favorites_index():
+        return favorites_index.info()['pairs']
+
+
+# 启动时先建一次
+scheduler.add_job(rebuild_favorites_index, 'interval', hours=1, id='rebuild_favorites_index',
+                  next_run_time=datetime.now(timezone.utc))
@@ -1,84 +1,85 @@
 from bot import LOGGER, config, bot
-from bot.func_helper.moviepilot import get_download_task, get_history_transfer_task_by_title_download_id
-from bot.sql_helper.sql_request_record import sql_update_request_status, sql_get_request_record_by_transfer_state, sql_get_request_record_by_download_id
+from bot.func_helper.moviepilot import get_download_task, get_history_transfer_status_map
+from bot.sql_helper.sql_request_record import sql_update_request_statuses, sql_get_request_record_by_transfer_state, \
+    sql_get_request_records_by_download_ids
 from bot.func_helper.scheduler import scheduler
+
+# MoviePilot 状态 -> 写入数据库的 (download_state, progress, left_time)，None 表示沿用任务里的值
+state_fields = {
+    'downloading': ('downloading', None, None),
+    'completed': ('completed', 100, '0'),
+    'failed': ('failed', None, '失败'),
+    'pending': ('pending', 0, '等待中'),
+}
+# 空闲退避：连续没有进行中的任务时跳过若干轮，最长约 max_skip+1 分钟同步一次
+max_skip = 9
+_idle = 0
+_skip = 0
+
+
+def wake_sync_download():
+    """有新的点播时取消退避，下一轮立即同步"""
+    global _idle, _skip
+    _idle = _skip = 0
+
+
 async def sync_download_tasks():
-    """同步MoviePilot下载任务状态到数据库"""
+    """同步MoviePilot下载任务状态到数据库，只写有变化的记录"""
+    global _idle, _skip
+    if _skip > 0:
+        _skip -= 1
+        return
     try:
-        # 获取所有下载任务
-        download_tasks = await get_download_task()
-        download_count = 0
-        if download_tasks is not None:
-            # 更新每个任务的状态
-            for task in download_tasks:
-                record = sql_get_request_record_by_download_id(task['download_id'])
-                if record is None:
-                    continue
-                download_id = task['download_id']
-                download_state = task['state']
-                progress = task['progress']
-                left_time = task.get('left_time', '未知')
+        # 获取所有下载任务，一次 IN 查询取出对应的点播记录
+        download_tasks = await get_download_task() or []
+        records = sql_get_request_records_by_download_ids([t['download_id'] for t in download_tasks])
+        updates = {}
+        active = False
+        for task in download_tasks:
+            record = records.get(task['download_id'])
+            if record is None or task['state'] not in state_fields:
+                continue
+            download_state, progress, left_time = state_fields[task['state']]
+            progress = task['progress'] if progress is None else progress
+            left_time = task.get('left_time', '未知') if left_time is None else left_time
+            active = active or download_state in ('downloading', 'pending')
+            if (record.download_state, record.progress, record.left_time) != (download_state, progress, left_time):
+                updates[record.download_id] = dict(download_id=record.download_id, download_state=download_state,
+                                                   progress=progress, left_time=left_time)
+        download_count = len(updates)
 
-                # 根据状态更新数据库
-                if download_state == 'downloading':
-                    # 正在下载中
-                    sql_update_request_status(
-                        download_id=download_id,
-                        download_state='downloading',
-                        progress=progress,
-                        left_time=left_time
-                    )
-                elif download_state == 'completed':
-                    # 下载完成
-                    sql_update_request_status(
-                        download_id=download_id,
-                        download_state='completed',
-                        progress=100,
-                        left_time='0'
-                    )
-                elif download_state == 'failed':
-                    # 下载失败
-                    sql_update_request_status(
-                        download_id=download_id,
-                        download_state='failed',
-                        progress=progress,
-                        left_time='失败'
-                    )
-                elif download_state == 'pending':
-                    # 等待下载
-                    sql_update_request_status(
-                        download_id=download_id,
-                        download_state='pending',
-                        progress=0,
-                        left_time='等待中'
-                    )
-                download_count += 1
-        # 获取需要检查转移状态的记录
+        # 需要检查转移状态的记录，整轮只查一次转移历史
         transfer_tasks = sql_get_request_record_by_transfer_state()
         transfer_count = 0
-        if transfer_tasks is not None:
-            # 检查每个记录的转移状态
+        if transfer_tasks:
+            history = await get_history_transfer_status_map(count=100) or {}
             for record in transfer_tasks:
-                transfer_state = await get_history_transfer_task_by_title_download_id("", record.download_id, count=100)
-                if transfer_state is not None:
-                    if transfer_state:
-                        try:
-                            await bot.send_message(chat_id=record.tg, text = f"💯恭喜您点播的「{record.request_name}」已成功入库！")
-                        except Exception as e:
-                            LOGGER.error(f"[MoviePilot] 发送通知到{record.tg}失败: {str(e)}")
-                    sql_update_request_status(
-                        download_id=record.download_id,
-                        transfer_state=transfer_state,
-                        download_state='completed',
-                        progress=100,
-                        left_time='0'
-                    )
-                    transfer_count += 1
+                transfer_state = history.get(record.download_id)
+                if transfer_state is None:
+                    continue
+                if transfer_state:
+                    try:
+                        await bot.send_message(chat_id=record.tg, text=f"💯恭喜您点播的「{record.request_name}」已成功入库！")
+                    except Exception as e:
+                        LOGGER.error(f"[MoviePilot] 发送通知到{record.tg}失败: {str(e)}")
+                updates[record.download_id] = dict(download_id=record.download_id, transfer_state=transfer_state,
+                                                   download_state='completed', progress=100, left_time='0')
+                transfer_count += 1
+
+        if updates and not sql_update_request_statuses(list(updates.values())):
+            LOGGER.error(f"[MoviePilot] 批量更新下载任务状态失败")
         if download_count > 0 or transfer_count > 0:
             LOGGER.info(f"[MoviePilot] 同步了 {download_count} 个下载任务状态, {transfer_count} 个转移任务状态")
+
+        if active or updates:
+            _idle = 0
+        else:
+            _idle += 1
+            _skip = min(2 ** _idle - 1, max_skip)
+        return download_count + transfer_count
     except Exception as e:
         LOGGER.error(f"[MoviePilot] 同步下载任务状态时出错: {str(e)}")
 # 如果MoviePilot功能开启，添加定时任务
 if config.moviepilot.status:
     scheduler.add_job(sync_download_tasks, 'interval',
-                     seconds=60, id='sync_download_tasks')
\ No newline at end of file
+                     seconds=60, id='sync_download_tasks')
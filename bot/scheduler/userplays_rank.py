@@ -4,10 +4,13 @@ from datetime import datetime, timezone, timedelta
 
 from bot import bot, bot_photo, group, sakura_b, LOGGER, ranks, _open
 from bot.func_helper.emby import emby
-from bot.func_helper.utils import convert_to_beijing_time, convert_s, cache, get_users, tem_deluser
+from bot.func_helper.utils import convert_s, cache, get_users, tem_deluser
+from bot.func_helper.sync_planner import run_bounded
 from bot.sql_helper import Session
-from bot.sql_helper.sql_emby import sql_get_emby, sql_update_embys, Emby, sql_update_emby
+from bot.sql_helper.sql_emby import sql_update_embys, Emby, get_all_emby, sql_clear_embys
 from bot.func_helper.fix_bottons import plays_list_button
+from bot.scheduler.playback_rollup import rollup_fresh
+from bot.sql_helper.sql_playback import sql_play_watch_time, start_day
 
 
 class Uplaysinfo:
@@ -17,7 +20,12 @@ class Uplaysinfo:
     @cache.memoize(ttl=120)
     async def users_playback_list(cls, days):
         try:
-            play_list = await emby.emby_cust_commit(user_id=None, days=days, method='sp')
+            if rollup_fresh():
+                play_list = sql_play_watch_time(start_day(days))
+            else:
+                # 汇总表落后太久，直接查询插件
+                LOGGER.warning('【userplays_rank】播放汇总落后太久，直接查询 Emby')
+                play_list = await emby.emby_cust_commit(days=days, method='sp')
         except Exception as e:
             print(f"Error fetching playback list: {e}")
             return None, 1, 1
@@ -106,56 +114,65 @@ class Uplaysinfo:
 
     @staticmethod
     async def check_low_activity():
-        now = datetime.now(timezone(timedelta(hours=8)))
+        """
+        活跃检测：c 级 15 天未活跃删除，b 级 21 天未活跃禁用。
+        数据库一次查出 b/c 级账户按名字建索引；LastActivityDate 是 UTC 的 ISO 字符串，
+        直接与截止时间的同格式字符串比较，不再逐个 strptime；emby 操作并发执行，数据库批量写入
+        """
         success, users = await emby.users()
         if not success:
             return await bot.send_message(chat_id=group[0], text='⭕ 调用emby api失败')
-        msg = ''
-        # print(users)
+        accounts = get_all_emby(Emby.lv.in_(['b', 'c'])) or []
+        by_name = {e.name: e for e in accounts if e.name}
+        by_embyid = {e.embyid: e for e in accounts if e.embyid}
+        by_tg = {str(e.tg): e for e in accounts}
+
+        now = datetime.now(timezone.utc)
+        cut_c = (now - timedelta(days=15)).strftime('%Y-%m-%dT%H:%M:%S')
+        cut_b = (now - timedelta(days=21)).strftime('%Y-%m-%dT%H:%M:%S')
+        to_delete, to_disable = [], []
         for user in users:
-            # 数据库先找
-            e = sql_get_emby(tg=user["Name"])
+            e = by_name.get(user["Name"]) or by_embyid.get(user["Id"]) or by_tg.get(user["Name"])
             if e is None:
                 continue
+            last = (user.get("LastActivityDate") or "")[:19]
+            if e.lv == 'c' and (not last or last < cut_c):
+                to_delete.append(e)
+            elif e.lv == 'b' and (not last or last < cut_b):
+                to_disable.append((e, user, bool(last)))
+
+        msg = ''
+        results = await run_bounded(lambda x: emby.emby_change_policy(id=x[1]["Id"], method=True), to_disable)
+        disabled = []
+        for (e, user, active), ok in results:
+            reason = '21天未活跃' if active else '注册后未活跃'
+            if ok:
+                disabled.append((e.tg, 'c'))
+                msg += f"**🔋活跃检测** - [{user['Name']}](tg://user?id={e.tg})\n#id{e.tg} {reason}，禁用\n\n"
+                LOGGER.info(f"【活跃检测】- 禁用账户 {user['Name']} #id{e.tg}：{reason}")
+            else:
+                msg += f"**🎂活跃检测** - [{user['Name']}](tg://user?id={e.tg})\n#id{e.tg} {reason}，禁用失败啦！检查emby连通性\n\n"
+                LOGGER.info(f"【活跃检测】- 禁用账户 {user['Name']} #id{e.tg}：禁用失败啦！检查emby连通性")
+        if disabled and not sql_update_embys(disabled, method='lv'):
+            LOGGER.error(f'【活跃检测】- 数据库批量禁用失败 {disabled}')
+
+        results = await run_bounded(lambda x: emby.emby_del(id=x.embyid), to_delete)
+        deleted = []
+        for e, ok in results:
+            if ok:
+                deleted.append(e.tg)
+                msg += f'**🔋活跃检测** - [{e.name}](tg://user?id={e.tg})\n#id{e.tg} 禁用后未解禁，已执行删除。\n\n'
+                LOGGER.info(f"【活跃检测】- 删除账户 {e.name} #id{e.tg}")
+            else:
+                msg += f'**🔋活跃检测** - [{e.name}](tg://user?id={e.tg})\n#id{e.tg} 禁用后未解禁，执行删除失败。\n\n'
+                LOGGER.info(f"【活跃检测】- 删除账户失败 {e.name} #id{e.tg}")
+        if deleted:
+            if sql_clear_embys(deleted) is None:
+                LOGGER.error(f'【活跃检测】- 数据库批量清除失败 {deleted}')
+            tem_deluser(len(deleted))
 
-            elif e.lv == 'c':
-                # print(e.tg)
-                try:
-                    ac_date = convert_to_beijing_time(user["LastActivityDate"])
-                except KeyError:
-                    ac_date = "None"
-                finally:
-                    if ac_date == "None" or ac_date + timedelta(days=15) < now:
-                        if await emby.emby_del(id=e.embyid):
-                            sql_update_emby(Emby.embyid == e.embyid, embyid=None, name=None, pwd=None, pwd2=None, lv='d',
-                                            cr=None, ex=None)
-                            tem_deluser()
-                            msg += f'**🔋活跃检测** - [{e.name}](tg://user?id={e.tg})\n#id{e.tg} 禁用后未解禁，已执行删除。\n\n'
-                            LOGGER.info(f"【活跃检测】- 删除账户 {user['Name']} #id{e.tg}")
-                        else:
-                            msg += f'**🔋活跃检测** - [{e.name}](tg://user?id={e.tg})\n#id{e.tg} 禁用后未解禁，执行删除失败。\n\n'
-                            LOGGER.info(f"【活跃检测】- 删除账户失败 {user['Name']} #id{e.tg}")
-            elif e.lv == 'b':
-                try:
-                    ac_date = convert_to_beijing_time(user["LastActivityDate"])
-                    # print(e.name, ac_date, now)
-                    if ac_date + timedelta(days=21) < now:
-                        if await emby.emby_change_policy(id=user["Id"], method=True):
-                            sql_update_emby(Emby.embyid == user["Id"], lv='c')
-                            msg += f"**🔋活跃检测** - [{user['Name']}](tg://user?id={e.tg})\n#id{e.tg} 21天未活跃，禁用\n\n"
-                            LOGGER.info(f"【活跃检测】- 禁用账户 {user['Name']} #id{e.tg}：21天未活跃")
-                        else:
-                            msg += f"**🎂活跃检测** - [{user['Name']}](tg://user?id={e.tg})\n21天未活跃，禁用失败啦！检查emby连通性\n\n"
-                            LOGGER.info(f"【活跃检测】- 禁用账户 {user['Name']} #id{e.tg}：禁用失败啦！检查emby连通性")
-                except KeyError:
-                    if await emby.emby_change_policy(id=user["Id"], method=True):
-                        sql_update_emby(Emby.embyid == user["Id"], lv='c')
-                        msg += f"**🔋活跃检测** - [{user['Name']}](tg://user?id={e.tg})\n#id{e.tg} 注册后未活跃，禁用\n\n"
-                        LOGGER.info(f"【活跃检测】- 禁用账户 {user['Name']} #id{e.tg}：注册后未活跃禁用")
-                    else:
-                        msg += f"**🎂活跃检测** - [{user['Name']}](tg://user?id={e.tg})\n#id{e.tg} 注册后未活跃，禁用失败啦！检查emby连通性\n\n"
-                        LOGGER.info(f"【活跃检测】- 禁用账户 {user['Name']} #id{e.tg}：禁用失败啦！检查emby连通性")
         n = 1000
         chunks = [msg[i:i + n] for i in range(0, len(msg), n)]
         for c in chunks:
             await bot.send_message(chat_id=group[0], text=c + f'**{datetime.now().strftime("%Y-%m-%d %H:%M:%S")}**')
+        return len(users)
@@ -1,7 +1,7 @@
 import json
 import os
 from pydantic import BaseModel, Field
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Union
 
 
 # 嵌套式的数据设计，规范数据 config.json
@@ -115,11 +115,29 @@ class AutoUpdate(BaseModel):
     up_description: Optional[str] = None  # 更新描述
 
 
+class RateLimit(BaseModel):
+    status: bool = True
+    # 令牌桶 [每秒补充的请求数, 桶容量即允许的突发数]，每秒补充数为 0 表示不限
+    # 每个有效 token + 客户端 ip；容量按媒体库扫描时 webhook 的突发、看板轮询和批量接口估算
+    token: List[float] = [100, 3000]
+    ip: List[float] = [5, 20]  # 不带有效 token 的请求，按客户端 ip
+    route: List[float] = [0, 0]  # 没在 routes 里的路径，每个路径所有客户端合计，默认不限
+    # 单独设置的路径，键以 / 结尾时匹配该前缀下的所有路径；webhook 由入队队列自己回 503 反压，不再限总量
+    routes: Dict[str, List[float]] = {"/emby/ban_playlist": [0.5, 5], "/emby/webhook/": [0, 0]}
+    trusted_proxies: List[str] = ["127.0.0.1", "::1"]  # 来自这些地址的请求按 X-Forwarded-For / X-Real-IP 取客户端 ip
+    db: bool = False  # 多进程/多实例共享客户端的限额，每个请求多两次数据库读写；路径的限额仍按进程计
+
+
 class API(BaseModel):
     status: bool = False  # 默认关闭
     http_url: Optional[str] = "0.0.0.0"
     http_port: Optional[int] = 8838
     allow_origins: Optional[List[Union[str, int]]] = None
+    webhook_dedup_db: bool = False  # 多进程/多实例共用webhook入口时，在数据库中登记去重
+    standalone: bool = False  # 为 true 时接口不随 bot 启动，改用 python3 web.py 单独运行
+    workers: int = 1  # 单独运行时 uvicorn 的工作进程数，/metrics 合并各进程的指标
+    metrics_port: int = 8839  # 单独运行时 bot 进程在这个端口提供 /metrics，0 为不提供
+    rate_limit: RateLimit = Field(default_factory=RateLimit)
 
     def __init__(self, **data):
         super().__init__(**data)
@@ -162,6 +180,8 @@ class Config(BaseModel):
     db_docker_name: str = "mysql"
     db_backup_dir: str = "./db_backup"
     db_backup_maxcount: int = 7
+    # 每隔多少天做一次全量备份，其余只备份变化过的表；0 为每次全量
+    db_backup_full_days: int = 7
     # another_line: Optional[List[str]] = []
     # 如果使用的是 Python 3.10+ ，|运算符能用
     # w_anti_channel_ids: Optional[List[str | int]] = []
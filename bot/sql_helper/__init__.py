@@ -5,6 +5,7 @@ from bot import db_host, db_user, db_pwd, db_name, db_port
 from sqlalchemy import create_engine
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session
+from bot.func_helper.metrics import instrument_engine
 
 # 创建engine对象
 engine = create_engine(f"mysql+pymysql://{db_user}:{db_pwd}@{db_host}:{db_port}/{db_name}?utf8mb4", echo=False,
@@ -12,6 +13,7 @@ engine = create_engine(f"mysql+pymysql://{db_user}:{db_pwd}@{db_host}:{db_port}/
                        pool_size=16,
                        pool_recycle=60 * 30,
                        )
+instrument_engine(engine)
 
 # 创建Base对象
 Base = declarative_base()
@@ -12,9 +12,9 @@ from sqlalchemy import (
     case,
     func,
 )
-from cacheout import Cache
+from bot.func_helper.metrics import MeteredCache
 
-cache = Cache()
+cache = MeteredCache('sql_code')
 
 
 class Code(Base):
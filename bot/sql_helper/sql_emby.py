@@ -62,6 +62,44 @@ def sql_delete_emby_by_tg(tg):
             session.rollback()
             return False
 
+def sql_delete_embys(tgs: list):
+    """
+    根据tg列表批量删除emby记录，一条 DELETE ... IN
+    :return: 删除的条数，失败返回 None
+    """
+    if not tgs:
+        return 0
+    with Session() as session:
+        try:
+            n = session.query(Emby).filter(Emby.tg.in_(tgs)).delete(synchronize_session=False)
+            session.commit()
+            return n
+        except Exception as e:
+            LOGGER.error(f"批量删除数据库记录时发生异常 {e}")
+            session.rollback()
+            return None
+
+
+def sql_clear_embys(tgs: list):
+    """
+    Emby 账户已删除：根据tg列表批量清空账户信息并置为 d 级，一条 UPDATE ... IN
+    :return: 更新的条数，失败返回 None
+    """
+    if not tgs:
+        return 0
+    with Session() as session:
+        try:
+            n = session.query(Emby).filter(Emby.tg.in_(tgs)).update(
+                {Emby.embyid: None, Emby.name: None, Emby.pwd: None, Emby.pwd2: None, Emby.lv: 'd', Emby.cr: None,
+                 Emby.ex: None}, synchronize_session=False)
+            session.commit()
+            return n
+        except Exception as e:
+            LOGGER.error(f"批量清空账户信息时发生异常 {e}")
+            session.rollback()
+            return None
+
+
 def sql_clear_emby_iv():
     """
     清除所有emby的iv
@@ -135,6 +173,26 @@ def sql_update_embys(some_list: list, method=None):
                 print(e)
                 session.rollback()
                 return False
+        if method == 'restore':
+            try:
+                mappings = [{"tg": c[0], "embyid": c[1], "pwd": c[2]} for c in some_list]
+                session.bulk_update_mappings(Emby, mappings)
+                session.commit()
+                return True
+            except Exception as e:
+                LOGGER.error(e)
+                session.rollback()
+                return False
+        if method == 'lv':
+            try:
+                mappings = [{"tg": c[0], "lv": c[1]} for c in some_list]
+                session.bulk_update_mappings(Emby, mappings)
+                session.commit()
+                return True
+            except Exception as e:
+                LOGGER.error(e)
+                session.rollback()
+                return False
 
 
 def sql_get_emby(tg):
@@ -150,6 +208,66 @@ def sql_get_emby(tg):
             return None
 
 
+def sql_get_embys(keys: list):
+    """
+    批量查询emby记录，keys 中每一项可以是 tg、embyid 或 name，一次 IN 查询
+    :return: {key: Emby}，查不到的 key 不在其中；失败返回 None
+    """
+    if not keys:
+        return {}
+    tgs = [int(k) for k in keys if str(k).lstrip('-').isdigit()]
+    names = [str(k) for k in keys]
+    with Session() as session:
+        try:
+            rows = session.query(Emby).filter(
+                or_(Emby.tg.in_(tgs), Emby.name.in_(names), Emby.embyid.in_(names))).all()
+        except Exception as e:
+            LOGGER.error(f"批量查询数据库记录时发生异常 {e}")
+            return None
+    found = {}
+    for key in keys:
+        found_one = next((e for e in rows if str(e.tg) == str(key)), None) or \
+                    next((e for e in rows if str(key) in (e.name, e.embyid)), None)
+        if found_one is not None:
+            found[key] = found_one
+    return found
+
+
+def sql_add_emby_ivs(changes: list):
+    """
+    在一个事务里批量增减积分：锁住涉及的行后逐项检查，最后一条 UPDATE ... CASE 原子累加，
+    积分不足或用户不存在的项跳过，不影响其他项
+    :param changes: [(tg, delta)]，同一 tg 可出现多次，按顺序生效
+    :return: [(code, iv)]，与 changes 一一对应，code 200 成功 / 404 用户不存在 / 400 积分不足；失败返回 None
+    """
+    if not changes:
+        return []
+    with Session() as session:
+        try:
+            ivs = dict(session.query(Emby.tg, Emby.iv).filter(
+                Emby.tg.in_({tg for tg, _ in changes})).with_for_update().all())
+            results, deltas = [], {}
+            for tg, delta in changes:
+                if tg not in ivs:
+                    results.append((404, None))
+                elif (ivs[tg] or 0) + delta < 0:
+                    results.append((400, ivs[tg] or 0))
+                else:
+                    ivs[tg] = (ivs[tg] or 0) + delta
+                    deltas[tg] = deltas.get(tg, 0) + delta
+                    results.append((200, ivs[tg]))
+            if deltas:
+                session.query(Emby).filter(Emby.tg.in_(deltas)).update(
+                    {Emby.iv: func.coalesce(Emby.iv, 0) + case(deltas, value=Emby.tg)},
+                    synchronize_session=False)
+            session.commit()
+            return results
+        except Exception as e:
+            LOGGER.error(f"批量更新积分时发生异常 {e}")
+            session.rollback()
+            return None
+
+
 # def sql_get_emby_by_embyid(embyid):
 #     """
 #     Retrieve an Emby object from the database based on the provided Emby ID.
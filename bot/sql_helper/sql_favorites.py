@@ -1,8 +1,17 @@
+import asyncio
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, UniqueConstraint
+from sqlalchemy import Column, Integer, String, DateTime, UniqueConstraint, Index, tuple_, inspect
+from sqlalchemy.dialects.mysql import insert
 from bot.sql_helper import Base, engine, Session
+from bot.sql_helper.sql_emby import Emby
+from bot.func_helper.favorites_index import favorites_index
 from bot import LOGGER
 
+# 其他进程（接口进程、其他实例）写入的收藏只能靠全量重建看到，索引超过这个时间（秒）后在查询时重建；
+# 平时由定时任务每小时重建，查询时很少需要等待
+index_max_age = 3600
+
+
 class EmbyFavorites(Base):
     """Emby收藏记录表"""
     __tablename__ = 'emby_favorites'
@@ -14,12 +23,16 @@ class EmbyFavorites(Base):
     item_name = Column(String(256), nullable=False, comment="项目名称")
     created_at = Column(DateTime, default=datetime.now, comment="收藏时间")
     
-    # 创建联合唯一索引
+    # 创建联合唯一索引；(item_id, embyid) 覆盖按条目找收藏用户的查询
     __table_args__ = (
         UniqueConstraint('embyid', 'item_id', name='uix_emby_item'),
+        Index('ix_item_emby', 'item_id', 'embyid'),
     ) 
 
 EmbyFavorites.__table__.create(bind=engine, checkfirst=True)
+# 早先建的表没有 ix_item_emby
+if 'ix_item_emby' not in [i['name'] for i in inspect(engine).get_indexes('emby_favorites')]:
+    Index('ix_item_emby', EmbyFavorites.item_id, EmbyFavorites.embyid).create(bind=engine)
 
 def sql_add_favorites(embyid: str, embyname: str, item_id: str, item_name: str, is_favorite: bool = True) -> bool:
     """
@@ -64,6 +77,10 @@ def sql_add_favorites(embyid: str, embyname: str, item_id: str, item_name: str,
                     LOGGER.info(f"删除收藏记录: {embyname} -> {item_name}")
                     
             session.commit()
+            if is_favorite:
+                favorites_index.add(embyid, item_id)
+            else:
+                favorites_index.discard(embyid, item_id)
             return True
             
     except Exception as e:
@@ -76,6 +93,7 @@ def sql_clear_favorites(embyid: str) -> bool:
         with Session() as session:
             session.query(EmbyFavorites).filter(EmbyFavorites.embyid == embyid).delete()
             session.commit()
+        favorites_index.clear_user(embyid)
         return True
     except Exception as e:
         LOGGER.error(f"清除收藏记录失败: {str(e)}")
@@ -88,4 +106,123 @@ def sql_get_favorites(embyid: str, page: int = 1, page_size: int = 20) -> list:
     except Exception as e:
         LOGGER.error(f"获取收藏记录失败: {str(e)}")
         return []
-    
+
+
+def sql_load_favorites_index() -> bool:
+    """从 emby_favorites JOIN emby 全量重建内存倒排索引，耗时较长，在线程里调用"""
+    favorites_index.begin()
+    try:
+        with Session() as session:
+            rows = session.query(EmbyFavorites.item_id, EmbyFavorites.embyid, Emby.tg).join(
+                Emby, EmbyFavorites.embyid == Emby.embyid).all()
+    except Exception as e:
+        favorites_index.abort()
+        LOGGER.error(f"建立收藏索引失败: {str(e)}")
+        return False
+    favorites_index.build(rows)
+    return True
+
+
+# 正在进行的重建
+_rebuilding = None
+
+
+async def sql_rebuild_favorites_index() -> bool:
+    """在线程里重建索引；同时到达的调用共用一次重建"""
+    global _rebuilding
+    if _rebuilding is None:
+        _rebuilding = asyncio.ensure_future(_rebuild())
+    return await asyncio.shield(_rebuilding)
+
+
+async def _rebuild():
+    global _rebuilding
+    try:
+        return await asyncio.to_thread(sql_load_favorites_index)
+    finally:
+        _rebuilding = None
+
+
+def _sql_query_favorite_fans(item_ids: list) -> list:
+    try:
+        with Session() as session:
+            return session.query(EmbyFavorites.item_id, Emby.tg).join(
+                Emby, EmbyFavorites.embyid == Emby.embyid).filter(
+                EmbyFavorites.item_id.in_(item_ids), Emby.tg.isnot(None)).all()
+    except Exception as e:
+        LOGGER.error(f"查询收藏用户失败: {str(e)}")
+        return None
+
+
+async def sql_get_favorite_fans(item_ids: list) -> list:
+    """
+    查出收藏了这些条目中任意一个、且已绑定 tg 的用户。
+    优先查内存索引，索引还没建立或超过 index_max_age 时先在线程里重建，重建失败时退回一次 item_id IN 查询
+    :return: [(item_id, tg)]，查询失败返回 None
+    """
+    if not item_ids:
+        return []
+    if (favorites_index.built and favorites_index.age() < index_max_age) or await sql_rebuild_favorites_index():
+        return favorites_index.fans(item_ids)
+    return await asyncio.to_thread(_sql_query_favorite_fans, item_ids)
+
+
+def sql_get_favorite_ids(embyids: list) -> dict:
+    """批量获取多个用户已存的收藏，返回 {embyid: {item_id: item_name}}"""
+    result = {e: {} for e in embyids}
+    if not embyids:
+        return result
+    try:
+        with Session() as session:
+            rows = session.query(EmbyFavorites.embyid, EmbyFavorites.item_id, EmbyFavorites.item_name).filter(
+                EmbyFavorites.embyid.in_(embyids)).all()
+            for embyid, item_id, item_name in rows:
+                result[embyid][item_id] = item_name
+        return result
+    except Exception as e:
+        LOGGER.error(f"批量获取收藏记录失败: {str(e)}")
+        return None
+
+
+def sql_upsert_favorites(rows: list, chunk: int = 1000) -> bool:
+    """
+    多行 INSERT ... ON DUPLICATE KEY UPDATE
+    :param rows: [{'embyid', 'embyname', 'item_id', 'item_name'}]
+    """
+    if not rows:
+        return True
+    try:
+        with Session() as session:
+            for i in range(0, len(rows), chunk):
+                stmt = insert(EmbyFavorites).values(rows[i:i + chunk])
+                session.execute(stmt.on_duplicate_key_update(embyname=stmt.inserted.embyname,
+                                                             item_name=stmt.inserted.item_name))
+            session.commit()
+        for row in rows:
+            favorites_index.add(row['embyid'], row['item_id'])
+        return True
+    except Exception as e:
+        LOGGER.error(f"批量写入收藏记录失败: {str(e)}")
+        return False
+
+
+def sql_delete_favorites(pairs: list, chunk: int = 1000) -> bool:
+    """
+    批量删除收藏，DELETE ... WHERE (embyid, item_id) IN (...)
+    :param pairs: [(embyid, item_id)]
+    """
+    if not pairs:
+        return True
+    try:
+        with Session() as session:
+            for i in range(0, len(pairs), chunk):
+                session.query(EmbyFavorites).filter(
+                    tuple_(EmbyFavorites.embyid, EmbyFavorites.item_id).in_(pairs[i:i + chunk])).delete(
+                    synchronize_session=False)
+            session.commit()
+        for embyid, item_id in pairs:
+            favorites_index.discard(embyid, item_id)
+        return True
+    except Exception as e:
+        LOGGER.error(f"批量删除收藏记录失败: {str(e)}")
+        return False
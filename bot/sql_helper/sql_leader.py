@@ -0,0 +1,72 @@
+"""
+多实例部署时的主节点租约
+一行一个锁名，持有者定期续期，过期后其他实例可以接管。时间一律用数据库的 NOW()，避免各机器时钟不一致
+"""
+from sqlalchemy import Column, String, DateTime, func, text
+from sqlalchemy.exc import IntegrityError
+
+from bot import LOGGER
+from bot.sql_helper import Base, Session, engine
+
+
+class Leader(Base):
+    """
+    sched_leader表，name为锁名，holder为当前持有者，expires_at为租约到期时间
+    """
+    __tablename__ = 'sched_leader'
+    name = Column(String(64), primary_key=True)
+    holder = Column(String(191), nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+
+Leader.__table__.create(bind=engine, checkfirst=True)
+
+
+def sql_acquire_lease(name: str, holder: str, ttl: int) -> bool:
+    """
+    获取或续期租约：自己持有或已过期时更新为自己，否则失败。
+    :return: 是否持有租约
+    """
+    expires = func.timestampadd(text('SECOND'), ttl, func.now())
+    with Session() as session:
+        try:
+            n = session.query(Leader).filter(Leader.name == name).filter(
+                (Leader.holder == holder) | (Leader.expires_at < func.now())).update(
+                {Leader.holder: holder, Leader.expires_at: expires}, synchronize_session=False)
+            if n == 0 and session.query(Leader).filter(Leader.name == name).first() is None:
+                session.add(Leader(name=name, holder=holder, expires_at=expires))
+                n = 1
+            session.commit()
+            return n > 0
+        except IntegrityError:
+            # 另一个实例同时插入了这一行
+            session.rollback()
+            return False
+        except Exception as e:
+            LOGGER.error(f"获取主节点租约失败 {e}")
+            session.rollback()
+            return False
+
+
+def sql_release_lease(name: str, holder: str):
+    """主动释放，其他实例不必等租约过期"""
+    with Session() as session:
+        try:
+            session.query(Leader).filter(Leader.name == name, Leader.holder == holder).delete(
+                synchronize_session=False)
+            session.commit()
+            return True
+        except Exception as e:
+            LOGGER.error(f"释放主节点租约失败 {e}")
+            session.rollback()
+            return False
+
+
+def sql_get_lease(name: str):
+    """当前租约，没有时返回None"""
+    with Session() as session:
+        try:
+            return session.query(Leader).filter(Leader.name == name).first()
+        except Exception as e:
+            LOGGER.error(f"查询主节点租约失败 {e}")
+            return None
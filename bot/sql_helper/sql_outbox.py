@@ -0,0 +1,88 @@
+"""
+bot 发件箱
+单独运行的接口进程（web.py）没有 Telegram 客户端，需要发的消息写在这里，由 bot 进程轮询取出执行，
+执行成功后删除。多实例部署时只有持有定时任务主节点租约的 bot 进程消费（见 relay.consume），不需要行锁。
+失败的记录按失败次数指数退避，到 next_attempt_at 之后才会再被取出
+"""
+import json
+
+from sqlalchemy import Column, String, Text, DateTime, Integer, func, text
+
+from bot import LOGGER
+from bot.sql_helper import Base, Session, engine
+
+
+class Outbox(Base):
+    """
+    bot_outbox表，action为操作名，payload为json格式的参数，attempts为已失败的次数，next_attempt_at为最早的下次执行时间
+    """
+    __tablename__ = 'bot_outbox'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    action = Column(String(32), nullable=False)
+    payload = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, nullable=False, index=True)
+
+
+Outbox.__table__.create(bind=engine, checkfirst=True)
+
+
+def sql_add_outbox(action: str, payload: dict) -> bool:
+    with Session() as session:
+        try:
+            session.add(Outbox(action=action, payload=json.dumps(payload, ensure_ascii=False),
+                               created_at=func.now(), attempts=0, next_attempt_at=func.now()))
+            session.commit()
+            return True
+        except Exception as e:
+            LOGGER.error(f"写入发件箱失败 {e}")
+            session.rollback()
+            return False
+
+
+def sql_get_outbox(limit: int = 100) -> list:
+    """
+    按写入顺序取出已到执行时间的操作
+    :return: [(id, action, payload, attempts)]
+    """
+    with Session() as session:
+        try:
+            rows = session.query(Outbox.id, Outbox.action, Outbox.payload, Outbox.attempts).filter(
+                Outbox.next_attempt_at <= func.now()).order_by(Outbox.id).limit(limit).all()
+            return [(i, action, json.loads(payload), attempts) for i, action, payload, attempts in rows]
+        except Exception as e:
+            LOGGER.error(f"读取发件箱失败 {e}")
+            return []
+
+
+def sql_delete_outbox(ids: list):
+    """执行完毕（或放弃重试）的操作"""
+    if not ids:
+        return
+    with Session() as session:
+        try:
+            session.query(Outbox).filter(Outbox.id.in_(ids)).delete(synchronize_session=False)
+            session.commit()
+        except Exception as e:
+            LOGGER.error(f"删除发件箱记录失败 {e}")
+            session.rollback()
+
+
+def sql_retry_outbox(ids: list, base: int, cap: int):
+    """
+    执行失败的操作累加失败次数，base * 2^(已失败次数) 秒后重试，最长 cap 秒
+    """
+    if not ids:
+        return
+    delay = func.least(base * func.pow(2, Outbox.attempts), cap)
+    with Session() as session:
+        try:
+            session.query(Outbox).filter(Outbox.id.in_(ids)).update(
+                {Outbox.attempts: Outbox.attempts + 1,
+                 Outbox.next_attempt_at: func.timestampadd(text('SECOND'), delay, func.now())},
+                synchronize_session=False)
+            session.commit()
+        except Exception as e:
+            LOGGER.error(f"更新发件箱记录失败 {e}")
+            session.rollback()
@@ -0,0 +1,171 @@
+"""
+播放记录汇总
+从 Emby 插件的 PlaybackActivity 按天聚合后拉取，每轮替换水位前一天起的汇总，
+日榜、周榜、观影时长榜、设备榜都改为对汇总表求和，不再每次全表扫描 Emby 主机上的 PlaybackActivity
+"""
+import json
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import Column, String, Integer, BigInteger, Date, Text, func, distinct
+from sqlalchemy.dialects.mysql import insert
+
+from bot import LOGGER
+from bot.sql_helper import Base, Session, engine
+
+
+class PlayDaily(Base):
+    """
+    play_daily表，每天每个用户每个条目一行
+    """
+    __tablename__ = 'play_daily'
+    day = Column(Date, primary_key=True)
+    user_id = Column(String(64), primary_key=True)
+    item_id = Column(String(64), primary_key=True)
+    user_name = Column(String(255), nullable=True)
+    item_type = Column(String(32), nullable=False, index=True)
+    name = Column(String(255), nullable=True)
+    plays = Column(Integer, default=0)
+    duration = Column(BigInteger, default=0)
+
+
+class PlayDeviceDaily(Base):
+    """
+    play_device_daily表，每天每个用户每个设备、客户端、ip一行
+    """
+    __tablename__ = 'play_device_daily'
+    day = Column(Date, primary_key=True)
+    user_id = Column(String(64), primary_key=True)
+    device = Column(String(128), primary_key=True)
+    client = Column(String(64), primary_key=True)
+    ip = Column(String(64), primary_key=True)
+    user_name = Column(String(255), nullable=True)
+    plays = Column(Integer, default=0)
+
+
+class PlaybackMeta(Base):
+    """
+    playback_meta表，key: watermark(已汇总到的时间), hidden_users(插件 UserList 中的隐藏用户)
+    """
+    __tablename__ = 'playback_meta'
+    key = Column(String(64), primary_key=True)
+    value = Column(Text, nullable=True)
+
+
+PlayDaily.__table__.create(bind=engine, checkfirst=True)
+PlayDeviceDaily.__table__.create(bind=engine, checkfirst=True)
+PlaybackMeta.__table__.create(bind=engine, checkfirst=True)
+
+
+def sql_get_playback_meta(key: str, default=None):
+    with Session() as session:
+        try:
+            meta = session.query(PlaybackMeta).filter(PlaybackMeta.key == key).first()
+            return json.loads(meta.value) if meta else default
+        except Exception as e:
+            LOGGER.error(f"读取播放汇总状态失败 {e}")
+            return default
+
+
+def sql_get_playback_user_names(user_ids) -> dict:
+    """:return: {user_id: 汇总表里记下的用户名}"""
+    with Session() as session:
+        try:
+            rows = session.query(PlayDaily.user_id, func.max(PlayDaily.user_name)).filter(
+                PlayDaily.user_id.in_(list(user_ids))).group_by(PlayDaily.user_id).all()
+            return {u: n for u, n in rows if n}
+        except Exception as e:
+            LOGGER.error(f"读取播放汇总用户名失败 {e}")
+            return {}
+
+
+def sql_replace_playback_rollup(plays: list, devices: list, start, end, watermark: str, hidden_users: list,
+                                chunk: int = 1000):
+    """
+    用 [start, end) 这些天重新聚合的结果替换汇总表中这些天的行，并在同一事务里更新水位，
+    任一步失败则整体回滚，汇总表保持旧值；重复执行结果相同。先锁住水位行，多个进程同时同步时依次执行
+    :param plays: [{'day', 'user_id', 'item_id', 'user_name', 'item_type', 'name', 'plays', 'duration'}]
+    :param devices: [{'day', 'user_id', 'device', 'client', 'ip', 'user_name', 'plays'}]
+    """
+    with Session() as session:
+        try:
+            session.query(PlaybackMeta).filter(PlaybackMeta.key == 'watermark').with_for_update().first()
+            for model in (PlayDaily, PlayDeviceDaily):
+                session.query(model).filter(model.day >= start, model.day < end).delete(synchronize_session=False)
+            # 截断后的设备名等可能重复，重复的行累加
+            for i in range(0, len(plays), chunk):
+                stmt = insert(PlayDaily).values(plays[i:i + chunk])
+                session.execute(stmt.on_duplicate_key_update(
+                    plays=PlayDaily.plays + stmt.inserted.plays, duration=PlayDaily.duration + stmt.inserted.duration,
+                    user_name=stmt.inserted.user_name, name=stmt.inserted.name))
+            for i in range(0, len(devices), chunk):
+                stmt = insert(PlayDeviceDaily).values(devices[i:i + chunk])
+                session.execute(stmt.on_duplicate_key_update(
+                    plays=PlayDeviceDaily.plays + stmt.inserted.plays, user_name=stmt.inserted.user_name))
+            for key, value in (('watermark', watermark), ('hidden_users', hidden_users)):
+                stmt = insert(PlaybackMeta).values(key=key, value=json.dumps(value))
+                session.execute(stmt.on_duplicate_key_update(value=stmt.inserted.value))
+            session.commit()
+            return True
+        except Exception as e:
+            LOGGER.error(f"写入播放汇总失败 {e}")
+            session.rollback()
+            return False
+
+
+def start_day(days: int):
+    """最近 days 个自然日（含今天，北京时间）的第一天"""
+    return (datetime.now(timezone(timedelta(hours=8))) - timedelta(days=days - 1)).date()
+
+
+def sql_play_report(item_type: str, since, limit: int = 10):
+    """
+    since 日起（含）的榜单，按名称合并，排除插件中的隐藏用户
+    :return: [[UserId, ItemId, ItemType, name, play_count, total_duarion]]，与 emby.get_emby_report 一致
+    """
+    hidden = sql_get_playback_meta('hidden_users', [])
+    with Session() as session:
+        try:
+            q = session.query(func.max(PlayDaily.user_id), func.max(PlayDaily.item_id), PlayDaily.item_type,
+                              PlayDaily.name, func.sum(PlayDaily.plays), func.sum(PlayDaily.duration)).filter(
+                PlayDaily.item_type == item_type, PlayDaily.day >= since)
+            if hidden:
+                q = q.filter(PlayDaily.user_id.notin_(hidden))
+            rows = q.group_by(PlayDaily.item_type, PlayDaily.name).order_by(
+                func.sum(PlayDaily.duration).desc()).limit(limit).all()
+            return [[u, i, t, n, int(c), int(d)] for u, i, t, n, c, d in rows]
+        except Exception as e:
+            LOGGER.error(f"查询播放榜单失败 {e}")
+            return None
+
+
+def sql_play_watch_time(since):
+    """
+    since 日起（含）每个用户的观看时长
+    :return: [[用户名, WatchTime]]，按时长倒序，与 emby.emby_cust_commit(method='sp') 一致
+    """
+    with Session() as session:
+        try:
+            rows = session.query(func.max(PlayDaily.user_name), func.sum(PlayDaily.duration)).filter(
+                PlayDaily.day >= since).group_by(PlayDaily.user_id).order_by(
+                func.sum(PlayDaily.duration).desc()).all()
+            return [[n, int(d)] for n, d in rows]
+        except Exception as e:
+            LOGGER.error(f"查询观看时长失败 {e}")
+            return None
+
+
+def sql_play_devices(offset: int = 0, limit: int = 20):
+    """
+    每个用户用过的设备数、ip 数，按设备数倒序
+    :return: [[用户名, device_count, ip_count]]
+    """
+    with Session() as session:
+        try:
+            device_count = func.count(distinct(func.concat(PlayDeviceDaily.device, PlayDeviceDaily.client)))
+            rows = session.query(func.max(PlayDeviceDaily.user_name), device_count,
+                                 func.count(distinct(PlayDeviceDaily.ip))).group_by(
+                PlayDeviceDaily.user_id).order_by(device_count.desc()).offset(offset).limit(limit).all()
+            return [[n, int(d), int(i)] for n, d, i in rows]
+        except Exception as e:
+            LOGGER.error(f"查询用户设备失败 {e}")
+            return None
@@ -0,0 +1,63 @@
+"""
+接口限流的共享令牌桶
+开启 api.rate_limit.db 时，多个接口进程 / 实例的限额记在这里，每个桶一行，取令牌时锁住该行
+"""
+from sqlalchemy import Column, String, Double
+from sqlalchemy.exc import IntegrityError
+
+from bot import LOGGER
+from bot.sql_helper import Base, Session, engine
+
+
+class RateBucket(Base):
+    """
+    rate_buckets表，key为桶名，tokens为上次更新时剩余的令牌数，updated_at为上次更新的unix时间戳
+    """
+    __tablename__ = 'rate_buckets'
+    key = Column(String(128), primary_key=True)
+    tokens = Column(Double, nullable=False)
+    updated_at = Column(Double, nullable=False, index=True)
+
+
+RateBucket.__table__.create(bind=engine, checkfirst=True)
+
+
+def sql_take_rate_token(key: str, rate: float, burst: float, now: float, cost: float = 1) -> float:
+    """
+    从桶中取 cost 个令牌
+    :return: 需要等待的秒数，0 表示放行；数据库出错时放行，宁可不限也不拒绝正常请求
+    """
+    with Session() as session:
+        try:
+            bucket = session.query(RateBucket).filter(RateBucket.key == key).with_for_update().first()
+            if bucket is None:
+                session.add(RateBucket(key=key, tokens=burst - cost, updated_at=now))
+                session.commit()
+                return 0
+            tokens = min(burst, bucket.tokens + max(0.0, now - bucket.updated_at) * rate)
+            wait = 0 if tokens >= cost else (cost - tokens) / rate
+            bucket.tokens = tokens if wait else tokens - cost
+            bucket.updated_at = now
+            session.commit()
+            return wait
+        except IntegrityError:
+            # 同一个桶被并发首次创建
+            session.rollback()
+            return 0
+        except Exception as e:
+            LOGGER.error(f"限流取令牌失败 {e}")
+            session.rollback()
+            return 0
+
+
+def sql_prune_rate_buckets(before: float):
+    """删除 before 之前就没再用过的桶，它们早已补满，与新建的桶没有区别"""
+    with Session() as session:
+        try:
+            n = session.query(RateBucket).filter(RateBucket.updated_at < before).delete(synchronize_session=False)
+            session.commit()
+            return n
+        except Exception as e:
+            LOGGER.error(f"清理限流记录失败 {e}")
+            session.rollback()
+            return 0
@@ -1,9 +1,9 @@
 from sqlalchemy import Column, String, DateTime, BigInteger, Text, Float
 import datetime
 from bot.sql_helper import Base, Session, engine
-from cacheout import Cache
+from bot.func_helper.metrics import MeteredCache
 
-cache = Cache()
+cache = MeteredCache('request_record')
 
 
 class RequestRecord(Base):
@@ -60,6 +60,14 @@ def sql_get_request_record_by_download_id(download_id: str):
         request_record = session.query(RequestRecord).filter(RequestRecord.download_id == download_id).first()
         return request_record
 
+def sql_get_request_records_by_download_ids(download_ids: list):
+    """一条 IN 查询取出多条记录，返回 {download_id: record}"""
+    if not download_ids:
+        return {}
+    with Session() as session:
+        records = session.query(RequestRecord).filter(RequestRecord.download_id.in_(download_ids)).all()
+        return {r.download_id: r for r in records}
+
 def sql_get_request_record_by_transfer_state(transfer_state: str = None):
     with Session() as session:
         request_record = session.query(RequestRecord).filter(RequestRecord.transfer_state == transfer_state).all()
@@ -86,3 +94,21 @@ def sql_update_request_status(download_id: str, download_state: str, transfer_st
         except Exception as e:
             session.rollback()
             return False
+
+
+def sql_update_request_statuses(rows: list):
+    """
+    批量更新下载状态
+    :param rows: [{'download_id': ..., 'download_state'/'transfer_state'/'progress'/'left_time': ...}]
+    """
+    if not rows:
+        return True
+    with Session() as session:
+        try:
+            now = datetime.datetime.utcnow()
+            session.bulk_update_mappings(RequestRecord, [{**r, 'update_at': now} for r in rows])
+            session.commit()
+            return True
+        except Exception as e:
+            session.rollback()
+            return False
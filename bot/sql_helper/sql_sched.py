@@ -0,0 +1,112 @@
+"""
+定时任务运行记录
+每次运行一行：计划时间、开始、结束、结果，用来排查任务叠加与重启后漏跑
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import Column, Integer, String, DateTime, Text
+
+from bot import LOGGER
+from bot.sql_helper import Base, Session, engine
+
+
+class SchedRun(Base):
+    """
+    sched_runs表，outcome: running, success, error, missed, skipped, interrupted
+    """
+    __tablename__ = 'sched_runs'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(String(191), nullable=False, index=True)
+    scheduled_at = Column(DateTime, nullable=True)
+    started_at = Column(DateTime, nullable=True)
+    ended_at = Column(DateTime, nullable=True)
+    outcome = Column(String(20), default='running')
+    error = Column(Text, nullable=True)
+    items = Column(Integer, nullable=True)
+
+
+SchedRun.__table__.create(bind=engine, checkfirst=True)
+
+
+def sql_add_sched_run(job_id: str, scheduled_at, started_at, outcome='running', error=None):
+    """新增一条运行记录，返回id"""
+    with Session() as session:
+        try:
+            run = SchedRun(job_id=job_id, scheduled_at=scheduled_at, started_at=started_at,
+                           ended_at=None if outcome == 'running' else started_at, outcome=outcome, error=error)
+            session.add(run)
+            session.commit()
+            return run.id
+        except Exception as e:
+            LOGGER.error(f"写入定时任务运行记录失败 {e}")
+            session.rollback()
+            return None
+
+
+def sql_start_sched_run(run_id: int, started_at):
+    """排队的运行真正开始时更新开始时间"""
+    with Session() as session:
+        try:
+            session.query(SchedRun).filter(SchedRun.id == run_id).update({SchedRun.started_at: started_at})
+            session.commit()
+            return True
+        except Exception as e:
+            LOGGER.error(f"更新定时任务运行记录失败 {e}")
+            session.rollback()
+            return False
+
+
+def sql_finish_sched_run(run_id: int, outcome: str, error=None, items=None, ended_at=None):
+    """结束一条运行记录"""
+    with Session() as session:
+        try:
+            session.query(SchedRun).filter(SchedRun.id == run_id).update(
+                {SchedRun.ended_at: ended_at or datetime.now(), SchedRun.outcome: outcome, SchedRun.error: error,
+                 SchedRun.items: items})
+            session.commit()
+            return True
+        except Exception as e:
+            LOGGER.error(f"更新定时任务运行记录失败 {e}")
+            session.rollback()
+            return False
+
+
+def sql_mark_interrupted_runs():
+    """启动时把上次进程遗留的 running 标记为 interrupted"""
+    with Session() as session:
+        try:
+            n = session.query(SchedRun).filter(SchedRun.outcome == 'running').update(
+                {SchedRun.outcome: 'interrupted', SchedRun.ended_at: datetime.now()})
+            session.commit()
+            return n
+        except Exception as e:
+            LOGGER.error(f"标记中断的定时任务失败 {e}")
+            session.rollback()
+            return 0
+
+
+def sql_get_sched_runs(job_id: str = None, limit: int = 20):
+    """最近的运行记录，新的在前"""
+    with Session() as session:
+        try:
+            q = session.query(SchedRun)
+            if job_id:
+                q = q.filter(SchedRun.job_id == job_id)
+            return q.order_by(SchedRun.id.desc()).limit(limit).all()
+        except Exception as e:
+            LOGGER.error(f"查询定时任务运行记录失败 {e}")
+            return []
+
+
+def sql_prune_sched_runs(days: int = 30):
+    """清理 days 天前的运行记录"""
+    with Session() as session:
+        try:
+            n = session.query(SchedRun).filter(
+                SchedRun.started_at < datetime.now() - timedelta(days=days)).delete(synchronize_session=False)
+            session.commit()
+            return n
+        except Exception as e:
+            LOGGER.error(f"清理定时任务运行记录失败 {e}")
+            session.rollback()
+            return 0
@@ -0,0 +1,73 @@
+"""
+webhook 去重记录
+多进程 / 多实例共用同一个 Emby webhook 入口时，内存去重看不到其他进程收过的事件，在这里登记。
+时间一律用数据库的 NOW()
+"""
+from sqlalchemy import Column, String, DateTime, func, text
+from sqlalchemy.exc import IntegrityError
+
+from bot import LOGGER
+from bot.sql_helper import Base, Session, engine
+
+
+class WebhookEvent(Base):
+    """
+    webhook_events表，key为事件去重键的摘要，received_at为首次收到的时间
+    """
+    __tablename__ = 'webhook_events'
+    key = Column(String(64), primary_key=True)
+    received_at = Column(DateTime, nullable=False, index=True)
+
+
+WebhookEvent.__table__.create(bind=engine, checkfirst=True)
+
+
+def sql_claim_webhook_event(key: str, ttl: int) -> bool:
+    """
+    登记一个事件；ttl 秒内已登记过的视为重复
+    :return: True 首次收到（或上次登记已过期），False 重复；数据库出错时返回 True，宁可重复也不丢事件
+    """
+    with Session() as session:
+        try:
+            session.add(WebhookEvent(key=key, received_at=func.now()))
+            session.commit()
+            return True
+        except IntegrityError:
+            session.rollback()
+            # 已过期的记录视为新事件，顺便刷新时间
+            n = session.query(WebhookEvent).filter(
+                WebhookEvent.key == key,
+                WebhookEvent.received_at < func.timestampadd(text('SECOND'), -ttl, func.now())).update(
+                {WebhookEvent.received_at: func.now()}, synchronize_session=False)
+            session.commit()
+            return n > 0
+        except Exception as e:
+            LOGGER.error(f"登记webhook事件失败 {e}")
+            session.rollback()
+            return True
+
+
+def sql_forget_webhook_event(key: str):
+    """事件没能入队时撤销登记，让 Emby 重发的那次能被处理"""
+    with Session() as session:
+        try:
+            session.query(WebhookEvent).filter(WebhookEvent.key == key).delete(synchronize_session=False)
+            session.commit()
+        except Exception as e:
+            LOGGER.error(f"撤销webhook事件失败 {e}")
+            session.rollback()
+
+
+def sql_prune_webhook_events(ttl: int):
+    """清理 ttl 秒之前的记录"""
+    with Session() as session:
+        try:
+            n = session.query(WebhookEvent).filter(
+                WebhookEvent.received_at < func.timestampadd(text('SECOND'), -ttl, func.now())).delete(
+                synchronize_session=False)
+            session.commit()
+            return n
+        except Exception as e:
+            LOGGER.error(f"清理webhook事件失败 {e}")
+            session.rollback()
+            return 0
@@ -11,8 +11,9 @@ import errno
 from fastapi import FastAPI
 from starlette.middleware.cors import CORSMiddleware
 
-from .api import emby_api_route, user_api_route
-from bot import api as config_api, LOGGER
+from .api import emby_api_route, user_api_route, metrics_api_route, health_api_route
+from .api.ratelimit import RateLimitMiddleware, rate_limiter
+from bot import api as config_api, LOGGER, role
 
 
 class Web:
@@ -27,6 +28,7 @@ class Web:
         """
         self.app: FastAPI = FastAPI()
         self.web_api = None
+        self.metrics_api = None
         self.start_api = None
 
     def init_api(self):
@@ -36,6 +38,10 @@ class Web:
         # 添加路由 /
         self.app.include_router(emby_api_route)
         self.app.include_router(user_api_route)
+        self.app.include_router(metrics_api_route)
+        self.app.include_router(health_api_route)
+        # 限流，先于 CORS 添加，位于其内层
+        self.app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
         # 配字 CORS 的中间件
         self.app.add_middleware(
             CORSMiddleware,
@@ -52,28 +58,44 @@ class Web:
             LOGGER.info("【API服务】未配置，跳过...")
             return
         LOGGER.info("【API服务】检测有配置，马上启动服务...")
-        import uvicorn
 
         self.init_api()
-        self.web_api = uvicorn.Server(
-            config=uvicorn.Config(self.app, host=config_api.http_url, port=config_api.http_port)
-        )
-        server_config = self.web_api.config
+        self.web_api = await self._serve(self.app, config_api.http_port)
+        LOGGER.info("【API服务】 启动成功!")
+
+    @staticmethod
+    async def _serve(app: FastAPI, port: int):
+        """在 port 上启动 uvicorn，失败时退出"""
+        import uvicorn
+
+        server = uvicorn.Server(config=uvicorn.Config(app, host=config_api.http_url, port=port))
+        server_config = server.config
         if not server_config.loaded:
             server_config.load()  # 加载配置
-        self.web_api.lifespan = server_config.lifespan_class(server_config)
+        server.lifespan = server_config.lifespan_class(server_config)
         try:
-            await self.web_api.startup()
+            await server.startup()
         except OSError as e:
             if e.errno == errno.EADDRINUSE:
-                LOGGER.error(f"【API服务】端口 {config_api.http_port} 被占用，请修改配置文件.")
+                LOGGER.error(f"【API服务】端口 {port} 被占用，请修改配置文件.")
             LOGGER.error("【API服务】启动失败，退出ing...")
             raise SystemExit from None
-        if self.web_api.should_exit:
+        if server.should_exit:
             LOGGER.error("【API服务】启动失败，退出ing...")
             raise SystemExit from None
+        return server
 
-        LOGGER.info("【API服务】 启动成功!")
+    async def start_metrics(self):
+        """
+        接口单独运行时，bot 进程的指标（Telegram、定时任务、发件箱等）不在 web 进程里，
+        单独在 api.metrics_port 上提供 /metrics
+        """
+        if not config_api.metrics_port:
+            return
+        app = FastAPI()
+        app.include_router(metrics_api_route)
+        self.metrics_api = await self._serve(app, config_api.metrics_port)
+        LOGGER.info(f"【API服务】bot 进程指标在端口 {config_api.metrics_port} 提供")
 
     def stop(self):
         """
@@ -95,4 +117,11 @@ check = Web()
 
 # 初始化
 loop = asyncio.get_event_loop()
-loop.create_task(check.start())
+if not config_api.standalone:
+    loop.create_task(check.start())
+elif role == 'bot' and config_api.status:
+    # 接口由 web.py 单独运行，bot 进程只执行接口转来的 Telegram 操作
+    from bot.func_helper import relay
+
+    loop.create_task(relay.consume())
+    loop.create_task(check.start_metrics())
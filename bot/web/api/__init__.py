@@ -10,10 +10,14 @@ from .ban_playlist import route as ban_playlist_route
 from .webhook.favorites import router as favorites_router
 from .webhook.media import router as media_router
 from .user_info import route as user_info_route
+from .metrics import route as metrics_route
+from .health import route as health_route
 from bot import bot_token, LOGGER
 
 emby_api_route = APIRouter(prefix="/emby", tags=["对接Emby的接口"])
 user_api_route = APIRouter(prefix="/user", tags=["对接用户信息的接口"])
+metrics_api_route = APIRouter(tags=["运行指标"])
+health_api_route = APIRouter(prefix="/health", tags=["健康检查"])
 
 async def verify_token(request: Request):
     """验证API请求的token"""
@@ -48,4 +52,11 @@ user_api_route.include_router(
     user_info_route,
     dependencies=[Depends(verify_token)]
 )
-
+metrics_api_route.include_router(
+    metrics_route,
+    dependencies=[Depends(verify_token)]
+)
+# 健康检查不需要 token，编排和反代的探针直接访问
+health_api_route.include_router(
+    health_route,
+)
@@ -0,0 +1,156 @@
+"""
+健康检查
+/health/live  进程和事件循环还在响应，不访问任何依赖，供重启判断
+/health/ready 并发探测各依赖（数据库、Emby、Navidrome、MoviePilot、Telegram 连接），返回每项的状态和耗时；
+              数据库或 Emby 不可用时返回 503，供编排 / 反代把流量从这个实例上摘掉。
+每项结果缓存 cache_ttl 秒，同时到达的请求共用一次探测，探测频率与请求频率无关
+"""
+import asyncio
+import time
+
+import aiohttp
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from sqlalchemy import text
+
+from bot import emby_url, moviepilot, bot, role
+from bot.func_helper.metrics import registry
+from bot.func_helper.navidrome import navidrome_api
+from bot.sql_helper import engine
+
+route = APIRouter()
+
+# 探测结果的缓存时间（秒）
+cache_ttl = 10
+# 单项探测的超时（秒）
+probe_timeout = 3
+# 超过这个耗时（秒）视为 degraded
+slow_after = 1
+# 这些依赖不可用时实例不可用，其余只算 degraded
+critical = ('db', 'emby')
+started_at = time.time()
+
+
+def _ping_db():
+    with engine.connect() as conn:
+        conn.execute(text('SELECT 1'))
+
+
+async def _get(url, headers=None) -> int:
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=probe_timeout)) as session:
+        async with session.get(url, headers=headers) as resp:
+            return resp.status
+
+
+async def probe_db():
+    await asyncio.to_thread(_ping_db)
+
+
+async def probe_emby():
+    status = await _get(f'{emby_url}/emby/System/Info/Public')
+    if status != 200:
+        raise RuntimeError(f'HTTP {status}')
+
+
+async def probe_navidrome():
+    result = await navidrome_api.ping()
+    if not result or result.get('subsonic-response', {}).get('status') != 'ok':
+        raise RuntimeError((result or {}).get('error', 'ping 失败'))
+
+
+async def probe_moviepilot():
+    status = await _get(f'{moviepilot.url}/api/v1/user/current', headers={'Authorization': moviepilot.access_token or ''})
+    # token 过期不影响连通性，下次真正调用时会重新登录
+    if status in (401, 403):
+        return 'token 失效'
+    if status != 200:
+        raise RuntimeError(f'HTTP {status}')
+
+
+async def probe_telegram():
+    if not bot.is_connected:
+        raise RuntimeError('未连接')
+
+
+# 名称 -> (探测函数, 是否启用)
+probes = {
+    'db': (probe_db, True),
+    'emby': (probe_emby, bool(emby_url)),
+    'navidrome': (probe_navidrome, navidrome_api is not None),
+    'moviepilot': (probe_moviepilot, moviepilot.status and bool(moviepilot.url)),
+    # 单独运行的接口进程不连接 Telegram
+    'telegram': (probe_telegram, role == 'bot'),
+}
+
+
+class HealthChecker:
+    def __init__(self):
+        # name -> (完成时间, 结果)
+        self._results = {}
+        # name -> 正在进行的探测
+        self._inflight = {}
+
+    async def _run(self, name, func):
+        start = time.perf_counter()
+        try:
+            detail = await asyncio.wait_for(func(), probe_timeout)
+            latency = time.perf_counter() - start
+            state = 'degraded' if detail or latency > slow_after else 'ok'
+        except asyncio.TimeoutError:
+            latency, state, detail = time.perf_counter() - start, 'down', f'超过 {probe_timeout}s 未响应'
+        except Exception as e:
+            latency, state, detail = time.perf_counter() - start, 'down', f'{type(e).__name__}: {e}'[:200]
+        finally:
+            self._inflight.pop(name, None)
+        result = {'state': state, 'latency_ms': round(latency * 1000, 1)}
+        if detail:
+            result['detail'] = detail
+        self._results[name] = (time.time(), result)
+
+    async def check(self, name: str) -> dict:
+        func, enabled = probes[name]
+        if not enabled:
+            return {'state': 'disabled'}
+        cached = self._results.get(name)
+        if cached is None or time.time() - cached[0] >= cache_ttl:
+            task = self._inflight.get(name)
+            if task is None:
+                task = self._inflight[name] = asyncio.create_task(self._run(name, func))
+            # 请求被取消时探测照常完成，结果留给下一个请求
+            await asyncio.shield(task)
+            cached = self._results[name]
+        return {**cached[1], 'age_s': round(time.time() - cached[0], 1)}
+
+    async def ready(self) -> dict:
+        results = await asyncio.gather(*(self.check(name) for name in probes))
+        checks = dict(zip(probes, results))
+        if any(checks[name]['state'] == 'down' for name in critical):
+            status = 'unready'
+        elif any(c['state'] in ('down', 'degraded') for c in checks.values()):
+            status = 'degraded'
+        else:
+            status = 'ready'
+        return {'status': status, 'checks': checks}
+
+    def cached(self) -> dict:
+        """最近一次的探测结果，不触发探测"""
+        return {name: result for name, (_, result) in self._results.items()}
+
+
+health = HealthChecker()
+registry.collector('bot_dependency_up', '依赖最近一次探测是否可用（degraded 也算可用）',
+                   lambda: {(('dependency', n),): int(r['state'] != 'down') for n, r in health.cached().items()})
+registry.collector('bot_dependency_latency_seconds', '依赖最近一次探测的耗时',
+                   lambda: {(('dependency', n),): r['latency_ms'] / 1000 for n, r in health.cached().items()})
+
+
+@route.get("/live")
+async def live():
+    return {'status': 'alive', 'role': role, 'uptime_s': round(time.time() - started_at)}
+
+
+@route.get("/ready")
+async def ready():
+    result = await health.ready()
+    return JSONResponse(result, status_code=503 if result['status'] == 'unready' else 200,
+                        headers={'Cache-Control': 'no-store'})
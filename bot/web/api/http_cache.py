@@ -0,0 +1,46 @@
+"""
+只读接口的响应缓存
+查询结果在内存里按 key 缓存 ttl 秒；响应带 ETag（返回内容的摘要）和 Cache-Control，
+客户端带 If-None-Match 且内容未变时直接回 304，nginx 等反代也可以按 Cache-Control 缓存
+"""
+import hashlib
+import json
+
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+
+from bot.func_helper.metrics import MeteredCache
+
+# 内存缓存和 Cache-Control 的有效期（秒），面板每几秒轮询一次，短一些既能挡住重复查询又不至于太旧
+ttl = 5
+response_cache = MeteredCache('api_response', maxsize=10000, ttl=ttl)
+
+
+def etag_of(data) -> str:
+    raw = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    return f'"{hashlib.sha1(raw.encode()).hexdigest()[:20]}"'
+
+
+def cached(key, loader):
+    """取缓存，未命中时调用 loader() 并缓存其结果"""
+    value = response_cache.get(key)
+    if value is None:
+        value = loader()
+        response_cache.set(key, value)
+    return value
+
+
+def invalidate(*keys):
+    """数据被本进程修改后立即失效，不必等 ttl"""
+    for key in keys:
+        response_cache.delete(key)
+
+
+def conditional_json(request: Request, data, max_age: int = ttl) -> Response:
+    """返回 data；If-None-Match 与当前 ETag 一致时回 304 不带内容"""
+    etag = etag_of(data)
+    headers = {'ETag': etag, 'Cache-Control': f'public, max-age={max_age}'}
+    if_none_match = request.headers.get('if-none-match', '')
+    if etag in [t.strip().removeprefix('W/') for t in if_none_match.split(',')] or if_none_match.strip() == '*':
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(data, headers=headers)
@@ -0,0 +1,79 @@
+"""
+Prometheus 抓取入口
+单独运行且 api.workers > 1 时每个工作进程各有一份指标，抓取请求只会落到其中一个。
+所以各进程定期把自己的指标写到 snapshot_dir，/metrics 合并所有进程的输出，样本带 worker 标签区分，
+查询时用 sum without (worker) 汇总。bot 进程的指标见 api.metrics_port
+"""
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from bot import api as config_api, LOGGER, role
+from bot.func_helper.metrics import registry
+
+route = APIRouter()
+
+merge_workers = role == 'web' and config_api.workers > 1
+snapshot_dir = os.path.join(tempfile.gettempdir(), f'embyboss-metrics-{config_api.http_port}')
+snapshot_interval = 10
+# 超过这个时间没有更新的快照视为进程已退出，删除
+snapshot_stale = 60
+_worker = (('worker', str(os.getpid())),)
+
+
+def _write_snapshot():
+    os.makedirs(snapshot_dir, exist_ok=True)
+    path = os.path.join(snapshot_dir, f'{os.getpid()}.json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(registry.collect(_worker), f, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+
+
+def _read_snapshots() -> list:
+    """:return: 其他工作进程的 collect() 结果"""
+    result = []
+    try:
+        names = os.listdir(snapshot_dir)
+    except FileNotFoundError:
+        return result
+    for name in names:
+        if not name.endswith('.json') or name == f'{os.getpid()}.json':
+            continue
+        path = os.path.join(snapshot_dir, name)
+        try:
+            if time.time() - os.path.getmtime(path) > snapshot_stale:
+                os.remove(path)
+                continue
+            with open(path, encoding='utf-8') as f:
+                families = json.load(f)
+        except (OSError, ValueError):
+            continue
+        # json 里标签是列表，转回元组
+        result.append({k: [h, t, [(s, tuple(map(tuple, l)), v) for s, l, v in samples]]
+                       for k, (h, t, samples) in families.items()})
+    return result
+
+
+async def write_snapshots():
+    """工作进程启动后定期写快照"""
+    while True:
+        try:
+            await asyncio.to_thread(_write_snapshot)
+        except Exception as e:
+            LOGGER.warning(f'【metrics】写入指标快照失败 {e}')
+        await asyncio.sleep(snapshot_interval)
+
+
+@route.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """进程内全部指标，Prometheus 文本格式；多个工作进程时合并所有进程"""
+    if merge_workers:
+        text = registry.render(_worker, await asyncio.to_thread(_read_snapshots))
+    else:
+        text = registry.render()
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4; charset=utf-8")
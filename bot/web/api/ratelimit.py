@@ -0,0 +1,135 @@
+"""
+接口限流
+令牌桶：带有效 token 的请求按 token + 客户端 ip 计，同一个 token 分给多个调用方（Emby webhook、商城前端、看板）时互不挤占；
+其他请求按客户端 ip 计。每个路径另有一个所有客户端合计的桶（route，routes 里的路径或以 / 结尾的前缀单独设置），保护 ban_playlist 这类会写 Emby 的接口。
+任一个桶取不到令牌就回 429 和 Retry-After。接口再忙也只占用有限的事件循环时间，不至于拖慢 Telegram 的处理。
+桶默认在进程内存里；开启 api.rate_limit.db 时客户端的桶记在数据库，多个接口进程 / 实例共享限额。
+路径的桶始终在内存里按进程计：放进数据库的话，同一路径的所有请求都要排队锁同一行
+"""
+import asyncio
+import hashlib
+import math
+import time
+
+from cacheout import Cache
+from fastapi import Request
+from fastapi.responses import JSONResponse
+
+from bot import LOGGER, bot_token, api as config_api
+from bot.func_helper.metrics import registry
+from bot.func_helper.scheduler import scheduler
+from bot.sql_helper.sql_ratelimit import sql_take_rate_token, sql_prune_rate_buckets
+
+# 内存中最多保存的桶数，超出时淘汰最早的（被淘汰的桶相当于重新补满）
+max_buckets = 100000
+# 数据库中的桶多久没用就删除（秒）
+db_keep = 3600
+
+
+class MemoryBuckets:
+    def __init__(self):
+        # key -> (剩余令牌, 上次更新的时间)
+        self._buckets = Cache(maxsize=max_buckets)
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1) -> float:
+        """:return: 需要等待的秒数，0 表示放行"""
+        now = time.monotonic()
+        tokens, last = self._buckets.get(key) or (burst, now)
+        tokens = min(burst, tokens + (now - last) * rate)
+        wait = 0 if tokens >= cost else (cost - tokens) / rate
+        # 补满所需的时间之后，桶与新建的没有区别，可以过期
+        self._buckets.set(key, (tokens if wait else tokens - cost, now), ttl=burst / rate + 1)
+        return wait
+
+
+class DbBuckets:
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1) -> float:
+        return await asyncio.to_thread(sql_take_rate_token, key, rate, burst, time.time(), cost)
+
+
+class RateLimiter:
+    def __init__(self, conf):
+        self.conf = conf
+        self.buckets = DbBuckets() if conf.db else MemoryBuckets()
+        self.route_buckets = MemoryBuckets()
+        self.stats = {'allowed': 0, 'limited_token': 0, 'limited_ip': 0, 'limited_route': 0}
+
+    def client_ip(self, request: Request) -> str:
+        """经过受信任的反代时取反代记录的客户端地址，否则取连接的对端地址"""
+        host = request.client.host if request.client else ''
+        if host not in self.conf.trusted_proxies:
+            return host
+        # X-Forwarded-For 从右往左是离我们由近到远的各跳，第一个不是受信任反代的就是客户端
+        for addr in reversed(request.headers.get('x-forwarded-for', '').split(',')):
+            addr = addr.strip()
+            if addr and addr not in self.conf.trusted_proxies:
+                return addr
+        return request.headers.get('x-real-ip', host)
+
+    def route_limit(self, path: str):
+        """:return: 路径的 [每秒补充数, 容量]，精确匹配优先，其次是最长的 / 结尾前缀，都没有时用 route"""
+        routes = self.conf.routes
+        if path in routes:
+            return routes[path]
+        prefixes = [p for p in routes if p.endswith('/') and path.startswith(p)]
+        return routes[max(prefixes, key=len)] if prefixes else self.conf.route
+
+    async def check(self, request: Request):
+        """
+        :return: (需要等待的秒数, 超限的桶类型)，放行时为 (0, None)
+        """
+        token = request.query_params.get('token')
+        ip = self.client_ip(request)
+        if token and token == bot_token:
+            # 无效的 token 按 ip 计，换着假 token 请求拿不到新桶
+            kind, key = 'token', f'{hashlib.sha1(token.encode()).hexdigest()[:16]}:{ip}'
+        else:
+            kind, key = 'ip', ip
+        path = request.url.path
+        # 先扣客户端自己的桶，被拒的请求不占用路径的总量
+        buckets = [(kind, key, getattr(self.conf, kind), self.buckets),
+                   ('route', path, self.route_limit(path), self.route_buckets)]
+        for kind, key, (rate, burst), store in buckets:
+            if rate <= 0:
+                continue
+            wait = await store.take(f'{kind}:{key}', rate, burst)
+            if wait:
+                self.stats[f'limited_{kind}'] += 1
+                return wait, kind
+        self.stats['allowed'] += 1
+        return 0, None
+
+
+class RateLimitMiddleware:
+    """纯 ASGI 中间件，须在 CORS 中间件之前添加，429 响应也能带上跨域头"""
+
+    def __init__(self, app, limiter: RateLimiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self.limiter.conf.status:
+            return await self.app(scope, receive, send)
+        wait, kind = await self.limiter.check(Request(scope))
+        if wait:
+            response = JSONResponse({'detail': 'Too Many Requests', 'limit': kind}, status_code=429,
+                                    headers={'Retry-After': str(math.ceil(wait))})
+            return await response(scope, receive, send)
+        await self.app(scope, receive, send)
+
+
+rate_limiter = RateLimiter(config_api.rate_limit)
+registry.collector('bot_api_rate_limited_total', '被限流的接口请求数，按桶类型',
+                   lambda: {(('limit', k.removeprefix('limited_')),): v for k, v in rate_limiter.stats.items()
+                            if k != 'allowed'}, kind='counter')
+
+
+def prune_rate_buckets():
+    n = sql_prune_rate_buckets(time.time() - db_keep)
+    if n:
+        LOGGER.info(f"清理了 {n} 条不再使用的限流记录")
+    return n
+
+
+if rate_limiter.conf.db:
+    scheduler.add_job(prune_rate_buckets, 'cron', hour=4, minute=20, id='prune_rate_buckets')
@@ -8,21 +8,95 @@ Date:2024/8/27
 
 import json
 from fastapi import APIRouter, Request
-from bot.sql_helper.sql_emby import Emby, sql_get_emby, sql_update_emby
+from bot.sql_helper.sql_emby import sql_get_emby, sql_get_embys, sql_add_emby_ivs
+from .http_cache import cached, invalidate, conditional_json, response_cache
 
 route = APIRouter()
 
 
-@route.get("/user_info")
-async def user_info(tg: str):
-    # 从数据库获取用户信息
-    user = sql_get_emby(tg)
+# 批量接口一次最多处理的条数
+max_batch = 500
+
+
+async def read_data(request: Request):
+    """请求体可以是 json，也可以是 form-data 里的 data 字段"""
+    content_type = request.headers.get("content-type", "").lower()
+    if "application/json" in content_type:
+        data = await request.json()
+        if isinstance(data, str):
+            data = json.loads(data)
+        return data
+    form_data = await request.form()
+    return json.loads(form_data["data"]) if "data" in form_data else {}
 
+
+def user_result(user):
     if not user:
         return {"code": 404, "message": "用户不存在"}
     return {"code": 200, "data": {"tg": user.tg, "iv": user.iv}}
 
 
+def cache_key(tg) -> str:
+    return f"user_info:{tg}"
+
+
+@route.get("/user_info")
+async def user_info(tg: str, request: Request):
+    # 从数据库获取用户信息，几秒内的重复轮询直接用缓存，内容没变时回 304
+    result = cached(cache_key(tg), lambda: user_result(sql_get_emby(tg)))
+    return conditional_json(request, result)
+
+
+@route.post("/user_info/batch")
+async def user_info_batch(request: Request):
+    """
+    批量获取用户信息，一次 IN 查询
+    请求: {"tgs": [tg, ...]}
+    返回: 与 tgs 一一对应的结果，每项与 /user_info 相同并带上 tg
+    """
+    try:
+        tgs = (await read_data(request)).get("tgs")
+        if not isinstance(tgs, list) or not tgs:
+            return {"code": 400, "message": "参数错误"}
+        if len(tgs) > max_batch:
+            return {"code": 400, "message": f"单次最多 {max_batch} 个"}
+
+        # 与 /user_info 共用缓存，只查缓存里没有的
+        hits = {tg: response_cache.get(cache_key(tg)) for tg in tgs}
+        misses = [tg for tg, result in hits.items() if result is None]
+        if misses:
+            users = sql_get_embys(misses)
+            if users is None:
+                return {"code": 500, "message": "查询失败"}
+            for tg in misses:
+                hits[tg] = user_result(users.get(tg))
+                response_cache.set(cache_key(tg), hits[tg])
+        return {"code": 200, "data": [{"tg": tg, **hits[tg]} for tg in tgs]}
+    except json.JSONDecodeError:
+        return {"code": 400, "message": "无效的JSON格式"}
+    except Exception as e:
+        return {"code": 500, "message": f"服务器错误: {str(e)}"}
+
+
+def parse_changes(items: list):
+    """
+    与 sql_get_emby 一样，tg 可以填 tg、embyid 或 name（name 也可能是纯数字），一次查出对应的 tg
+    :return: [(tg, credit)]，与 items 一一对应，参数错误的项为 None，找不到用户的项 tg 为 None
+    """
+    changes = []
+    for item in items:
+        try:
+            tg, credit = item.get("tg"), item.get("credit")
+            valid = tg and isinstance(tg, (str, int)) and credit is not None
+            changes.append((tg, int(credit)) if valid else None)
+        except (AttributeError, TypeError, ValueError):
+            changes.append(None)
+    users = sql_get_embys(list({c[0] for c in changes if c is not None}))
+    if users is None:
+        raise RuntimeError("查询用户失败")
+    return [None if c is None else ((users[c[0]].tg if c[0] in users else None), c[1]) for c in changes]
+
+
 @route.post("/update_credit")
 async def update_credit(request: Request):
     """
@@ -30,40 +104,67 @@ async def update_credit(request: Request):
     :param request: 请求对象
     """
     try:
-        content_type = request.headers.get("content-type", "").lower()
-        if "application/json" in content_type:
-            data = await request.json()
-            if isinstance(data, str):
-                data = json.loads(data)
-        else:
-            form_data = await request.form()
-            data = json.loads(form_data["data"]) if "data" in form_data else {}
-
-        tg = data.get("tg")
-        credit = data.get("credit")
-        if not tg or credit is None:
+        data = await read_data(request)
+        change = parse_changes([data])[0]
+        if change is None:
             return {"code": 400, "message": "参数错误"}
-
-        # 获取用户信息
-        user = sql_get_emby(tg)
-        if not user:
+        if change[0] is None:
             return {"code": 404, "message": "用户不存在"}
 
-        # 计算新的积分值
-        new_iv = user.iv + int(credit)
-        if new_iv < 0:
+        # 检查余额和累加在同一个事务里完成，并发请求不会互相覆盖
+        res = sql_add_emby_ivs([change])
+        invalidate(cache_key(change[0]), cache_key(data.get("tg")))
+        if res is None:
+            return {"code": 500, "message": "更新失败"}
+        code, iv = res[0]
+        if code == 404:
+            return {"code": 404, "message": "用户不存在"}
+        if code == 400:
             return {"code": 400, "message": "积分不足"}
-        # 更新用户积分
-        user.iv = new_iv
-        res = sql_update_emby(Emby.tg == tg, iv=new_iv)
-        if res:
-
-            return {
-                "code": 200,
-                "data": {"tg": user.tg, "iv": user.iv, "changed": credit},
-            }
-        else:
+        return {
+            "code": 200,
+            "data": {"tg": change[0], "iv": iv, "changed": data.get("credit")},
+        }
+    except json.JSONDecodeError:
+        return {"code": 400, "message": "无效的JSON格式"}
+    except Exception as e:
+        return {"code": 500, "message": f"服务器错误: {str(e)}"}
+
+
+@route.post("/update_credit/batch")
+async def update_credit_batch(request: Request):
+    """
+    批量修改用户积分，全部在一个事务里原子累加，单项失败不影响其他项
+    请求: {"items": [{"tg": tg, "credit": 变动值}, ...]}，同一 tg 可出现多次，按顺序生效
+    返回: 与 items 一一对应的结果，每项与 /update_credit 相同并带上 tg
+    """
+    try:
+        items = (await read_data(request)).get("items")
+        if not isinstance(items, list) or not items:
+            return {"code": 400, "message": "参数错误"}
+        if len(items) > max_batch:
+            return {"code": 400, "message": f"单次最多 {max_batch} 个"}
+
+        changes = parse_changes(items)
+        res = sql_add_emby_ivs([c for c in changes if c is not None and c[0] is not None])
+        invalidate(*{cache_key(c[0]) for c in changes if c is not None and c[0] is not None},
+                   *{cache_key(item.get("tg")) for item in items if isinstance(item, dict)})
+        if res is None:
             return {"code": 500, "message": "更新失败"}
+        res = iter(res)
+        messages = {404: "用户不存在", 400: "积分不足"}
+        results = []
+        for item, change in zip(items, changes):
+            tg = item.get("tg") if isinstance(item, dict) else None
+            if change is None:
+                results.append({"tg": tg, "code": 400, "message": "参数错误"})
+                continue
+            code, iv = next(res) if change[0] is not None else (404, None)
+            if code == 200:
+                results.append({"tg": tg, "code": 200, "data": {"tg": change[0], "iv": iv, "changed": change[1]}})
+            else:
+                results.append({"tg": tg, "code": code, "message": messages[code]})
+        return {"code": 200, "data": results}
     except json.JSONDecodeError:
         return {"code": 400, "message": "无效的JSON格式"}
     except Exception as e:
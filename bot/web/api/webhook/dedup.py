@@ -0,0 +1,78 @@
+"""
+webhook 去重
+Emby 在响应慢时会重发 webhook，媒体库刷新也会对同一条目多次发送 item.added / library.new。
+按 (事件, 条目, 用户, ...) 生成去重键，首次收到后 ttl 秒内的同一键视为重复。先查进程内的有界 TTL 缓存，
+开启 api.webhook_dedup_db 时再到数据库登记（在线程里，不阻塞事件循环），多进程部署也只处理一次
+"""
+import asyncio
+import hashlib
+
+from cacheout import Cache
+
+from bot import LOGGER, api as config_api
+from bot.func_helper.metrics import registry
+from bot.func_helper.scheduler import scheduler
+from bot.sql_helper.sql_webhook import sql_claim_webhook_event, sql_forget_webhook_event, sql_prune_webhook_events
+
+# 内存中最多记住的事件数，超出时淘汰最早的
+max_size = 20000
+# 数据库记录保留的最长时间（秒），应不小于各路由的 ttl
+db_keep = 24 * 3600
+
+
+class WebhookDedup:
+    def __init__(self, use_db: bool = False):
+        self.use_db = use_db
+        self._seen = Cache(maxsize=max_size)
+        self.stats = {'checked': 0, 'dropped_memory': 0, 'dropped_db': 0}
+
+    @staticmethod
+    def make_key(event: str, item_id: str, user_id: str, *extra) -> str:
+        """
+        :param extra: 其他区分事件的字段；只想去掉 Emby 的重发时带上请求的 Date，重发的 Date 完全相同
+        """
+        raw = '|'.join(str(p) for p in (event, item_id, user_id, *extra))
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    async def claim(self, key: str, ttl: int) -> bool:
+        """
+        :param ttl: 从首次收到算起，这段时间（秒）内的同一键视为重复
+        :return: True 首次收到，应当处理；False 重复，应当丢弃
+        """
+        self.stats['checked'] += 1
+        if self._seen.get(key) is not None:
+            self.stats['dropped_memory'] += 1
+            return False
+        # 先占住内存里的键，等数据库期间同时到达的同一事件直接丢弃
+        self._seen.set(key, 1, ttl=ttl)
+        if self.use_db and not await asyncio.to_thread(sql_claim_webhook_event, key, ttl):
+            self.stats['dropped_db'] += 1
+            return False
+        return True
+
+    async def forget(self, key: str):
+        """事件没能入队时撤销，让重发的那次能被处理"""
+        self._seen.delete(key)
+        if self.use_db:
+            await asyncio.to_thread(sql_forget_webhook_event, key)
+
+    def info(self) -> dict:
+        return {'size': len(self._seen), 'use_db': self.use_db, **self.stats,
+                'dropped': self.stats['dropped_memory'] + self.stats['dropped_db']}
+
+
+webhook_dedup = WebhookDedup(config_api.webhook_dedup_db)
+registry.collector('bot_webhook_duplicates_total', '丢弃的重复 webhook 事件数，按命中位置',
+                   lambda: {(('source', 'memory'),): webhook_dedup.stats['dropped_memory'],
+                            (('source', 'db'),): webhook_dedup.stats['dropped_db']}, kind='counter')
+
+
+def prune_webhook_events():
+    n = sql_prune_webhook_events(db_keep)
+    if n:
+        LOGGER.info(f"清理了 {n} 条过期的webhook去重记录")
+    return n
+
+
+if webhook_dedup.use_db:
+    scheduler.add_job(prune_webhook_events, 'cron', hour=4, minute=10, id='prune_webhook_events')
@@ -1,11 +1,18 @@
 from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
 from bot.sql_helper.sql_favorites import sql_add_favorites
+from bot.func_helper.favorites_index import favorites_index
+from bot.scheduler.sync_favorites import request_resync
 from bot.sql_helper.sql_emby import Emby
 from bot.sql_helper import Session
-from bot import LOGGER, bot
-import json
+from bot import LOGGER
+from bot.func_helper import relay
+from .ingest import webhook_queue, read_payload, retry_after
+from .dedup import webhook_dedup
 
 router = APIRouter()
+# 收藏事件在内存 / 数据库中记住多久（秒）
+dedup_ttl = 600
 
 async def send_favorite_notification(tg_id: int, embyname: str, item_name: str, is_favorite: bool):
     """发送收藏通知到Telegram"""
@@ -13,105 +20,101 @@ async def send_favorite_notification(tg_id: int, embyname: str, item_name: str,
         action = "收藏" if is_favorite else "取消收藏"
         message = f"📢 您的Emby账号 {embyname} {action}了《{item_name}》"
         
-        await bot.send_message(
-            chat_id=tg_id,
-            text=message
-        )
+        await relay.send_message(tg_id, message)
         LOGGER.info(f"已发送{action}通知到用户 {tg_id}")
     except Exception as e:
         LOGGER.error(f"发送通知失败: {str(e)}")
 
+async def process_favorite_event(webhook_data: dict):
+    """队列 worker 中处理一条收藏变更：写库、通知用户、安排对账"""
+    # 提取用户和项目信息
+    user_data = webhook_data.get("User", {})
+    item_data = webhook_data.get("Item", {})
+
+    # 获取关键数据
+    embyid = user_data.get("Id", "")
+    embyname = user_data.get("Name", "")
+    item_id = item_data.get("Id", "")
+    item_name = item_data.get("Name", "")
+
+    # 检查收藏状态
+    is_favorite = item_data.get("UserData", {}).get("IsFavorite", False)
+
+    # 保存到数据库
+    save_result = sql_add_favorites(
+        embyid=embyid,
+        embyname=embyname,
+        item_id=item_id,
+        item_name=item_name,
+        is_favorite=is_favorite
+    )
+
+    if save_result:
+        action = "收藏" if is_favorite else "取消收藏"
+        LOGGER.info(f"用户 {embyname} {action}了项目 {item_name}")
+
+        # 创建新的session来查询用户
+        session = Session()
+        try:
+            user = session.query(Emby).filter(
+                Emby.embyid == embyid
+            ).first()
+        finally:
+            session.close()  # 确保session被关闭
+        # 顺便刷新索引里该用户绑定的 tg
+        favorites_index.set_tg(embyid, user.tg if user else None)
+
+        if user and user.tg:
+            # 发送Telegram通知
+            await send_favorite_notification(
+                tg_id=user.tg,
+                embyname=embyname,
+                item_name=item_name,
+                is_favorite=is_favorite
+            )
+    else:
+        LOGGER.error(f"操作收藏记录失败")
+    # 稍后对该用户差分对账一次，补上漏发或写入失败的事件
+    request_resync(embyid)
+
+
 @router.post("/webhook/favorites")
 async def handle_favorite_webhook(request: Request):
-    """处理Emby服务器发送的收藏变更webhook"""
+    """接收Emby服务器发送的收藏变更webhook，校验后放入队列，立即返回 202"""
     try:
-        # 检查Content-Type
-        content_type = request.headers.get("content-type", "").lower()
-        
-        if "application/json" in content_type:
-            # 处理JSON格式
-            webhook_data = await request.json()
-        else:
-            # 处理form-data格式
-            form_data = await request.form()
-            form = dict(form_data)
-            webhook_data = json.loads(form["data"]) if "data" in form else None
-            
-        if not webhook_data:
-            return {
-                "status": "error",
-                "message": "No data received"
-            }
-            
-        # 提取用户和项目信息
-        user_data = webhook_data.get("User", {})
-        item_data = webhook_data.get("Item", {})
-        
-        # 获取关键数据
-        embyid = user_data.get("Id", "")
-        embyname = user_data.get("Name", "")
-        item_id = item_data.get("Id", "")
-        item_name = item_data.get("Name", "")
-        
-        # 检查收藏状态
-        is_favorite = item_data.get("UserData", {}).get("IsFavorite", False)
-        
-        # 构建返回数据
-        response_data = {
-            "user": {
-                "name": embyname,
-                "id": embyid
-            },
-            "item": {
-                "name": item_name,
-                "id": item_id
-            },
+        webhook_data = await read_payload(request)
+    except Exception as e:
+        LOGGER.error(f"解析Webhook失败: {str(e)}")
+        return JSONResponse(status_code=400, content={"status": "error", "message": str(e)})
+
+    if not webhook_data:
+        return JSONResponse(status_code=400, content={"status": "error", "message": "No data received"})
+
+    user_data = webhook_data.get("User") or {}
+    item_data = webhook_data.get("Item") or {}
+    if not user_data.get("Id") or not item_data.get("Id"):
+        return JSONResponse(status_code=400, content={"status": "error", "message": "Missing User.Id or Item.Id"})
+
+    # Emby 重发的请求 Date 相同，只去掉重发，不合并用户短时间内的多次操作
+    is_favorite = item_data.get("UserData", {}).get("IsFavorite", False)
+    key = webhook_dedup.make_key(webhook_data.get("Event", ""), item_data["Id"], user_data["Id"],
+                                 webhook_data.get("Date", ""), is_favorite)
+    if not await webhook_dedup.claim(key, dedup_ttl):
+        return {"status": "duplicate", "message": "Favorite event already received"}
+
+    if not webhook_queue.submit(process_favorite_event, webhook_data):
+        await webhook_dedup.forget(key)
+        return JSONResponse(status_code=503, headers={"Retry-After": str(retry_after)},
+                            content={"status": "busy", "message": "Webhook queue is full"})
+    return JSONResponse(status_code=202, content={
+        "status": "accepted",
+        "message": "Favorite event queued",
+        "data": {
+            "user": {"name": user_data.get("Name", ""), "id": user_data["Id"]},
+            "item": {"name": item_data.get("Name", ""), "id": item_data["Id"]},
             "is_favorite": is_favorite,
             "event": webhook_data.get("Event", ""),
-            "date": webhook_data.get("Date", "")
-        }
-        # 保存到数据库
-        save_result = sql_add_favorites(
-            embyid=embyid,
-            embyname=embyname,
-            item_id=item_id,
-            item_name=item_name,
-            is_favorite=is_favorite
-        )
-        
-        if save_result:
-            action = "收藏" if is_favorite else "取消收藏"
-            LOGGER.info(f"用户 {embyname} {action}了项目 {item_name}")
-            
-            # 创建新的session来查询用户
-            session = Session()
-            try:
-                user = session.query(Emby).filter(
-                    Emby.embyid == embyid
-                ).first()
-                
-                if user and user.tg:
-                    # 发送Telegram通知
-                    await send_favorite_notification(
-                        tg_id=user.tg,
-                        embyname=embyname,
-                        item_name=item_name,
-                        is_favorite=is_favorite
-                    )
-            finally:
-                session.close()  # 确保session被关闭
-        else:
-            LOGGER.error(f"操作收藏记录失败")
-            
-        return {
-            "status": "success",
-            "message": "Favorite event processed",
-            "data": response_data
+            "date": webhook_data.get("Date", ""),
+            "queue_depth": webhook_queue.depth
         }
-        
-    except Exception as e:
-        LOGGER.error(f"处理Webhook失败: {str(e)}")
-        return {
-            "status": "error",
-            "message": str(e)
-        }
\ No newline at end of file
+    })
@@ -0,0 +1,100 @@
+"""
+webhook 异步接收队列
+路由只做解析和校验，事件放进有界队列后立即返回 202；固定数量的 worker 从队列取出事件处理，
+数据库查询、Emby 查询、Telegram 发送都不再阻塞 Emby 的 webhook 请求。
+队列满时拒绝新事件（503 + Retry-After），让 Emby 稍后重发，而不是无限堆积在内存里
+"""
+import asyncio
+import json
+import time
+
+from fastapi import Request
+
+from bot import LOGGER
+from bot.func_helper.metrics import registry
+
+# 同时处理的事件数
+workers = 4
+# 队列上限，媒体库扫描时一次涌入几千个 item.added 也能放下
+max_size = 5000
+# 队列满时建议 Emby 多久后重发（秒）
+retry_after = 30
+
+
+async def read_payload(request: Request):
+    """Emby 的 webhook 可能是 json，也可能是 form-data 里的 data 字段"""
+    content_type = request.headers.get("content-type", "").lower()
+    if "application/json" in content_type:
+        return await request.json()
+    form = dict(await request.form())
+    return json.loads(form["data"]) if "data" in form else None
+
+
+class WebhookQueue:
+    def __init__(self, workers: int = workers, max_size: int = max_size):
+        self.workers = workers
+        self.max_size = max_size
+        self._queue = None
+        self._tasks = []
+        self.stats = {'accepted': 0, 'rejected': 0, 'processed': 0, 'failed': 0, 'peak': 0}
+        # 正在处理的事件数、最近一次处理耗时（秒）
+        self.running = 0
+        self.last_duration = 0.0
+
+    def _start(self):
+        # 在第一个请求里创建，保证队列和 worker 属于 uvicorn 所在的事件循环
+        if self._queue is None:
+            self._queue = asyncio.Queue(self.max_size)
+        self._tasks = [t for t in self._tasks if not t.done()]
+        for i in range(len(self._tasks), self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(i)))
+
+    def submit(self, handler, data: dict) -> bool:
+        """
+        放入队列，由 worker 调用 await handler(data)
+        :return: 队列已满时返回 False
+        """
+        self._start()
+        try:
+            self._queue.put_nowait((handler, data, time.monotonic()))
+        except asyncio.QueueFull:
+            self.stats['rejected'] += 1
+            LOGGER.warning(f"webhook 队列已满({self.max_size})，拒绝事件 {data.get('Event', '')}")
+            return False
+        self.stats['accepted'] += 1
+        self.stats['peak'] = max(self.stats['peak'], self._queue.qsize())
+        return True
+
+    async def _worker(self, n: int):
+        while True:
+            handler, data, queued_at = await self._queue.get()
+            start = time.monotonic()
+            self.running += 1
+            try:
+                await handler(data)
+                self.stats['processed'] += 1
+            except Exception as e:
+                self.stats['failed'] += 1
+                LOGGER.error(f"webhook worker{n} 处理 {handler.__name__} 失败: {e}")
+            finally:
+                self.running -= 1
+                self.last_duration = time.monotonic() - start
+                self._queue.task_done()
+            if start - queued_at > 60:
+                LOGGER.warning(f"webhook 事件排队 {start - queued_at:.0f}s 才开始处理，当前队列 {self.depth}")
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def info(self) -> dict:
+        return {'depth': self.depth, 'max_size': self.max_size, 'workers': self.workers, 'running': self.running,
+                'last_duration': round(self.last_duration, 3), **self.stats}
+
+
+webhook_queue = WebhookQueue()
+registry.collector('bot_webhook_queue_depth', 'webhook 队列中等待处理的事件数', lambda: webhook_queue.depth)
+registry.collector('bot_webhook_queue_running', '正在处理的 webhook 事件数', lambda: webhook_queue.running)
+registry.collector('bot_webhook_events_total', 'webhook 事件数，按结果',
+                   lambda: {(('outcome', k),): v for k, v in webhook_queue.stats.items() if k != 'peak'},
+                   kind='counter')
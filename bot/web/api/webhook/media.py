@@ -1,20 +1,20 @@
 from fastapi import APIRouter, Request
-from bot.sql_helper.sql_emby import Emby
-from bot.sql_helper.sql_favorites import EmbyFavorites
-from bot.sql_helper import Session
+from fastapi.responses import JSONResponse
+from bot.sql_helper.sql_favorites import sql_get_favorite_fans
 from bot.func_helper.emby import emby
-from bot import LOGGER, bot
-import json
+from bot import LOGGER
+from bot.func_helper import relay
+from .ingest import webhook_queue, read_payload, retry_after
+from .dedup import webhook_dedup
 
 router = APIRouter()
+# 同一条目的新增事件，首次收到后这段时间（秒）内只处理一次
+dedup_ttl = 6 * 3600
 
 async def send_update_notification_to_user(tg_id: int, message: str):
     """发送通知到指定用户"""
     try:
-        await bot.send_message(
-            chat_id=tg_id,
-            text=message
-        )
+        await relay.send_message(tg_id, message)
         return True
     except Exception as e:
         LOGGER.error(f"发送通知失败: {str(e)}")
@@ -32,81 +32,63 @@ async def check_and_notify_series_update(item_data: dict):
         if not series_id:
             return
             
-        session = Session()
-        try:
-            # 查找收藏了这个剧集的用户
-            favorites = session.query(EmbyFavorites, Emby).join(
-                Emby, EmbyFavorites.embyid == Emby.embyid
-            ).filter(
-                EmbyFavorites.item_id == series_id,
-                Emby.tg.isnot(None)
-            ).all()
+        # 查找收藏了这个剧集的用户
+        fans = await sql_get_favorite_fans([series_id])
+        if fans:
+            message = (
+                f"📺 您喜欢的剧集更新啦\n"
+                f"剧集：《{series_name}》\n"
+                f"季度：{season_name}\n"
+                f"更新：第{episode_number}集 "
+            )
             
-            if favorites:
-                message = (
-                    f"📺 您喜欢的剧集更新啦\n"
-                    f"剧集：《{series_name}》\n"
-                    f"季度：{season_name}\n"
-                    f"更新：第{episode_number}集 "
-                )
-                
-                # 给每个收藏了该剧集的用户发送通知
-                for favorite, user in favorites:
-                    await send_update_notification_to_user(user.tg, message)
-                    LOGGER.info(f"已发送剧集更新通知给用户 {user.tg}: {series_name} - {episode_number}")
-        finally:
-            session.close()
+            # 给每个收藏了该剧集的用户发送通知
+            for tg in {tg for _, tg in fans}:
+                await send_update_notification_to_user(tg, message)
+                LOGGER.info(f"已发送剧集更新通知给用户 {tg}: {series_name} - {episode_number}")
             
     except Exception as e:
         LOGGER.error(f"处理剧集更新通知失败: {str(e)}")
 
 async def check_and_notify_person_update(item_data: dict):
-    """检查并通知演员相关更新"""
+    """检查并通知演员相关更新，无论演职员多少，只查一次库"""
     try:
         # 获取电影/剧集ID
         item_id = item_data.get("Id", "")
         if not item_id:
             return
             
-        # 获取演员信息
-        success, people_list = await emby.item_id_people(item_id)
-        if not success:
+        # 获取演员信息，webhook 里带了 People 就不再请求 Emby
+        people_list = item_data.get("People")
+        if people_list is None:
+            success, people_list = await emby.item_id_people(item_id)
+            if not success:
+                return
+        names = {p["Id"]: p.get("Name") for p in people_list if p.get("Id")}
+
+        # 查找收藏了其中任意演员的用户，按用户归并
+        fans = await sql_get_favorite_fans(list(names))
+        if not fans:
             return
-        session = Session()
-        try:
-            for person in people_list:
-                person_id = person.get("Id")
-                person_name = person.get("Name")
-                
-                if not person_id:
-                    continue
-                    
-                # 查找收藏了这个演员的用户
-                favorites = session.query(EmbyFavorites, Emby).join(
-                    Emby, EmbyFavorites.embyid == Emby.embyid
-                ).filter(
-                    EmbyFavorites.item_id == person_id,
-                    Emby.tg.isnot(None)
-                ).all()
-                
-                if favorites:
-                    # 获取作品信息
-                    item_name = item_data.get("Name", "")
-                    item_type = item_data.get("Type", "")
-                    
-                    message = (
-                        f"🎭 您喜欢的演员有新作品啦\n"
-                        f"演员：{person_name}\n"
-                        f"作品：《{item_name}》\n"
-                        f"类型：{item_type}\n"
-                    )
-                    
-                    # 给每个收藏了该演员的用户发送通知
-                    for favorite, user in favorites:
-                        await send_update_notification_to_user(user.tg, message)
-                        LOGGER.info(f"已发送演员新作品通知给用户 {user.tg}: {person_name} - {item_name}")
-        finally:
-            session.close()
+        persons_of = {}
+        for person_id, tg in fans:
+            persons_of.setdefault(tg, []).append(names[person_id])
+
+        # 获取作品信息
+        item_name = item_data.get("Name", "")
+        item_type = item_data.get("Type", "")
+        
+        # 每个用户只发一条，列出其收藏的全部演员
+        for tg, persons in persons_of.items():
+            person_name = "、".join(dict.fromkeys(persons))
+            message = (
+                f"🎭 您喜欢的演员有新作品啦\n"
+                f"演员：{person_name}\n"
+                f"作品：《{item_name}》\n"
+                f"类型：{item_type}\n"
+            )
+            await send_update_notification_to_user(tg, message)
+            LOGGER.info(f"已发送演员新作品通知给用户 {tg}: {person_name} - {item_name}")
             
     except Exception as e:
         LOGGER.error(f"处理演员更新通知失败: {str(e)}")
@@ -132,77 +114,63 @@ async def send_new_media_notification(item_data: dict):
     except Exception as e:
         LOGGER.error(f"发送新媒体通知失败: {str(e)}")
 
+async def process_media_event(item_data: dict):
+    """队列 worker 中处理一条新增媒体"""
+    if item_data.get("Type", "") == "Episode":
+        # 处理剧集更新
+        await check_and_notify_series_update(item_data)
+    else:
+        # 处理新电影或新剧集
+        await send_new_media_notification(item_data)
+
+
 @router.post("/webhook/medias")
 async def handle_media_webhook(request: Request):
-    """处理Emby媒体库更新webhook"""
+    """接收Emby媒体库更新webhook，新增媒体放入队列后立即返回 202"""
     try:
-        # 检查Content-Type
-        content_type = request.headers.get("content-type", "").lower()
-        
-        if "application/json" in content_type:
-            # 处理JSON格式
-            webhook_data = await request.json()
-        else:
-            # 处理form-data格式
-            form_data = await request.form()
-            form = dict(form_data)
-            webhook_data = json.loads(form["data"]) if "data" in form else None
-            
-        if not webhook_data:
-            return {
-                "status": "error",
-                "message": "No data received"
-            }
-            
-        event = webhook_data.get("Event", "")
-        item_data = webhook_data.get("Item", {})
-        
-        # 处理新增媒体事件
-        if event in ["item.added", "library.new"]:
-            # 检查媒体类型
-            item_type = item_data.get("Type", "")
-            
-            if item_type == "Episode":
-                # 处理剧集更新
-                await check_and_notify_series_update(item_data)
-                return {
-                    "status": "success",
-                    "message": "Episode update notification sent",
-                    "data": {
-                        "type": item_type,
-                        "name": item_data.get("Name"),
-                        "series": item_data.get("SeriesName"),
-                        "event": event
-                    }
-                }
-            elif item_type in ["Movie", "Series"]:
-                # 处理新电影或新剧集
-                await send_new_media_notification(item_data)
-                return {
-                    "status": "success",
-                    "message": "New media notification sent",
-                    "data": {
-                        "type": item_type,
-                        "name": item_data.get("Name"),
-                        "event": event
-                    }
-                }
-                
-            return {
-                "status": "ignored",
-                "message": "Not a new media event",
-                "event": event
-            }
-                
+        webhook_data = await read_payload(request)
+    except Exception as e:
+        LOGGER.error(f"解析媒体库Webhook失败: {str(e)}")
+        return JSONResponse(status_code=400, content={"status": "error", "message": str(e)})
+
+    if not webhook_data:
+        return JSONResponse(status_code=400, content={"status": "error", "message": "No data received"})
+
+    event = webhook_data.get("Event", "")
+    item_data = webhook_data.get("Item") or {}
+    item_type = item_data.get("Type", "")
+
+    # 只处理新增的电影、剧集、单集
+    if event not in ["item.added", "library.new"] or item_type not in ["Episode", "Movie", "Series"]:
         return {
             "status": "ignored",
             "message": "Not a new media event",
             "event": event
         }
-                
-    except Exception as e:
-        LOGGER.error(f"处理媒体库更新失败: {str(e)}")
-        return {
-            "status": "error",
-            "message": str(e)
-        } 
\ No newline at end of file
+
+    if not item_data.get("Id"):
+        return JSONResponse(status_code=400, content={"status": "error", "message": "Missing Item.Id"})
+
+    # item.added 和 library.new 是同一件事；媒体库刷新会在几小时内重复发送同一条目
+    key = webhook_dedup.make_key("new", item_data["Id"], "")
+    if not await webhook_dedup.claim(key, dedup_ttl):
+        return {"status": "duplicate", "message": "Media event already received", "event": event}
+
+    if not webhook_queue.submit(process_media_event, item_data):
+        await webhook_dedup.forget(key)
+        return JSONResponse(status_code=503, headers={"Retry-After": str(retry_after)},
+                            content={"status": "busy", "message": "Webhook queue is full"})
+    data = {"type": item_type, "name": item_data.get("Name"), "event": event, "queue_depth": webhook_queue.depth}
+    if item_type == "Episode":
+        data["series"] = item_data.get("SeriesName")
+    return JSONResponse(status_code=202, content={
+        "status": "accepted",
+        "message": "Media event queued",
+        "data": data
+    })
+
+
+@router.get("/webhook/queue")
+async def webhook_queue_info():
+    """webhook 队列深度、处理和去重统计"""
+    return {**webhook_queue.info(), "dedup": webhook_dedup.info()}
@@ -0,0 +1,15 @@
+"""
+单独运行接口时（web.py）uvicorn 加载的应用，每个工作进程各导入一次
+"""
+import asyncio
+
+from bot.web import check
+from bot.web.api import metrics
+
+check.init_api()
+app = check.app
+
+if metrics.merge_workers:
+    @app.on_event("startup")
+    async def start_metrics_snapshots():
+        asyncio.create_task(metrics.write_snapshots())
@@ -0,0 +1,101 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+从 db_backup 目录恢复数据库：全量备份 + 最近一次增量备份依次导入。
+独立运行，不启动bot，只读取 config.json 中的数据库配置。
+
+    python3 restore_db.py                 # 恢复到最新的备份
+    python3 restore_db.py 2024-01-01-02-30-00   # 恢复到指定时间的备份
+    python3 restore_db.py --dry-run       # 只列出将要导入的文件
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import zlib
+
+chunk_size = 1024 * 1024
+
+
+def load_manifests(backup_dir, database_name):
+    manifests = {}
+    for path in sorted(glob.glob(os.path.join(backup_dir, f'{database_name}-*.manifest.json'))):
+        with open(path, 'r', encoding='utf-8') as f:
+            m = json.load(f)
+            manifests[m['stamp']] = m
+    return manifests
+
+
+def restore_chain(manifests, stamp=None):
+    """要依次导入的清单：增量备份前面加上它依赖的全量"""
+    if not manifests:
+        sys.exit('没有找到备份清单')
+    stamp = stamp or max(manifests)
+    if stamp not in manifests:
+        sys.exit(f'没有 {stamp} 的备份清单')
+    m = manifests[stamp]
+    if m['type'] == 'full':
+        return [m]
+    if m['base'] not in manifests:
+        sys.exit(f'增量备份 {stamp} 依赖的全量备份 {m["base"]} 已不存在')
+    return [manifests[m['base']], m]
+
+
+def verify(backup_dir, m):
+    digest = hashlib.sha256()
+    for name in m['files']:
+        with open(os.path.join(backup_dir, name), 'rb') as f:
+            while data := f.read(chunk_size):
+                digest.update(data)
+    if digest.hexdigest() != m['sha256']:
+        sys.exit(f'{m["stamp"]} 校验失败，文件可能损坏')
+
+
+def mysql_cmd(config):
+    cmd = ['mysql', f'-u{config["db_user"]}', config['db_name']]
+    if config.get('db_is_docker', False) and os.environ.get('DOCKER_MODE') != '1':
+        return ['docker', 'exec', '-i', '-e', 'MYSQL_PWD', config.get('db_docker_name', 'mysql')] + cmd
+    return cmd[:1] + [f'-h{config["db_host"]}', f'-P{config.get("db_port", 3306)}'] + cmd[1:]
+
+
+def replay(backup_dir, m, config):
+    """分卷按顺序解压后直接写入 mysql 的标准输入"""
+    proc = subprocess.Popen(mysql_cmd(config), stdin=subprocess.PIPE,
+                            env={**os.environ, 'MYSQL_PWD': config['db_pwd']})
+    d = zlib.decompressobj(31)
+    try:
+        for name in m['files']:
+            with open(os.path.join(backup_dir, name), 'rb') as f:
+                while data := f.read(chunk_size):
+                    proc.stdin.write(d.decompress(data))
+        proc.stdin.write(d.flush())
+    finally:
+        proc.stdin.close()
+    if proc.wait() != 0:
+        sys.exit(f'导入 {m["stamp"]} 失败, mysql 返回 {proc.returncode}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='从备份恢复bot数据库')
+    parser.add_argument('stamp', nargs='?', help='备份时间，如 2024-01-01-02-30-00，默认最新')
+    parser.add_argument('--config', default='config.json')
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    backup_dir = config.get('db_backup_dir', './db_backup')
+    chain = restore_chain(load_manifests(backup_dir, config['db_name']), args.stamp)
+    for m in chain:
+        print(f'{m["stamp"]} {m["type"]} {m.get("tables") or "全部表"} <- {m["files"]}')
+        if not args.dry_run:
+            verify(backup_dir, m)
+            replay(backup_dir, m, config)
+    print('恢复完成' if not args.dry_run else '预演结束，未导入')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+单独运行 web 接口，配置 api.standalone 为 true 后与 main.py 各自启动：
+    python3 main.py
+    python3 web.py
+两个进程共用配置和数据库；接口要发的 Telegram 消息写入发件箱，由 bot 进程发送。
+api.workers 大于 1 时启动多个 uvicorn 工作进程，webhook 和接口请求可以用上多个核心
+"""
+import os
+
+os.environ['EMBYBOSS_ROLE'] = 'web'
+
+import uvicorn
+
+from bot import api as config_api, LOGGER
+
+if __name__ == '__main__':
+    if not (config_api.status and config_api.standalone):
+        LOGGER.error("【API服务】api.status 和 api.standalone 都开启时才需要单独运行接口")
+        raise SystemExit(1)
+    if config_api.workers > 1 and not config_api.webhook_dedup_db:
+        LOGGER.warning("【API服务】多个工作进程各自去重 webhook，建议开启 api.webhook_dedup_db")
+    LOGGER.info(f"【API服务】单独运行，{config_api.workers} 个工作进程")
+    uvicorn.run('bot.web.app:app', host=config_api.http_url, port=config_api.http_port,
+                workers=config_api.workers)